@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+from time import perf_counter
+
+API_DIR = Path(__file__).resolve().parent
+BENCHMARKS_DIR = API_DIR / 'benchmarks'
+SAMPLES_DIR = API_DIR.parent / 'for tracing'
+
+# a file is run as the session's main.py, a directory is copied as the session directory
+WORKLOADS = {
+    "tight_loop": BENCHMARKS_DIR / 'tight_loop.py',
+    "deep_recursion": BENCHMARKS_DIR / 'deep_recursion.py',
+    "large_locals": BENCHMARKS_DIR / 'large_locals.py',
+    "print_heavy": BENCHMARKS_DIR / 'print_heavy.py',
+    "many_modules": BENCHMARKS_DIR / 'many_modules',
+    "sample_test": SAMPLES_DIR / 'test.py',
+    "sample_try": SAMPLES_DIR / 'try.py'
+}
+
+SESSION = 'benchmark'
+
+# compared against a baseline, True when a larger value is better
+METRICS = {
+    "events_per_second": True,
+    "latency_p50_us": False,
+    "latency_p99_us": False,
+    "db_bytes": False,
+    "ipc_bytes": False,
+    "checkpoint_seconds": False,
+    "checkpoint_bytes": False
+}
+
+STAGES = ('tracer', 'scope', 'serialize', 'branch', 'event', 'store', 'checkpoint', 'output', 'transport')
+
+class StageTimer:
+    # exclusive time per stage, time spent in a stage called from another one only counts for the inner one
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.inclusive = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.stack = []
+
+    def wrap(self, stage: str, function):
+        def timed(*args, **kwargs):
+            self.stack.append(0.0)
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                self.seconds[stage] += elapsed - self.stack.pop()
+                self.inclusive[stage] += elapsed
+                self.calls[stage] += 1
+                if self.stack:
+                    self.stack[-1] += elapsed
+        return timed
+
+def percentile(ordered: list[float], share: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def directory_bytes(path: Path) -> int:
+    if not path.is_dir():
+        return 0
+    return sum(entry.stat().st_size for entry in path.rglob('*') if entry.is_file() and not entry.is_symlink())
+
+def table_bytes(database: Path) -> dict[str, int]:
+    try:
+        with sqlite3.connect(database) as db_connection:
+            return dict(db_connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC").fetchall())
+    except sqlite3.OperationalError:
+        return {} # sqlite built without dbstat
+
+def run_workload(name: str, result_path: Path, checkpoint_every: int | None) -> None:
+    # in a fresh process, the environment set up by run(): settrace keeps its state in module globals
+    from utils.internal_file_communication import serve_ifc, ifc
+    from utils.schema import create_tables
+    from utils.scope_functions import ScopeTracker
+    from utils.sessions import TRACE_HOME, session_dir, session_file
+
+    serve_ifc() # this process stands in for the API
+
+    database = TRACE_HOME / 'trace.db'
+    create_tables(database)
+
+    directory = session_dir(SESSION)
+    source = WORKLOADS[name]
+    if source.is_dir():
+        shutil.copytree(source, directory)
+    else:
+        directory.mkdir(parents=True)
+        shutil.copy(source, directory / 'main.py')
+
+    file = session_file(SESSION)
+    with sqlite3.connect(database) as db_connection:
+        db_connection.execute(
+            "INSERT INTO files (file, branch_id, checkpoint_policy) VALUES (?, 0, ?)",
+            (file, json.dumps({"every_events": checkpoint_every}) if checkpoint_every else None)
+        )
+        db_connection.execute("INSERT INTO branches (file, id, parent_id, fork_id) VALUES (?, 0, NULL, -1)", (file,))
+        db_connection.execute("INSERT INTO sessions (id, file) VALUES (?, ?)", (SESSION, file))
+
+    import settrace
+
+    settrace.mode = 'run' # no breakpoints, so it never pauses
+    settrace.warm_pool.watcher_pid = os.getpid() # parked copies exit with this process
+    # the broker's connection threads stand in for the API process, they would block every checkpoint
+    # as threads of the script
+    settrace.script_threads_running = lambda: any(
+        thread not in settrace.tracer_threads and not thread.name.endswith('(process_request_thread)')
+        for thread in threading.enumerate()
+    )
+
+    timer = StageTimer()
+    latencies = []
+
+    ScopeTracker.update = timer.wrap('scope', ScopeTracker.update)
+    settrace.serialize_data = timer.wrap('serialize', settrace.serialize_data)
+    settrace.handle_data = timer.wrap('event', settrace.handle_data)
+    settrace.take_checkpoint = timer.wrap('checkpoint', settrace.take_checkpoint)
+    settrace.branch_follower.place = timer.wrap('branch', settrace.branch_follower.place)
+    settrace.timeline_writer.flush = timer.wrap('store', settrace.timeline_writer.flush)
+    settrace.output_capture.write = timer.wrap('output', settrace.output_capture.write)
+    settrace.output_capture.poll = timer.wrap('output', settrace.output_capture.poll)
+    ifc._request = timer.wrap('transport', ifc._request)
+
+    use_tracing = settrace.use_tracing
+
+    def timed_tracing(trace_function, should_trace):
+        traced = timer.wrap('tracer', trace_function)
+
+        def timed_trace(frame, event, arg):
+            events = timer.calls['event']
+            started = perf_counter()
+            local_trace = traced(frame, event, arg)
+            if timer.calls['event'] != events: # filtered out calls are not events
+                latencies.append(perf_counter() - started)
+            return timed_trace if local_trace is not None else None
+
+        return use_tracing(timed_trace, should_trace)
+
+    settrace.use_tracing = timed_tracing
+
+    settrace.checkpoints.wipe()
+
+    started = perf_counter()
+    settrace.main((directory / 'main.py').resolve())
+    settrace.timeline_writer.close()
+    settrace.output_capture.flush()
+    seconds = perf_counter() - started
+
+    settrace.warm_pool.clear()
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+    latencies.sort()
+    events = timer.calls['event']
+
+    db_bytes = sum(path.stat().st_size for path in (database, database.with_name('trace.db-wal')) if path.exists())
+    checkpoint_bytes = sum(directory_bytes(path) for path in (directory / 'criu_dumps', directory / '_images', TRACE_HOME / '_objects'))
+
+    result_path.write_text(json.dumps({
+        "workload": name,
+        "events": events,
+        "seconds": seconds,
+        "events_per_second": events / seconds if seconds else 0.0,
+        "latency_p50_us": percentile(latencies, .5) * 1e6,
+        "latency_p90_us": percentile(latencies, .9) * 1e6,
+        "latency_p99_us": percentile(latencies, .99) * 1e6,
+        "latency_max_us": (latencies[-1] if latencies else 0.0) * 1e6,
+        "db_bytes": db_bytes,
+        "db_tables": table_bytes(database),
+        "ipc_bytes": ifc.bytes_sent + ifc.bytes_received,
+        "ipc_requests": timer.calls['transport'],
+        "checkpoints": timer.calls['checkpoint'],
+        "checkpoint_seconds": timer.inclusive['checkpoint'],
+        "checkpoint_bytes": checkpoint_bytes,
+        "stages": {
+            stage: {
+                "seconds": timer.seconds[stage],
+                "calls": timer.calls[stage]
+            }
+            for stage in STAGES
+        }
+    }))
+
+def run(name: str, scale: int, repeat: int, backend: str, checkpoint_every: int | None) -> dict:
+    # the median run by events per second
+    results = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix='trace-benchmark-') as home:
+            result_path = Path(home) / 'result.json'
+            env = {
+                **os.environ,
+                "TRACE_HOME": home,
+                "TRACE_SESSION": SESSION,
+                "CHECKPOINT_BACKEND": backend,
+                "WARM_POOL_SIZE": os.environ.get('WARM_POOL_SIZE', '0'),
+                "BENCH_SCALE": str(scale)
+            }
+            command = [sys.executable, str(Path(__file__).resolve()), '--child', name, '--result', str(result_path)]
+            if checkpoint_every:
+                command += ['--checkpoint-every', str(checkpoint_every)]
+            subprocess.run(command, env=env, cwd=API_DIR, check=True)
+            results.append(json.loads(result_path.read_text()))
+    results.sort(key=lambda result: result['events_per_second'])
+    return results[len(results) // 2]
+
+def print_result(result: dict) -> None:
+    print(
+        f"{result['workload']:<16}"
+        f"{result['events']:>9} events"
+        f"{result['events_per_second']:>11.0f}/s"
+        f"   p50 {result['latency_p50_us']:>7.1f}us"
+        f"   p99 {result['latency_p99_us']:>8.1f}us"
+        f"   db {result['db_bytes'] / 1024:>8.1f}KiB"
+        f"   ipc {result['ipc_bytes'] / 1024:>8.1f}KiB"
+        f"   {result['checkpoints']} checkpoints {result['checkpoint_seconds'] * 1000:.1f}ms {result['checkpoint_bytes'] / 1024:.1f}KiB"
+    )
+    total = sum(stage['seconds'] for stage in result['stages'].values()) or 1.0
+    print(' ' * 16 + '  '.join(
+        f"{stage} {100 * values['seconds'] / total:.0f}%"
+        for stage, values in result['stages'].items()
+        if values['calls']
+    ))
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    # the regressions, one line each
+    regressions = []
+    print(f"\ncompared with the baseline, a change beyond {threshold:.0%} in the wrong direction is a regression")
+    for name, result in results.items():
+        if (before := baseline.get('results', {}).get(name)) is None:
+            continue
+        changes = []
+        for metric, larger_is_better in METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if larger_is_better else change
+            mark = ''
+            if worse > threshold:
+                mark = ' !'
+                regressions.append(f"{name} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+            changes.append(f"{metric} {change:+.1%}{mark}")
+        print(f"{name:<16}" + '   '.join(changes))
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Runs workloads through settrace.py and reports what tracing them costs.")
+    parser.add_argument('workloads', nargs='*', help=f"any of {', '.join(WORKLOADS)}, all of them by default")
+    parser.add_argument('--scale', type=int, default=1, help="multiplies each workload's iterations")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per workload, the median one is reported")
+    parser.add_argument('--backend', choices=('stub', 'fork', 'criu'), default='stub', help="checkpoint backend, criu needs root")
+    parser.add_argument('--checkpoint-every', type=int, help="a checkpoint every N events instead of the tracer's default policy")
+    parser.add_argument('--save', type=Path, help="write the results as JSON, e.g. a baseline")
+    parser.add_argument('--baseline', type=Path, help="compare with results written by --save")
+    parser.add_argument('--threshold', type=float, default=.1, help="relative change counted as a regression")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_workload(args.child, args.result, args.checkpoint_every)
+        return 0
+
+    if unknown := set(args.workloads) - set(WORKLOADS):
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.workloads or WORKLOADS:
+        results[name] = run(name, args.scale, args.repeat, args.backend, args.checkpoint_every)
+        print_result(results[name])
+
+    if args.save:
+        args.save.write_text(json.dumps({
+            "python": platform.python_version(),
+            "backend": args.backend,
+            "scale": args.scale,
+            "checkpoint_every": args.checkpoint_every,
+            "results": results
+        }, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if (baseline.get('backend'), baseline.get('scale'), baseline.get('checkpoint_every')) != (args.backend, args.scale, args.checkpoint_every):
+            print("the baseline was recorded with other settings, the numbers are not comparable", file=sys.stderr)
+        if regressions := compare(results, baseline, args.threshold):
+            print("\nregressions:\n" + '\n'.join(regressions))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+import os
+
+SCALE = int(os.environ.get('BENCH_SCALE', 1))
+
+def depth(n):
+    if n == 0:
+        return 0
+    return depth(n - 1) + 1
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+for _ in range(2 * SCALE):
+    depth(400)
+
+print(fib(12 + SCALE.bit_length()))
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+import os
+
+SCALE = int(os.environ.get('BENCH_SCALE', 1))
+
+def grow(rows):
+    table = {}
+    names = []
+    for i in range(rows):
+        names.append(f'name {i}')
+        table[i] = {"name": names[-1], "values": list(range(i % 50))}
+    return len(table)
+
+def rewrite(size):
+    buffer = list(range(size))
+    for i in range(50):
+        buffer[i] = -buffer[i]
+    return sum(buffer)
+
+for _ in range(SCALE):
+    grow(300)
+    rewrite(5000)
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+
+import os
+
+from parts import alpha, beta, gamma, delta, epsilon, zeta
+
+SCALE = int(os.environ.get('BENCH_SCALE', 1))
+
+total = 0
+for i in range(50 * SCALE):
+    total += alpha.run(i) + beta.run(i) + gamma.run(i) + delta.run(i) + epsilon.run(i) + zeta.run(i)
+
+print(total)
@@ -0,0 +1,4 @@
+from parts.common import scale
+
+def run(value):
+    return scale(value, 6) % 97
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+
+import os
+
+SCALE = int(os.environ.get('BENCH_SCALE', 1))
+
+for i in range(500 * SCALE):
+    print(f'line {i}: ' + 'x' * (i % 80))
+    if i % 100 == 0:
+        print('progress', i, flush=True)
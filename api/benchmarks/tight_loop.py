@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+
+import os
+
+SCALE = int(os.environ.get('BENCH_SCALE', 1))
+
+total = 0
+for i in range(2000 * SCALE):
+    total += i * i % 7
+
+print(total)
@@ -1,88 +1,64 @@
-
 import asyncio
 import json
+import os
+import shutil
 import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from fastapi import FastAPI, UploadFile, File, Response, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 from pathlib import Path
 
-from utils.internal_file_communication import ifc
+from utils.internal_file_communication import serve_ifc
+from utils.breakpoints import Breakpoints
+from utils.checkpoints import CheckpointPolicy
+from utils.trace_filter import TraceFilter
+from utils.retention import RetentionPolicy, ROW_BYTES
+from utils.keyframes import apply_diff
+from utils.ast_functions import source_index
+from utils.content_store import BlobReader, ObjectStore, collect_blobs
+from utils.branches import BRANCH_PATH, ON_PATH, ROOT_BRANCH, branch_path, shared_until
+from utils.schema import create_tables, json_items
+from utils.profiling import Profile
+from utils.line_stats import path_line_stats
+from utils.frames import frame_on_path
+from utils.checkpoint_backends import CHECKPOINT_BACKEND
+from utils.sessions import TRACE_HOME, DEFAULT_SESSION, TracerScheduler, valid_session_id, session_dir, session_channels, session_file
 
 import sqlite3
 
-DATABASE = Path.cwd() / 'trace.db'
+DATABASE = TRACE_HOME / 'trace.db'
 
-def create_tables():
-    with sqlite3.connect(DATABASE) as db_connection:
-        db_connection.executescript('''
-            CREATE TABLE IF NOT EXISTS files (
-                file TEXT NOT NULL,
-                
-                timeline_id INTEGER,    -- timeline pointer
-                line_number INTEGER,    -- node pointer
-                
-                PRIMARY KEY (file)
-            );
-            
-            CREATE TABLE IF NOT EXISTS state (
-                id INTEGER CHECK (id = 1),
-                
-                file TEXT,    -- file pointer
+def collect_garbage() -> None:
+    with sqlite3.connect(DATABASE, timeout=30) as db_connection:
+        if removed := collect_blobs(db_connection):
+            print(f"[GC] {removed} blobs", flush=True)
 
-                PRIMARY KEY (id)
-                
-                FOREIGN KEY (file)
-                    REFERENCES files(file)
-                    ON DELETE SET NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS timeline (
-                file TEXT NOT NULL,
-                id INTEGER NOT NULL,
-                
-                event TEXT,
-                target TEXT,
-                return_value TEXT,
-                frame_id INTEGER,
-                function TEXT,
-                line_number INTEGER,
-                source_segment TEXT,
-                global_diff TEXT,   -- JSON
-                local_diff TEXT,    -- JSON
-                traceback TEXT,
-                error TEXT,
-                
-                -- +? time_taken REAL
-
-                -- +? sha256 TEXT UNIQUE
-                -- +? last_sha256 TEXT
-                
-                PRIMARY KEY (file, id),
-                
-                FOREIGN KEY (file)
-                    REFERENCES files(file)
-                    ON DELETE CASCADE
-            )
-        ''')
+create_tables(DATABASE)
 
-create_tables()
+# every tracer writes here, each message carries its session id
+_app_to_server = str(TRACE_HOME / '_app_to_server.txt')
+open(_app_to_server, "w").close()
 
-for name in (
-    '_app_to_server',
-    '_server_to_app',
-    '_watcher',
-):
-    file_txt = Path.cwd() / f'{name}.txt'
-    globals()[name] = str(file_txt)
-    open(str(file_txt), "w").close()
+ifc = serve_ifc()
 
 app = FastAPI(
     openapi_url=None
 )
 
-watcher_process = None
-needs_to_sync = False
+MAX_TRACERS = int(os.environ.get('MAX_TRACERS', 4))
+
+scheduler = TracerScheduler(MAX_TRACERS, privileged=CHECKPOINT_BACKEND == 'criu')
+
+blocking_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="blocking")
+
+async def run_blocking(function, *args, **kwargs):
+    # sqlite, IFC and file work never runs on the event loop
+    return await asyncio.get_running_loop().run_in_executor(blocking_pool, partial(function, *args, **kwargs))
 
 app.add_middleware(
     CORSMiddleware,
@@ -91,29 +67,478 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/api/sync")
-async def app_sync() -> dict:
+TIMELINE_COLUMNS = (
+    "id", "branch_id", "event", "target", "return_value", "file",
+    "frame_id", "function", "line_number", "source_segment",
+    "global_diff", "local_diff", "traceback", "error", "output",
+    "time_taken", "cpu_time", "thread_id", "checkpoint", "parked"
+)
+
+PROFILE_COLUMNS = ("id", "event", "target", "frame_id", "line_number", "source_file", "time_taken", "cpu_time", "thread_id")
+
+def timeline_rows(cursor, file: str, branch_id: int, after_id: int, until_id: int | None, limit: int | None = None, chunk_size: int = 1000, columns: tuple = TIMELINE_COLUMNS, **filters):
+    # one range query per segment of the branch's path, so rows stream in id order straight from the index;
+    # filters are column equalities (line_number, frame_id, function), each backed by an index
+    conditions = ''.join(f"AND {column} = :{column}\n" for column in filters if column in TIMELINE_COLUMNS)
+    
+    until_id = (1 << 63) - 1 if until_id is None else until_id
+    remaining = -1 if limit is None else limit
+    
+    blobs = BlobReader(cursor.connection)
+    
+    for segment_branch_id, first_id, last_id in branch_path(cursor, file, branch_id):
+        if remaining == 0:
+            return
+        if last_id <= after_id or first_id > until_id:
+            continue
+        
+        cursor.execute(
+            f"""
+            SELECT  {', '.join(columns)}
+            FROM timeline
+            WHERE file == :file
+              AND branch_id = :branch_id
+              AND id > :after_id
+              AND id <= :until_id
+              {conditions}
+            ORDER BY id ASC
+            LIMIT :limit
+            """,
+            {
+                "file": file,
+                "branch_id": segment_branch_id,
+                "after_id": max(after_id, first_id - 1),
+                "until_id": min(until_id, last_id),
+                "limit": remaining,
+                **filters
+            }
+        )
+        
+        while rows := cursor.fetchmany(chunk_size):
+            for row in rows:
+                row = dict(zip(columns, row))
+                if "global_diff" in row:
+                    row["global_diff"] = blobs.expand(row["global_diff"])
+                    row["local_diff"] = blobs.expand(row["local_diff"])
+                remaining -= 1
+                yield row
+
+@app.get("/api/sessions/{session_id}/timeline")
+def app_timeline(session_id: str, after_id: int = -1, limit: int = 1000) -> StreamingResponse:
+    db_connection = sqlite3.connect(DATABASE)
+    cursor = db_connection.cursor()
+    
+    cursor.execute(
+        """
+        SELECT files.file, files.branch_id, files.timeline_id
+        FROM sessions
+        JOIN files ON files.file = sessions.file
+        WHERE sessions.id = :session
+        """,
+        {
+            "session": session_id
+        }
+    )
+    
+    if row := cursor.fetchone():
+        file, branch_id, timeline_id = row
+    else:
+        db_connection.close()
+        raise HTTPException(status_code=404, detail="no pointer to a file")
+    
+    def ndjson():
+        try:
+            for row in timeline_rows(cursor, file, branch_id, after_id, timeline_id, limit):
+                yield json.dumps(row) + "\n"
+        finally:
+            db_connection.close()
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+def current_file(cursor, session_id: str) -> str:
+    cursor.execute(
+        """
+        SELECT file
+        FROM sessions
+        WHERE id = :session
+        """,
+        {
+            "session": session_id
+        }
+    )
+    
+    if (row := cursor.fetchone()) and row[0] is not None:
+        return row[0]
+    
+    raise HTTPException(status_code=404, detail="no pointer to a file")
+
+def current_branch(cursor, session_id: str) -> tuple[str, int]:
+    cursor.execute(
+        """
+        SELECT files.file, files.branch_id
+        FROM sessions
+        JOIN files ON files.file = sessions.file
+        WHERE sessions.id = :session
+        """,
+        {
+            "session": session_id
+        }
+    )
+    
+    if row := cursor.fetchone():
+        return row
+    
+    raise HTTPException(status_code=404, detail="no pointer to a file")
+
+@app.get("/api/sessions/{session_id}/line_events")
+def app_line_events(session_id: str, line_number: int, after_id: int = -1, limit: int = 1000) -> list[dict]:
     with sqlite3.connect(DATABASE) as db_connection:
         cursor = db_connection.cursor()
         
-        cursor.execute("PRAGMA foreign_keys = ON;")
+        return list(timeline_rows(cursor, *current_branch(cursor, session_id), after_id, None, limit, line_number=line_number))
+
+@app.get("/api/sessions/{session_id}/function_frames")
+def app_function_frames(session_id: str, function: str) -> list[dict]:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file, branch_id = current_branch(cursor, session_id)
         
         cursor.execute(
-            """
-            SELECT file
-            FROM state
-            WHERE id = 1
-            """
+            f"""
+            {BRANCH_PATH}
+            SELECT frame_id, MIN(id), MAX(id), COUNT(*)
+            FROM path
+            {ON_PATH.format(table="timeline", id="id")}
+            WHERE function = :function
+            GROUP BY frame_id
+            ORDER BY MIN(id) ASC
+            """,
+            {
+                "file": file,
+                "branch_id": branch_id,
+                "function": function
+            }
+        )
+        
+        return [
+            {
+                "frame_id": frame_id,
+                "first_id": first_id,
+                "last_id": last_id,
+                "events": events
+            }
+            for frame_id, first_id, last_id, events in cursor.fetchall()
+        ]
+
+NAVIGATION = ("step_over", "step_out", "caller")
+
+def row_after(cursor, file: str, branch_id: int, timeline_id: int, **filters) -> dict | None:
+    # the first row of the path after timeline_id, retention can leave gaps
+    return next(timeline_rows(cursor, file, branch_id, timeline_id, None, 1, columns=("id", "event", "frame_id", "thread_id"), **filters), None)
+
+def frame_left(cursor, file: str, branch_id: int, frame: dict, timeline_id: int) -> int | None:
+    # where a frame entered or resumed at timeline_id hands control back: its return, or the next
+    # suspend of a generator or coroutine
+    if not frame['suspends']:
+        return frame['end_event']
+    
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT MIN(timeline.id)
+        FROM path
+        {ON_PATH.format(table="timeline", id="id")}
+        WHERE timeline.frame_id = :frame_id
+          AND timeline.id > :timeline_id
+          AND timeline.event IN ('suspend', 'return')
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id,
+            "frame_id": frame['id'],
+            "timeline_id": timeline_id
+        }
+    )
+    
+    return cursor.fetchone()[0]
+
+def event_at_depth(cursor, file: str, branch_id: int, timeline_id: int, depth: int, thread_id: int) -> int | None:
+    # the thread's first event after timeline_id in a frame at most depth deep, whole calls made in between are skipped
+    row = row_after(cursor, file, branch_id, timeline_id, thread_id=thread_id)
+    while row is not None:
+        frame = frame_on_path(cursor, file, branch_id, row['frame_id'])
+        if frame is None or frame['depth'] <= depth:
+            return row['id']
+        if (left := frame_left(cursor, file, branch_id, frame, row['id'])) is None:
+            return None
+        row = row_after(cursor, file, branch_id, left, thread_id=thread_id)
+    return None
+
+@app.get("/api/sessions/{session_id}/navigate")
+def app_navigate(session_id: str, timeline_id: int, action: str) -> dict:
+    # the timeline id to jump to, None when the stored path does not get there (yet);
+    # a few frames lookups instead of scanning the timeline for matching frame_ids
+    if action not in NAVIGATION:
+        raise HTTPException(status_code=400, detail=f"action must be one of {', '.join(NAVIGATION)}")
+    
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file, branch_id = current_branch(cursor, session_id)
+        
+        if (row := row_after(cursor, file, branch_id, timeline_id - 1)) is None or row['id'] != timeline_id:
+            raise HTTPException(status_code=404, detail="no such timeline id on the current branch")
+        
+        if (frame := frame_on_path(cursor, file, branch_id, row['frame_id'])) is None:
+            raise HTTPException(status_code=404, detail="the frame was recorded without frame ids")
+        
+        target = None
+        
+        match action:
+            case "step_over":
+                # the next event of this frame or, once it returned, of its caller
+                target = event_at_depth(cursor, file, branch_id, timeline_id, frame['depth'], row['thread_id'])
+            case "step_out":
+                # the caller's next event after this frame returned
+                if (left := frame_left(cursor, file, branch_id, frame, timeline_id)) is not None:
+                    target = event_at_depth(cursor, file, branch_id, left, frame['depth'] - 1, row['thread_id'])
+            case "caller":
+                # the caller's last event before the call
+                if frame['parent_id'] is not None:
+                    cursor.execute(
+                        f"""
+                        {BRANCH_PATH}
+                        SELECT MAX(timeline.id)
+                        FROM path
+                        {ON_PATH.format(table="timeline", id="id")}
+                        WHERE timeline.frame_id = :frame_id
+                          AND timeline.id < :start_event
+                        """,
+                        {
+                            "file": file,
+                            "branch_id": branch_id,
+                            "frame_id": frame['parent_id'],
+                            "start_event": frame['start_event']
+                        }
+                    )
+                    target, = cursor.fetchone()
+        
+        return {
+            "timeline_id": target,
+            "frame": frame
+        }
+
+@app.get("/api/sessions/{session_id}/variable_history")
+def app_variable_history(session_id: str, name: str, scope: str | None = None, after_id: int = -1, limit: int = 1000) -> list[dict]:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file, branch_id = current_branch(cursor, session_id)
+        
+        cursor.execute(
+            f"""
+            {BRANCH_PATH}
+            SELECT variable_changes.timeline_id, variable_changes.scope, variable_changes.value,
+                   timeline.line_number, timeline.function, timeline.frame_id
+            FROM path
+            {ON_PATH.format(table="variable_changes", id="timeline_id")}
+            JOIN timeline
+              ON timeline.file = variable_changes.file
+             AND timeline.branch_id = variable_changes.branch_id
+             AND timeline.id = variable_changes.timeline_id
+            WHERE variable_changes.name = :name
+              AND variable_changes.timeline_id > :after_id
+              {"AND variable_changes.scope = :scope" if scope else ""}
+            ORDER BY variable_changes.timeline_id ASC
+            LIMIT :limit
+            """,
+            {
+                "file": file,
+                "branch_id": branch_id,
+                "name": name,
+                "scope": scope,
+                "after_id": after_id,
+                "limit": limit
+            }
+        )
+        
+        blobs = BlobReader(db_connection)
+        
+        return [
+            {
+                "timeline_id": timeline_id,
+                "scope": scope,
+                "value": blobs.expand(value),
+                "line_number": line_number,
+                "function": function,
+                "frame_id": frame_id
+            }
+            for timeline_id, scope, value, line_number, function, frame_id in cursor.fetchall()
+        ]
+
+@app.get("/api/sessions/{session_id}/scope")
+def app_scope(session_id: str, timeline_id: int) -> dict:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file, branch_id = current_branch(cursor, session_id)
+        
+        cursor.execute(
+            f"""
+            {BRANCH_PATH}
+            SELECT keyframes.timeline_id, keyframes.globals, keyframes.locals, keyframes.return_value, keyframes.error
+            FROM path
+            {ON_PATH.format(table="keyframes", id="timeline_id")}
+            WHERE keyframes.timeline_id <= :timeline_id
+            ORDER BY keyframes.timeline_id DESC
+            LIMIT 1
+            """,
+            {
+                "file": file,
+                "branch_id": branch_id,
+                "timeline_id": timeline_id
+            }
         )
         
+        scope = {
+            "event": None,
+            "file": None,
+            "function": None,
+            "frame_id": None,
+            "line_number": None,
+            "globals": {},
+            "locals": {},
+            "return_value": None,
+            "error": None
+        }
+        
         if row := cursor.fetchone():
-            file, = row
+            keyframe_id, globals_json, locals_json, scope["return_value"], scope["error"] = row
+            blobs = BlobReader(db_connection)
+            scope["globals"] = json.loads(blobs.expand(globals_json))
+            scope["locals"] = json.loads(blobs.expand(locals_json))
         else:
-            raise HTTPException(status_code=404, detail="no pointer to a file")
+            keyframe_id = -1
+        
+        row = None
+        
+        # the keyframe's own row is re-applied for its event fields, applying a diff twice is harmless
+        for row in timeline_rows(cursor, file, branch_id, keyframe_id - 1, timeline_id):
+            for key in ("event", "file", "function", "frame_id", "line_number"):
+                scope[key] = row[key]
+            
+            apply_diff(scope["globals"], dict(json_items(row["global_diff"])))
+            apply_diff(scope["locals"], dict(json_items(row["local_diff"])))
+            
+            if row["return_value"] is not None:
+                scope["return_value"] = row["return_value"]
+            if row["error"] is not None:
+                scope["error"] = row["error"]
+        
+        if row is None or row["id"] != timeline_id:
+            raise HTTPException(status_code=404, detail="no such timeline_id")
+        
+        return scope
+
+@app.get("/api/sessions/{session_id}/console")
+def app_console(session_id: str, timeline_id: int) -> list[list[str]]:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file, branch_id = current_branch(cursor, session_id)
+        
+        cursor.execute(
+            f"""
+            {BRANCH_PATH}
+            SELECT output
+            FROM path
+            {ON_PATH.format(table="timeline", id="id")}
+            WHERE timeline.id <= :timeline_id
+              AND output IS NOT NULL
+            ORDER BY timeline.id ASC
+            """,
+            {
+                "file": file,
+                "branch_id": branch_id,
+                "timeline_id": timeline_id
+            }
+        )
+        
+        # everything the script printed up to this step, consecutive chunks of a stream merged
+        console = []
+        for output, in cursor.fetchall():
+            for stream, text in json.loads(output):
+                if console and console[-1][0] == stream:
+                    console[-1][1] += text
+                else:
+                    console.append([stream, text])
+        
+        return console
+
+@app.get("/api/sessions/{session_id}/branches")
+def app_branches(session_id: str) -> list[dict]:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
         
         cursor.execute(
             """
-            SELECT timeline_id, line_number
+            SELECT branches.id, branches.parent_id, branches.fork_id, MIN(timeline.id), MAX(timeline.id), COUNT(timeline.id),
+                   json_group_array(timeline.id) FILTER (WHERE timeline.checkpoint IS NOT NULL OR timeline.parked IS NOT NULL)
+            FROM branches
+            LEFT JOIN timeline
+              ON timeline.file = branches.file
+             AND timeline.branch_id = branches.id
+            WHERE branches.file = :file
+            GROUP BY branches.id
+            ORDER BY branches.id ASC
+            """,
+            {
+                "file": current_file(cursor, session_id)
+            }
+        )
+        
+        # own rows only, everything up to fork_id is read through the parent; resumable lists the ids
+        # with a checkpoint image or a parked copy, parked copies only last until the pool evicts them
+        return [
+            {
+                "branch_id": branch_id,
+                "parent_id": parent_id,
+                "fork_id": fork_id,
+                "first_id": first_id,
+                "last_id": last_id,
+                "events": events,
+                "resumable": sorted(json.loads(resumable))
+            }
+            for branch_id, parent_id, fork_id, first_id, last_id, events, resumable in cursor.fetchall()
+        ]
+
+@app.get("/api/sessions/{session_id}/profile")
+def app_profile(session_id: str, until_id: int | None = None, limit: int | None = 100) -> dict:
+    # where the traced script spent its time along the current branch, thinned out events are missing from it
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        profile = Profile()
+        
+        for row in timeline_rows(cursor, *current_branch(cursor, session_id), -1, until_id, columns=PROFILE_COLUMNS):
+            profile.add(row)
+        
+        return profile.to_dict(limit)
+
+@app.get("/api/sessions/{session_id}/sync")
+def app_sync(session_id: str, after_id: int = -1, limit: int | None = None, branch_id: int | None = None) -> dict:
+    # branch_id is the branch the client's rows up to after_id came from
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        file = current_file(cursor, session_id)
+        
+        cursor.execute(
+            """
+            SELECT timeline_id, branch_id, line_number, checkpoint_policy, trace_filter, retention_policy
             FROM files
             WHERE file = :file
             """,
@@ -123,161 +548,379 @@ async def app_sync() -> dict:
         )
         
         if row := cursor.fetchone():
-            timeline_id, node_id = row
+            timeline_id, current_branch_id, node_id, checkpoint_policy, trace_filter, retention_policy = row
         else:
             raise HTTPException(status_code=404, detail="no last IDs for this file")
 
         timeline = []
         
         if timeline_id is not None:
-            cursor.execute(
-                """
-                SELECT  id, event, target, return_value, file,
-                        frame_id, function, line_number, source_segment,
-                        global_diff, local_diff, traceback, error
-                FROM timeline
-                WHERE id <= :id
-                  AND file == :file
-                ORDER BY id ASC
-                """,
-                {
-                    "id": timeline_id,
-                    "file": file
-                }
-            )
+            after_id = min(after_id, timeline_id)
             
-            if rows := cursor.fetchall():
-                timeline = [
-                    {
-                        "id": row[0],
-                        "event": row[1],
-                        "target":   row[2],
-                        "return_value": row[3],
-                        "file": row[4],
-                        "frame_id": row[5],
-                        "function": row[6],
-                        "line_number": row[7],
-                        "source_segment": row[8],
-                        "global_diff": row[9],
-                        "local_diff": row[10],
-                        "traceback": row[11],
-                        "error": row[12]
-                    }
-                    for row in rows
-                ]
-            else:
+            if branch_id is not None and branch_id != current_branch_id:
+                # only the part both paths share is still valid on the client
+                after_id = min(after_id, shared_until(branch_path(cursor, file, branch_id), branch_path(cursor, file, current_branch_id)))
+            
+            timeline = list(timeline_rows(cursor, file, current_branch_id, after_id, timeline_id, limit))
+            
+            if not timeline and after_id < timeline_id and limit != 0:
                 raise HTTPException(status_code=400, detail='no timeline for this timeline_id')
+        
+        cursor.execute(
+            """
+            SELECT spec
+            FROM breakpoints
+            WHERE file = :file
+            ORDER BY id ASC
+            """,
+            {
+                "file": file
+            }
+        )
+        
+        breakpoints = [json.loads(spec) for spec, in cursor.fetchall()]
     
         return {
-            "nodes": nodes_from_file(timeline_id=timeline_id),
+            "nodes": nodes_from_file(session_id, file, timeline_id=timeline_id, branch_id=current_branch_id),
             "node_id": node_id,
             "timeline": timeline,
-            "timeline_id": timeline_id
+            "after_id": after_id, # the client keeps rows up to here and drops the rest after timeline_id
+            "timeline_id": timeline_id,
+            "branch_id": current_branch_id,
+            "breakpoints": breakpoints,
+            "checkpoint_policy": CheckpointPolicy.from_dict(checkpoint_policy and json.loads(checkpoint_policy)).to_dict(),
+            "trace_filter": TraceFilter.from_dict(trace_filter and json.loads(trace_filter)).to_dict(),
+            "retention_policy": RetentionPolicy.from_dict(retention_policy and json.loads(retention_policy)).to_dict()
         }
 
-def ensure_watcher_running():
-    global watcher_process, needs_to_sync
+def save_breakpoints(session_id: str, specs: list[dict]) -> None:
+    Breakpoints(specs) # raises on a bad condition expression
     
-    restart_needed = watcher_process is None or watcher_process.poll() is not None
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        file = current_file(cursor, session_id)
+        
+        cursor.execute(
+            """
+            DELETE FROM breakpoints
+            WHERE file = :file
+            """,
+            {
+                "file": file
+            }
+        )
+        
+        cursor.executemany(
+            """
+            INSERT INTO breakpoints (file, id, spec)
+            VALUES (:file, :id, :spec)
+            """,
+            [
+                {
+                    "file": file,
+                    "id": idx,
+                    "spec": json.dumps(spec)
+                }
+                for idx, spec in enumerate(specs)
+            ]
+        )
 
-    if restart_needed:
-        timeline_id, node_id = None, None
+def save_checkpoint_policy(session_id: str, config: dict) -> None:
+    config = CheckpointPolicy.from_dict(config).to_dict()
+    
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
         
-        with sqlite3.connect(DATABASE) as db_connection:
-            cursor = db_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        cursor.execute(
+            """
+            UPDATE files
+            SET checkpoint_policy = :checkpoint_policy
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+            """,
+            {
+                "session": session_id,
+                "checkpoint_policy": json.dumps(config)
+            }
+        )
+        
+        if not cursor.rowcount:
+            raise ValueError("no pointer to a file")
+
+def save_trace_filter(session_id: str, config: dict) -> None:
+    config = TraceFilter.from_dict(config).to_dict()
+    
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        cursor.execute(
+            """
+            UPDATE files
+            SET trace_filter = :trace_filter
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+            """,
+            {
+                "session": session_id,
+                "trace_filter": json.dumps(config)
+            }
+        )
+        
+        if not cursor.rowcount:
+            raise ValueError("no pointer to a file")
+
+def save_retention_policy(session_id: str, config: dict) -> None:
+    config = RetentionPolicy.from_dict(config).to_dict()
+    
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        cursor.execute(
+            """
+            UPDATE files
+            SET retention_policy = :retention_policy
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+            """,
+            {
+                "session": session_id,
+                "retention_policy": json.dumps(config)
+            }
+        )
+        
+        if not cursor.rowcount:
+            raise ValueError("no pointer to a file")
+
+def directory_bytes(directory: Path) -> int:
+    total = 0
+    for parent, _, filenames in os.walk(directory):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(parent, name)).st_size
+            except OSError:
+                pass
+    return total
+
+@app.get("/api/sessions/{session_id}/storage")
+def app_storage(session_id: str) -> dict:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        file = current_file(cursor, session_id)
+        
+        cursor.execute(
+            f"""
+            SELECT COUNT(*), MIN(id), MAX(id), MIN(recorded_at), IFNULL(SUM({ROW_BYTES}), 0), COUNT(checkpoint), COUNT(parked)
+            FROM timeline
+            WHERE file = :file
+            """,
+            {
+                "file": file
+            }
+        )
+        
+        events, first_id, last_id, oldest, timeline_bytes, checkpoints, parked = cursor.fetchone()
+        
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM keyframes
+            WHERE file = :file
+            """,
+            {
+                "file": file
+            }
+        )
+        
+        keyframes, = cursor.fetchone()
+        
+        cursor.execute(
+            """
+            SELECT retention_policy
+            FROM files
+            WHERE file = :file
+            """,
+            {
+                "file": file
+            }
+        )
+        
+        retention_policy, = cursor.fetchone()
+        
+        cursor.execute("SELECT COUNT(*), IFNULL(SUM(length(data)), 0), IFNULL(SUM(size), 0) FROM blobs")
+        
+        blobs, blob_bytes, blob_raw_bytes = cursor.fetchone()
+        
+        page_size, = cursor.execute("PRAGMA page_size").fetchone()
+        page_count, = cursor.execute("PRAGMA page_count").fetchone()
+        freelist_count, = cursor.execute("PRAGMA freelist_count").fetchone()
+    
+    directory = session_dir(session_id)
+    
+    return {
+        "file": file,
+        "events": events, # rows kept, thinned history included
+        "first_id": first_id,
+        "last_id": last_id,
+        "oldest_recorded_at": oldest,
+        "timeline_bytes": timeline_bytes, # estimate, see ROW_BYTES
+        "keyframes": keyframes,
+        "checkpoints": checkpoints,
+        "parked": parked, # steps with a copy in the warm pool
+        "retention_policy": RetentionPolicy.from_dict(retention_policy and json.loads(retention_policy)).to_dict(),
+        # shared by every session
+        "database": {
+            "bytes": page_size * page_count,
+            "free_bytes": page_size * freelist_count,
+            "blobs": blobs,
+            "blob_bytes": blob_bytes,
+            "blob_raw_bytes": blob_raw_bytes
+        },
+        "images": {
+            "unpacked_bytes": directory_bytes(directory / "criu_dumps"),
+            "manifests": len(list((directory / "_images").glob("*.json"))),
+            "store_bytes": directory_bytes(ObjectStore().root) # shared by every session
+        }
+    }
+
+prepared_sessions = set()
+prepare_lock = threading.Lock()
+
+def prepare_session(session_id: str) -> dict[str, str]:
+    # the session directory holds the uploaded script, its inbound channels and the tracer's CRIU images
+    if not valid_session_id(session_id):
+        raise HTTPException(status_code=400, detail="invalid session id")
+    
+    channels = session_channels(session_id)
+    
+    with prepare_lock:
+        if session_id not in prepared_sessions:
+            directory = session_dir(session_id)
+            directory.mkdir(parents=True, exist_ok=True)
+            
+            legacy_script = TRACE_HOME / "shared" / "main.py"
+            if session_id == DEFAULT_SESSION and legacy_script.exists() and not (directory / "main.py").exists():
+                shutil.copyfile(legacy_script, directory / "main.py")
             
-            cursor.execute("PRAGMA foreign_keys = ON;")
+            for channel in channels.values():
+                open(channel, "w").close()
             
+            prepared_sessions.add(session_id)
+    
+    return channels
+
+def ensure_watcher_running(session_id: str):
+    if scheduler.start(session_id, partial(start_watcher, session_id)):
+        request_sync(session_id)
+        print(f"[SSS {session_id}]", flush=True)
+
+def start_watcher(session_id: str) -> subprocess.Popen:
+    channels = prepare_session(session_id)
+    
+    timeline_id, node_id = None, None
+    
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
+        cursor.execute("PRAGMA foreign_keys = ON;")
+        
+        cursor.execute(
+            """
+            SELECT file
+            FROM sessions
+            WHERE id = :session
+            """,
+            {
+                "session": session_id
+            }
+        )
+        
+        if row := cursor.fetchone():
+            file, = row
+        
             cursor.execute(
                 """
-                SELECT file
-                FROM state
-                WHERE id = 1
-                """
+                SELECT timeline_id, branch_id, line_number
+                FROM files
+                WHERE file = :file
+                """,
+                {
+                    "file": file
+                }
             )
             
             if row := cursor.fetchone():
-                file, = row
+                timeline_id, branch_id, node_id = row
+            
+            checkpoint = None
             
+            if timeline_id is not None:
                 cursor.execute(
-                    """
-                    SELECT timeline_id, line_number
-                    FROM files
-                    WHERE file = :file
+                    f"""
+                    {BRANCH_PATH}
+                    SELECT checkpoint
+                    FROM path
+                    {ON_PATH.format(table="timeline", id="id")}
+                    WHERE timeline.id <= :id
+                      AND checkpoint IS NOT NULL
+                    ORDER BY timeline.id DESC
+                    LIMIT 1
                     """,
                     {
-                        "file": file
+                        "id": timeline_id,
+                        "file": file,
+                        "branch_id": branch_id
                     }
                 )
                 
                 if row := cursor.fetchone():
-                    timeline_id, node_id = row
-                    
-                try:
-                    if not type(timeline_id) is int:
-                        raise ValueError("There's no timeline_id or it isn't an int")
-                    ifc.replace(_watcher, [str(timeline_id)])
-                    print(f"[REC {timeline_id} line {node_id}]", flush=True)
-                except Exception as error:
-                    pass#print(f"[bbb] {error}", flush=True)
-        
-        watcher_process = subprocess.Popen(
-            ["sudo", "-E", "/home/user/trace/api/env/bin/python", "settrace.py"]
-        )
-        
-        needs_to_sync = True
-        
-        print("[SSS]", flush=True)
-
-MAIN_FILE_PATH = Path.cwd() / "shared" / "main.py"
+                    checkpoint, = row
+                
+            try:
+                if not type(checkpoint) is int:
+                    raise ValueError("There's no checkpoint or it isn't an int")
+                ifc.replace(channels['_watcher'], [{
+                    "checkpoint": checkpoint,
+                    "timeline_id": timeline_id
+                }])
+                print(f"[REC {session_id} {timeline_id} line {node_id}]", flush=True)
+            except Exception as error:
+                pass#print(f"[bbb] {error}", flush=True)
+    
+    # started inside the session directory, so CRIU images stay per session as well
+    return subprocess.Popen(
+        (["sudo", "-E"] if CHECKPOINT_BACKEND == 'criu' else []) + ["/home/user/trace/api/env/bin/python", str(TRACE_HOME / "settrace.py")],
+        cwd=session_dir(session_id),
+        start_new_session=True, # evicting the session kills the group
+        env={
+            **os.environ,
+            "TRACE_HOME": str(TRACE_HOME),
+            "TRACE_SESSION": session_id
+        }
+    )
 
-def nodes_from_file(raw_bytes = None, timeline_id = None) -> str:
+def nodes_from_file(session_id: str, file: str, raw_bytes = None, timeline_id = None, branch_id = ROOT_BRANCH) -> str:
+    script_path = session_dir(session_id) / "main.py"
+    
     if raw_bytes:
         text = raw_bytes.decode('utf-8')
     else:
-        with open(str(MAIN_FILE_PATH), "r") as file:
-            text = file.read()
+        with open(str(script_path), "r") as script:
+            text = script.read()
 
-    lines_with_numbers = [(lineno, source_segment) for lineno, source_segment in enumerate(text.splitlines(), start=1) if source_segment.strip() and source_segment.lstrip()[0] != '#']
+    lines_with_numbers = source_index(text, script_path.name)['nodes']
 
-    line_number_frame_id = None
+    line_stats = {}
 
     if timeline_id:
         with sqlite3.connect(DATABASE) as db_connection:
-            cursor = db_connection.cursor()
-            
-            cursor.execute("PRAGMA foreign_keys = ON;")
-            
-            cursor.execute(
-                """
-                SELECT file
-                FROM state
-                WHERE id = 1
-                """
-            )
-            
-            if row := cursor.fetchone():
-                file, = row
-                
-                cursor.execute(
-                    """
-                    SELECT line_number, frame_id
-                    FROM timeline
-                    WHERE id <= :id
-                    AND file == :file
-                    ORDER BY id ASC
-                    """,
-                    {
-                        "id": timeline_id,
-                        "file": file
-                    }
-                )
-
-                if rows := cursor.fetchall():
-                    line_number_frame_id = {
-                        row[0]: row[1]
-                        for row in rows
-                    }
+            line_stats = path_line_stats(db_connection.cursor(), file, branch_id, timeline_id)
 
     gap_between_nodes = 50
 
@@ -288,26 +931,35 @@ def nodes_from_file(raw_bytes = None, timeline_id = None) -> str:
             "position": {"x": (len(source_segment) - len(source_segment.lstrip())) / 4 * 25, "y": idx * gap_between_nodes},
             "data": {
                 "source_segment": source_segment.lstrip(),
-                "framePointer": line_number_frame_id[lineno] if line_number_frame_id and lineno in line_number_frame_id else None
+                "framePointer": line_stats[lineno]['frame_id'] if lineno in line_stats else None,
+                "hits": line_stats[lineno]['hits'] if lineno in line_stats else 0,
+                "exceptions": line_stats[lineno]['exceptions'] if lineno in line_stats else 0,
+                "firstTimelineId": line_stats[lineno]['first_id'] if lineno in line_stats else None,
+                "lastTimelineId": line_stats[lineno]['last_id'] if lineno in line_stats else None
             },
         }
         for idx, (lineno, source_segment) in enumerate(lines_with_numbers)
     ]
 
-@app.post("/api/upload")
-async def import_graph(file: UploadFile = File(...)):
-    global needs_to_sync
+@app.post("/api/sessions/{session_id}/upload")
+def import_graph(session_id: str, file: UploadFile = File(...)):
+    prepare_session(session_id)
+    
+    scheduler.stop(session_id)
+    
+    raw_bytes = file.file.read()
     
-    if watcher_process: # use a pointer in the db instead!
-        watcher_process.kill()
+    script_path = session_dir(session_id) / "main.py"
     
-    raw_bytes = await file.read()
+    with open(str(script_path), "wb") as script:
+        script.write(raw_bytes)
     
-    with open(str(MAIN_FILE_PATH), "wb") as file:
-        file.write(raw_bytes)
+    source_index(raw_bytes.decode('utf-8'), script_path.name) # parsed once here, the tracer reuses it
     
     send_back = {
-        "file": "main.py" # ! REPLACE WITH THE ACTUAL UPLOADED FILENAME
+        "session": session_id,
+        "file": session_file(session_id), # ! REPLACE WITH THE ACTUAL UPLOADED FILENAME
+        "branch_id": ROOT_BRANCH
     }
         
     with sqlite3.connect(DATABASE) as db_connection:
@@ -315,93 +967,206 @@ async def import_graph(file: UploadFile = File(...)):
         
         cursor.execute("PRAGMA foreign_keys = ON;")
         
+        # only the recorded run goes, breakpoints and policies belong to the file and stay
+        cursor.execute(
+            """
+            INSERT INTO files (file, branch_id)
+            VALUES (:file, :branch_id)
+            ON CONFLICT (file) DO UPDATE SET
+                timeline_id = NULL,
+                branch_id = excluded.branch_id,
+                line_number = NULL
+            """,
+            send_back
+        )
+        
+        # cascades to the timeline, its variable_changes and keyframes, frames, line_stats and blob_refs
+        cursor.execute(
+            """
+            DELETE FROM branches
+            WHERE file = :file
+            """,
+            send_back
+        )
+        
         cursor.execute(
             """
-            INSERT OR REPLACE INTO files (file)
-            VALUES (:file)
+            INSERT INTO branches (file, id, parent_id, fork_id)
+            VALUES (:file, :branch_id, NULL, -1)
             """,
             send_back
         )
         
         cursor.execute(
             """
-            INSERT OR REPLACE INTO state (
+            INSERT INTO sessions (
                 id, file
             )
             VALUES (
-                1, :file
+                :session, :file
             )
+            ON CONFLICT (id) DO UPDATE SET
+                file = excluded.file
             """,
             send_back
         )
     
-    needs_to_sync = True
+    request_sync(session_id)
+    
+    blocking_pool.submit(collect_garbage) # the replaced timeline's values
     
     return Response(status_code=201)
 
-queue = []
+class Client:
+    # one per websocket, its outbox is bounded so a slow browser cannot hold up the others
+    def __init__(self, session_id: str, websocket: WebSocket, max_messages: int = 1000):
+        self.session_id = session_id
+        self.websocket = websocket
+        self.outbox = asyncio.Queue(max_messages)
+        self.ready = asyncio.Event()
+        self.needs_sync = False
+        self.timeline_id = -1 # last timeline id this client holds
+        self.branch_id = None # and the branch those rows came from
+    
+    def push(self, message: str, parsed: dict) -> None:
+        if parsed['type'] == 'sync': # the tracer ran past events without sending them
+            self.request_sync()
+            return
+        try:
+            self.outbox.put_nowait((message, parsed))
+        except asyncio.QueueFull:
+            # overflow collapses into one sync, the client reloads the timeline and console from the db
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            self.needs_sync = True
+        self.ready.set()
+    
+    def request_sync(self) -> None:
+        self.needs_sync = True
+        self.ready.set()
+    
+    async def send_loop(self) -> None:
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            
+            if self.needs_sync:
+                self.needs_sync = False
+                try:
+                    sync_data = await run_blocking(app_sync, self.session_id, after_id=self.timeline_id, branch_id=self.branch_id)
+                except Exception:
+                    await asyncio.sleep(.1) # no file selected yet or the db is busy
+                    self.request_sync()
+                    continue
+                
+                # queued events are either covered by the sync or from a future it just discarded
+                queued = []
+                while not self.outbox.empty():
+                    queued.append(self.outbox.get_nowait())
+                for item in queued:
+                    if item[1]['type'] != 'event':
+                        self.outbox.put_nowait(item)
+                
+                self.timeline_id = -1 if sync_data['timeline_id'] is None else sync_data['timeline_id']
+                self.branch_id = sync_data['branch_id']
+                await self.websocket.send_text(json.dumps({
+                    "type": "sync",
+                    "data": sync_data
+                }))
+            
+            while not self.outbox.empty():
+                message, parsed = self.outbox.get_nowait()
+                if parsed['type'] == 'event':
+                    self.timeline_id = parsed['data']['id']
+                    self.branch_id = parsed['data'].get('branch_id')
+                await self.websocket.send_text(message)
+
+session_clients: dict[str, set[Client]] = defaultdict(set)
+event_loop = None
+
+def request_sync(session_id: str) -> None:
+    # callable from any thread, every client of the session re-syncs
+    if event_loop is not None:
+        event_loop.call_soon_threadsafe(lambda: [client.request_sync() for client in session_clients.get(session_id, ())])
+
+async def pump_app_messages() -> None:
+    # the only reader of _app_to_server, wakes as soon as any tracer appends
+    while True:
+        try:
+            messages = await run_blocking(ifc.pop, _app_to_server, keep_json=True, timeout=1)
+        except Exception as error:
+            print(f"[pump] {error}", flush=True)
+            await asyncio.sleep(1)
+            continue
+        
+        for message in messages:
+            parsed = json.loads(message)
+            for client in session_clients.get(parsed.get('session'), ()):
+                client.push(message, parsed)
+
+@app.on_event("startup")
+async def start_pump() -> None:
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    asyncio.create_task(pump_app_messages())
+    blocking_pool.submit(collect_garbage)
 
-@app.websocket("/api/ws")
-async def websocket_endpoint(websocket: WebSocket):
+@app.websocket("/api/sessions/{session_id}/ws")
+async def websocket_endpoint(websocket: WebSocket, session_id: str):
+    if not valid_session_id(session_id):
+        await websocket.close(code=1008)
+        return
+    
     await websocket.accept()
     
+    channels = await run_blocking(prepare_session, session_id)
+    
+    client = Client(session_id, websocket)
+    
     async def ws_to_app():
         while True:
+            data = await websocket.receive_text()
+            try:
+                message = json.loads(data)
+                if not isinstance(message, dict) or not isinstance(message.get('type'), str):
+                    raise ValueError("not a JSON object with a type") # the tracer matches on it
+            except ValueError as error:
+                # one bad frame must not drop the connection and the client's outbox with it
+                print(f"[WS {session_id}] skipped a malformed message: {error}", flush=True)
+                continue
             try:
-                data = await websocket.receive_text()
-                ifc.append(_server_to_app, data, is_json=True)
-                ensure_watcher_running()
+                match message.get('type'):
+                    case 'set_breakpoints':
+                        await run_blocking(save_breakpoints, session_id, message.get('breakpoints', []))
+                    case 'set_checkpoint_policy':
+                        await run_blocking(save_checkpoint_policy, session_id, message.get('checkpoint_policy'))
+                    case 'set_trace_filter':
+                        await run_blocking(save_trace_filter, session_id, message.get('trace_filter'))
+                    case 'set_retention_policy':
+                        await run_blocking(save_retention_policy, session_id, message.get('retention_policy'))
             except Exception as error:
-                print(f"[ccc] {error}", flush=True)
-                raise
-
-    async def app_to_ws():
-        global needs_to_sync
-        while True:
-            while queue:
-                await asyncio.sleep(.1)
-            
-            messages = ifc.pop(_app_to_server, keep_json=True)
-            
-            if needs_to_sync:
-                needs_to_sync = False
-                while True:
-                    try:
-                        sync_event = json.dumps({
-                            "type": "sync",
-                            "data": await app_sync()
-                        })
-                        break
-                    except:
-                        await asyncio.sleep(.1)
-                messages.insert(0, sync_event)
-            
-            for i, message in enumerate(messages):
-                try:
-                    await websocket.send_text(message)
-                except Exception as error:
-                    queue.extend(messages[i:])
-                    print(f"[ddd] {error}", flush=True)
-                    raise
-            
-            await asyncio.sleep(.1)
-            
-    async def resend():
-        while True:
-            while queue:
-                message = queue.pop(0)
-                try:
-                    await websocket.send_text(message)
-                except:
-                    print("[b4]", flush=True)
-                    queue.insert(0, message)
-                    raise
-            await asyncio.sleep(.1)
+                client.push(json.dumps({
+                    "type": "stderr",
+                    "data": f"{message['type']}: {error}\n"
+                }), {"type": "stderr"})
+                continue
+            await run_blocking(ifc.append, channels['_server_to_app'], data, is_json=True)
+            await run_blocking(ensure_watcher_running, session_id)
+    
+    clients = session_clients[session_id]
+    clients.add(client)
+    tasks = [
+        asyncio.create_task(ws_to_app()),
+        asyncio.create_task(client.send_loop())
+    ]
     try:
-        await asyncio.gather(
-            ws_to_app(),
-            app_to_ws(),
-            resend()
-        )
-    except Exception as error:
-        print(error)
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), (WebSocketDisconnect, type(None))):
+                print(task.exception(), flush=True)
+    finally:
+        clients.discard(client)
+        if not clients:
+            session_clients.pop(session_id, None)
+        for task in tasks:
+            task.cancel()
@@ -1,151 +1,600 @@
 #!/usr/bin/env python3
 
+import atexit
 import json
-from time import sleep
-import criu_api as criu
+import threading
+import weakref
+from contextlib import contextmanager
+from itertools import count
+from time import perf_counter, time
 from os import (
     _exit,
-    fork as os_fork,
-    waitpid as os_waitpid
+    environ,
+    getpid,
+    fork as os_fork
 )
 
 from utils.ast_functions import find_python_imports, get_source_code_cache
-from utils.context_managers import use_dir, use_trace
-from utils.scope_functions import diff_scope, pretty_scope, filter_scope
+from utils.context_managers import use_dir, use_tracing, restart_tracing, monitoring_available
+from utils.scope_functions import ScopeTracker
+from utils.breakpoints import Breakpoints
+from utils.checkpoints import CheckpointPolicy
+from utils.trace_filter import TraceFilter
+from utils.retention import RetentionPolicy, thin
+from utils.keyframes import ScopeKeyframes
+from utils.serializer import Serializer
+from utils.output_capture import OutputCapture
+from utils.profiling import EventClock
+from utils.sessions import TRACE_HOME, DEFAULT_SESSION, session_dir, session_channels
+from utils.warm_pool import WarmPool, become_subreaper, wait_for
+from utils.checkpoint_backends import checkpoint_backend
+from utils.content_store import BlobPacker, collect_blobs
+from utils.branches import BRANCH_PATH, ON_PATH, ROOT_BRANCH, BranchFollower, branch_path
+from utils.frames import FrameIds
 import sys
-from sys import argv, exit
+from sys import exit
 from pathlib import Path
-from collections import defaultdict
 from traceback import format_tb
 
 from utils.internal_file_communication import ifc
+from utils.timeline_writer import TimelineWriter
 
 import sqlite3
 
-DATABASE = Path.cwd() / 'trace.db'
+DATABASE = TRACE_HOME / 'trace.db'
 
-def serialize(obj):
-    if isinstance(obj, (int, float, str, bool, type(None))):
-        return obj
-    elif isinstance(obj, (tuple, list)):
-        return [serialize(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {str(k): serialize(v) for k, v in obj.items()}
+SESSION = environ.get('TRACE_SESSION', DEFAULT_SESSION)
+
+serialize = Serializer()
+serialize.register('pandas.core.frame.DataFrame', lambda frame: f"<DataFrame {frame.shape[0]}x{frame.shape[1]}>")
+serialize.register('pandas.core.series.Series', lambda series: f"<Series {len(series)} dtype={series.dtype}>")
+
+timeline_writer = TimelineWriter(DATABASE)
+atexit.register(timeline_writer.close)
+
+scope_keyframes = ScopeKeyframes()
+branch_follower = BranchFollower()
+frame_ids = FrameIds()
+
+# the lock is only held to number an event and, in id order, to place it and decide on pausing; each
+# thread snapshots and serializes its scopes and stores its rows outside it. It is never held while
+# the main thread waits in the pause loop, so other threads keep running and storing
+tracing_lock = threading.RLock()
+event_order = threading.Condition(tracing_lock)
+next_turn = 0 # id of the next event to be placed
+threads = threading.local()
+thread_numbers = count()
+thread_writers = weakref.WeakSet() # writers of threads the script started
+writers_lock = threading.Lock()
+tracer_threads = set()             # threads running before the script, not the script's own
+
+def thread_state():
+    # per thread: its number (0 for the thread running the script), scope snapshots, clock and writer
+    if not hasattr(threads, 'number'):
+        threads.number = next(thread_numbers)
+        threads.scope_tracker = ScopeTracker()
+        threads.clock = EventClock()
+        if threads.number:
+            threads.writer = TimelineWriter(DATABASE, moves_pointer=False)
+            with writers_lock:
+                thread_writers.add(threads.writer)
+        else:
+            threads.writer = timeline_writer
+    return threads
+
+def script_threads_running() -> bool:
+    # a checkpoint forks or dumps the process, a parked copy would run on without the script's other threads
+    return any(thread not in tracer_threads for thread in threading.enumerate())
+
+def flush_thread_writers(close: bool = False) -> None:
+    with writers_lock:
+        writers = list(thread_writers)
+    for writer in writers:
+        writer.close() if close else writer.flush()
+
+atexit.register(flush_thread_writers, True)
+
+@contextmanager
+def event_turn(timeline_id: int):
+    # whichever thread got its id first, events are placed in id order
+    global next_turn
+    with event_order:
+        event_order.wait_for(lambda: next_turn == timeline_id)
+        try:
+            yield
+        finally:
+            next_turn += 1
+            event_order.notify_all()
+
+DELETED = json.dumps("<deleted>")
+
+def serialize_data(send_back, blobs: BlobPacker) -> tuple[list, dict]:
+    # every value is encoded once and packed into a blob right away when it is large; the stored diffs,
+    # variable_changes and keyframes are all put together from that text, nothing parses it again;
+    # returns the variable_changes and, per scope, what the keyframes take from the diff
+    variable_changes = []
+    digests = []
+    diffs = {}
+    shown = {}
+    
+    for scope in ('global', 'local'):
+        diff = diffs[scope] = {} # name -> ('"name": value' as stored, digest or None), None when deleted
+        stored, inline = [], []
+        for name, value in serialize.scope(send_back[f'{scope}_diff']).items():
+            name_json = json.dumps(name)
+            value_json = stored_json = json.dumps(value)
+            digest = None
+            if len(value_json) >= blobs.min_size:
+                digest = blobs.put(value_json)
+                digests.append(digest)
+                stored_json = f'"<blob:{digest}>"'
+            text = f'{name_json}: {stored_json}'
+            stored.append(text)
+            inline.append(f'{name_json}: {value_json}' if digest else text)
+            diff[name] = None if value_json == DELETED else (text, digest)
+            variable_changes.append((send_back['file'], send_back['id'], scope, name, stored_json))
+        send_back[f'{scope}_diff'] = '{' + ', '.join(stored) + '}'
+        shown[f'{scope}_diff'] = inline
+    
+    send_back['blobs'] = digests
+    if digests:
+        send_back['shown'] = {key: '{' + ', '.join(inline) + '}' for key, inline in shown.items()}
+    
+    if isinstance(return_value := serialize(send_back['return_value']), (dict, list, tuple)):
+        send_back['return_value'] = json.dumps(return_value)
     else:
-        return str(obj)
+        send_back['return_value'] = return_value
+    
+    return variable_changes, diffs
 
-def db_save(send_back) -> None:
+def app_event(send_back) -> dict:
+    # the stored diffs refer to blobs, the app gets every value inline
+    event = {key: value for key, value in send_back.items() if key not in ('blobs', 'shown')}
+    event.update(send_back.get('shown', ()))
+    return event
+
+def db_save(send_back, variable_changes, keyframe, write, branch_id) -> None:
+    thread_state().writer.save(send_back, variable_changes, keyframe, write, branch_id)
+
+def new_branch(file: str, parent_id: int, fork_id: int) -> int:
+    # other threads may have numbered events past the fork already, the frames those started are not copied
+    return thread_state().writer.new_branch(file, parent_id, fork_id, [
+        frame for frame in frame_ids.open.values()
+        if frame['id'] <= fork_id
+    ])
+
+def db_load_settings() -> dict:
+    # breakpoints and the three policies of the session's file, in one query
     with sqlite3.connect(DATABASE) as db_connection:
         cursor = db_connection.cursor()
         
-        cursor.execute("PRAGMA foreign_keys = ON;")
+        cursor.execute(
+            """
+            SELECT files.checkpoint_policy, files.trace_filter, files.retention_policy, (
+                SELECT json_group_array(json(spec))
+                FROM (
+                    SELECT spec
+                    FROM breakpoints
+                    WHERE breakpoints.file = files.file
+                    ORDER BY id ASC
+                )
+            )
+            FROM sessions
+            JOIN files
+              ON files.file = sessions.file
+            WHERE sessions.id = :session
+            """,
+            {
+                "session": SESSION
+            }
+        )
+        
+        checkpoint_policy, trace_filter, retention_policy, specs = cursor.fetchone() or (None, None, None, None)
+        
+        return {
+            "breakpoints": json.loads(specs or '[]'),
+            "checkpoint_policy": checkpoint_policy and json.loads(checkpoint_policy),
+            "trace_filter": trace_filter and json.loads(trace_filter),
+            "retention_policy": retention_policy and json.loads(retention_policy)
+        }
+
+def db_load_branch() -> int:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
         
         cursor.execute(
+            """
+            SELECT branch_id
+            FROM files
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+            """,
+            {
+                "session": SESSION
+            }
+        )
+        
+        if (row := cursor.fetchone()) and row[0] is not None:
+            return row[0]
+        
+        return ROOT_BRANCH
+
+def db_save_branch(file: str, branch_id: int) -> None:
+    with sqlite3.connect(DATABASE) as db_connection:
+        db_connection.execute(
             """
             UPDATE files
-            SET timeline_id = :id,
-                line_number = :line_number
-            WHERE file = :file;
+            SET branch_id = :branch_id
+            WHERE file = :file
             """,
-            send_back
+            {
+                "file": file,
+                "branch_id": branch_id
+            }
         )
 
-        send_back['global_diff'] = json.dumps(serialize(send_back['global_diff']))
-        send_back['local_diff'] = json.dumps(serialize(send_back['local_diff']))
+def db_load_path(file: str, branch_id: int) -> list[tuple[int, int, int]]:
+    with sqlite3.connect(DATABASE) as db_connection:
+        return branch_path(db_connection.cursor(), file, branch_id)
+
+def db_find_checkpoint(file: str, timeline_id: int, branch_id: int) -> tuple[int, int] | None:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
         
-        if isinstance(return_value := serialize(send_back['return_value']), (dict, list, tuple)):
-            send_back['return_value'] = json.dumps(return_value)
-        else:
-            send_back['return_value'] = return_value
+        cursor.execute(
+            f"""
+            {BRANCH_PATH}
+            SELECT timeline.id, timeline.checkpoint
+            FROM path
+            {ON_PATH.format(table="timeline", id="id")}
+            WHERE timeline.id <= :id
+              AND timeline.checkpoint IS NOT NULL
+            ORDER BY timeline.id DESC
+            LIMIT 1
+            """,
+            {
+                "id": timeline_id,
+                "file": file,
+                "branch_id": branch_id
+            }
+        )
+        
+        if row := cursor.fetchone():
+            return row
+
+def db_save_parked(timeline_id: int, branch_id: int, pid: int | None) -> None:
+    # which steps a parked copy can resume, for the app; the pool is what jumps actually read
+    with sqlite3.connect(DATABASE) as db_connection:
+        db_connection.execute(
+            """
+            UPDATE timeline
+            SET parked = :pid
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+              AND branch_id = :branch_id
+              AND id = :timeline_id
+            """,
+            {
+                "session": SESSION,
+                "branch_id": branch_id,
+                "timeline_id": timeline_id,
+                "pid": pid
+            }
+        )
 
+def db_clear_parked() -> None:
+    # copies of an earlier watcher, or lost with the API's in-memory registry
+    with sqlite3.connect(DATABASE) as db_connection:
+        db_connection.execute(
+            """
+            UPDATE timeline
+            SET parked = NULL
+            WHERE file = (SELECT file FROM sessions WHERE id = :session)
+              AND parked IS NOT NULL
+            """,
+            {
+                "session": SESSION
+            }
+        )
+
+def db_load_session_file() -> str:
+    with sqlite3.connect(DATABASE) as db_connection:
+        cursor = db_connection.cursor()
+        
         cursor.execute(
             """
-            INSERT OR REPLACE INTO timeline (
-                id, event, target, return_value, file,
-                frame_id, function, line_number, source_segment,
-                global_diff, local_diff, traceback, error
-            )
-            VALUES (
-                :id, :event, :target, :return_value, :file,
-                :frame_id, :function, :line_number, :source_segment,
-                :global_diff, :local_diff, :traceback, :error
-            )
+            SELECT file
+            FROM sessions
+            WHERE id = :session
             """,
-            send_back
+            {
+                "session": SESSION
+            }
         )
+        
+        if (row := cursor.fetchone()) and row[0]:
+            return row[0]
+        
+        raise Exception("no pointer to a file")
+
+_app_to_server = str(TRACE_HOME / '_app_to_server.txt') # shared by every session
+
+for name, file_txt in session_channels(SESSION).items():
+    globals()[name] = file_txt
+
+def send_to_app(message: dict) -> None:
+    ifc.append(_app_to_server, {**message, "session": SESSION})
 
-for name in (
-    '_app_to_server',
-    '_server_to_app',
-    '_watcher',
-):
-    file_txt = Path.cwd() / f'{name}.txt'
-    globals()[name] = str(file_txt)
+output_capture = OutputCapture(send_to_app)
+atexit.register(output_capture.flush)
 
 class StdOutRedirector:
     def flush(self):
-        ifc.append(_app_to_server, {
-            "type": "flush",
-            "data": "stdout"
-        })
+        output_capture.mark_flushed("stdout")
     
     def write(self, text):
-        ifc.append(_app_to_server, {
-            "type": "stdout",
-            "data": text
-        })
+        output_capture.write("stdout", text, live=replay_to is None)
 
 class StdErrRedirector:
     def flush(self):
-        ifc.append(_app_to_server, {
-            "type": "flush",
-            "data": "stderr"
-        })
+        output_capture.mark_flushed("stderr")
     
     def write(self, text):
-        ifc.append(_app_to_server, {
-            "type": "stderr",
-            "data": text
-        })
+        output_capture.write("stderr", text, live=replay_to is None)
 
 sys.stdout = StdOutRedirector()
 sys.stderr = StdErrRedirector()
 
+breakpoints = Breakpoints()
+checkpoint_policy = CheckpointPolicy()
+trace_filter = TraceFilter()
+retention_policy = RetentionPolicy()
+
+def load_settings() -> None:
+    # at startup, and in a restored or resumed copy that still has the settings of the step it was taken at;
+    # otherwise the set_* messages say when something changed
+    settings = db_load_settings()
+    breakpoints.replace(settings['breakpoints'])
+    checkpoint_policy.configure(settings['checkpoint_policy'])
+    retention_policy.configure(settings['retention_policy'])
+    if trace_filter.configure(settings['trace_filter']):
+        restart_tracing()
+
+mode = 'step' # 'step' pauses on every event, 'run' only on breakpoints
+next_timeline_id = 0
+skipped_events = False
+replay_to = None # timeline id to re-execute up to after a restore
+watcher_checked_at = 0.0
+
+def prepare_fork():
+    # nothing open may end up in a CRIU image or be shared with a parked copy
+    output_capture.flush()
+    timeline_writer.close()
+    flush_thread_writers(close=True)
+    ifc.close()
+
+warm_pool = WarmPool(_pool, session_dir(SESSION), prepare_fork, size=int(environ.get('WARM_POOL_SIZE', 8)), record=db_save_parked)
+checkpoints = checkpoint_backend(_replay, warm_pool, session_dir(SESSION))
+
+def take_checkpoint(send_back) -> bool:
+    global replay_to
+    
+    # pending rows are written either way; closing the database and IFC is part of what a dump costs
+    # the run, so the budget counts it too
+    timeline_writer.flush()
+    
+    started = perf_counter()
+    
+    prepare_fork()
+    
+    send_back['checkpoint'], restored_to = checkpoints.dump(send_back['id'], send_back['branch_id'])
+    
+    if restored_to is None:
+        checkpoint_policy.dumped(perf_counter() - started)
+    
+    # a resident copy of this step lets the next jump here skip the restore from disk
+    if checkpoints.persistent and (resumed_to := warm_pool.park(send_back['id'], send_back['branch_id'])) is not None:
+        restored_to = resumed_to
+    
+    # the row is written after this, the pool's record of the copy has nothing to update yet
+    send_back['parked'] = warm_pool.last_parked
+    
+    if restored_to is None:
+        return False
+    
+    replay_to = restored_to
+    checkpoint_policy.dumped(0.0)
+    load_settings()
+    return True
+
+def prune(send_back) -> None:
+    # thins what the retention policy no longer keeps in full, up to the last step that can still be restored
+    timeline_writer.flush()
+    db_connection = timeline_writer.connect()
+    
+    file, branch_id = send_back['file'], branch_follower.branch_id
+    
+    cutoff = retention_policy.cutoff(db_connection.cursor(), file, branch_id)
+    
+    if cutoff is None:
+        return
+    
+    cutoff = min(cutoff, send_back['id'])
+    path = db_load_path(file, branch_id)
+    
+    reachable = []
+    if (checkpoint := db_find_checkpoint(file, cutoff, branch_id)) is not None:
+        reachable.append(checkpoint[0])
+    if not checkpoints.persistent and (snapshot := warm_pool.nearest(cutoff, path)) is not None:
+        reachable.append(snapshot['timeline_id'])
+    
+    if not reachable:
+        return
+    
+    cutoff = max(reachable)
+    
+    dropped = thin(db_connection, file, branch_id, cutoff, timeline_writer.blobs)
+    
+    if dropped is None:
+        return
+    
+    checkpoints.drop(dropped)
+    warm_pool.drop_before(cutoff, path)
+    collect_blobs(db_connection)
+
+def jump(file: str, timeline_id: int, branch_id: int) -> None:
+    # hands over to the nearest parked copy, or to a CRIU restore when an image is closer,
+    # both taken from the path of the branch being jumped to
+    checkpoint = db_find_checkpoint(file, timeline_id, branch_id)
+    snapshot = warm_pool.nearest(timeline_id, db_load_path(file, branch_id))
+    
+    if snapshot is not None and (checkpoint is None or snapshot['timeline_id'] >= checkpoint[0]):
+        warm_pool.resume(snapshot, timeline_id)
+        ifc.append(_watcher, {
+            "pid": snapshot['pid']
+        })
+    elif checkpoint is not None:
+        ifc.append(_watcher, {
+            "checkpoint": checkpoint[1],
+            "timeline_id": timeline_id
+        })
+    else:
+        raise ValueError(f"no checkpoint at or before timeline id {timeline_id}")
+    
+    _exit(0)
+
 def send_data(send_back, f):
-    criu.dump(allow_overwrite=True)
+    global skipped_events, mode, replay_to
     
-    send_back['id'] = criu._last_dump_number
+    timeline_writer.flush()
+    flush_thread_writers()
+    output_capture.flush()
     
-    db_save(send_back)
+    if skipped_events:
+        skipped_events = False
+        send_to_app({
+            "type": "sync"
+        })
+    else:
+        send_to_app({
+            "type": "event",
+            "data": app_event(send_back)
+        })
     
-    ifc.append(_app_to_server, {
-        "type": "event",
-        "data": send_back
-    })
     running = True
     while running:
-        for message in ifc.pop(_server_to_app):
+        if warm_pool.orphaned():
+            _exit(0)
+        for message in ifc.pop(_server_to_app, timeout=1):
             match message['type']:
                 case 'continue':
+                    mode = 'run' if message.get('mode') == 'run' else 'step'
                     running = False
+                case 'set_breakpoints' | 'set_checkpoint_policy' | 'set_trace_filter' | 'set_retention_policy':
+                    try:
+                        load_settings()
+                    except Exception as error:
+                        print(error)
                 case 'new_timeline_id':
                     try:
-                        new_timeline_id = message['new_timeline_id']
-                        int(new_timeline_id)
-                        ifc.append(_watcher, new_timeline_id)
-                        _exit(0)
+                        new_timeline_id = int(message['new_timeline_id'])
+                        new_branch_id = int(message.get('branch_id', branch_follower.branch_id))
+                        
+                        # the step being left stays resident too, scrubbing tends to come back
+                        resumed_to = None if script_threads_running() else warm_pool.park(send_back['id'], send_back['branch_id'])
+                        
+                        if resumed_to is None:
+                            # what runs next, restored or resumed, follows this branch's stored path
+                            db_save_branch(send_back['file'], new_branch_id)
+                            jump(send_back['file'], new_timeline_id, new_branch_id)
+                        elif resumed_to == send_back['id']:
+                            load_settings()
+                            follow_branch(send_back)
+                            timeline_writer.move_pointer({**send_back, "branch_id": branch_follower.branch_id})
+                            send_to_app({
+                                "type": "sync"
+                            })
+                        else:
+                            load_settings()
+                            skipped_events = True
+                            replay_to = resumed_to
+                            running = False
+                            break
                     except Exception as error:
                         print(error)
                 case 'update_node_code': # TODO
-                    ifc.append(_app_to_server, {
+                    send_to_app({
                         "type": "stderr",
                         "data": f"TODO: EDIT NODE {message['lineno']} TO {repr(message['code_segment'])}\n"
                     })
                 case "stdin": # TODO, CURRENTLY USED FOR DEBUG ^
                     clean_input = int(message['data'])
                     exec(f'try:\n    f.f_lineno = {clean_input}\nexcept Exception as e:\n    print(e)')
-            
-        sleep(.1)
+
+def follow_branch(send_back) -> None:
+    # after a jump, the steps ahead are compared with the stored path instead of overwriting it
+    with tracing_lock:
+        branch_follower.follow(timeline_writer.connect(), send_back['file'], db_load_branch())
+
+def handle_data(send_back, f, function_name, diffs) -> tuple[bool, tuple | None]:
+    # called on the event's turn, holding tracing_lock; returns whether to pause on the event and what
+    # to save for it, (keyframe, write, branch_id) or None when its row is stored already
+    global skipped_events, replay_to, watcher_checked_at
+    
+    state = thread_state()
+    
+    send_back['checkpoint'] = None
+    send_back['parked'] = None
+    send_back['output'] = None if state.number else output_capture.take() # printed while running up to this event
+    send_back['recorded_at'] = time()
+    
+    # a script running without pauses notices an evicted session about once a second
+    if send_back['recorded_at'] - watcher_checked_at >= 1:
+        watcher_checked_at = send_back['recorded_at']
+        if warm_pool.orphaned():
+            _exit(0)
+    
+    output_capture.poll()
+    
+    # done for replayed events too, the keyframe scope has to follow every event
+    keyframe = scope_keyframes.apply(send_back, diffs['global'], diffs['local'])
+    
+    replayed = replay_to is not None
+    
+    if state.number:
+        # the script's other threads never pause or take checkpoints; replaying, their rows are stored already
+        if replayed:
+            return False, None
+        skipped_events = True
+        write = branch_follower.place(state.writer.connect(), send_back, new_branch)
+        return False, (keyframe, write, branch_follower.branch_id)
+    
+    if replayed:
+        # re-executing forward from an earlier image, these rows are already stored
+        if send_back['id'] < replay_to:
+            return False, None
+        replay_to = None
+        pause = True
+        follow_branch(send_back)
+    else:
+        pause = mode == 'step' or breakpoints.hit(f, send_back['event'], send_back['source_file'], function_name)
+    
+    write = branch_follower.place(timeline_writer.connect(), send_back, new_branch)
+    
+    if not write:
+        # reproduced a stored row, its image (if any) is this step's image as well
+        send_back['checkpoint'] = branch_follower.checkpoint
+    elif not replayed and checkpoint_policy.due() and not script_threads_running() and take_checkpoint(send_back):
+        skipped_events = True
+        if send_back['id'] < replay_to:
+            return False, None
+        replay_to = None
+        pause = True
+        follow_branch(send_back)
+        write = branch_follower.place(timeline_writer.connect(), send_back, new_branch)
+    
+    if not pause:
+        skipped_events = True
+    
+    return pause, (keyframe, write, branch_follower.branch_id)
     
 def main(debug_script_path: Path):
     paths_to_trace = find_python_imports(debug_script_path)
@@ -155,16 +604,43 @@ def main(debug_script_path: Path):
         for path in paths_to_trace
     }
     
-    last_files = defaultdict(dict)
+    source_files = {
+        str(path): path.relative_to(debug_script_path.parent).as_posix()
+        for path in paths_to_trace
+    }
+    
+    tracer_threads.update(threading.enumerate())
+    thread_state() # the thread running the script is number 0
+    
+    file = db_load_session_file()
     
-    str_paths_to_trace = {
+    branch_follower.follow(timeline_writer.connect(), file, db_load_branch())
+    
+    trace_filter.paths = {
         str(path)
         for path in paths_to_trace
     }
+    load_settings()
+    
+    classify_suspensions = not monitoring_available()
     
     def trace_function(frame, event, arg):
+        clock = thread_state().clock
+        clock.enter()
+        try:
+            return trace_event(frame, event, arg)
+        finally:
+            clock.leave()
+    
+    def trace_event(frame, event, arg):
+        global next_timeline_id
+        
+        if not trace_filter(frame.f_code): return
+        
+        if classify_suspensions:
+            event = frame_ids.settrace_event(frame, event, arg)
+        
         str_code_filepath = frame.f_code.co_filename
-        if str_code_filepath not in str_paths_to_trace: return
 
         code_name = frame.f_code.co_name
         filename = Path(str_code_filepath).name
@@ -174,71 +650,96 @@ def main(debug_script_path: Path):
         if is_not_module:
             target = code_name
             function_name = None if code_name.startswith('<') else code_name
-            current_locals = dict(frame.f_locals)
         else:
             target = filename
             function_name = None
-            current_locals = {}
-
-        current_globals = dict(frame.f_globals)
 
-        last_scope = last_files[str_code_filepath]
+        source_file = source_files.get(str_code_filepath, filename)
         
-        frame_id = id(frame)
+        state = thread_state()
         
-        global_diff, local_diff = {}, {}
+        with tracing_lock:
+            timeline_id = next_timeline_id
+            next_timeline_id += 1
+            frame_info = frame_ids.get(frame, event, timeline_id, target, source_file)
         
-        if event in ("line", "return"):
-            old_globals, old_locals = last_scope[frame_id]
-        elif (last_frame_id := id(frame.f_back)) in last_scope:
-            old_globals, old_locals = last_scope[last_frame_id]
-        else:
-            old_globals, old_locals = {}, {}
-                
-        global_diff = diff_scope(old_globals, current_globals)
-        local_diff = diff_scope(old_locals, current_locals)
+        frame_id = frame_info['id']
+        
+        try:
+            global_diff, local_diff = state.scope_tracker.update(
+                frame,
+                frame_id,
+                frame_info['parent_id'],
+                track_locals=is_not_module
+            )
+            
+            source_segment = source_code_cache[str_code_filepath].get(frame.f_lineno, {}).get('segment', '')
+            
+            time_taken, cpu_time = state.clock.take()
+            
+            data = {
+                'id': timeline_id,
+                'event': event,
+                'target': target,
+                'file': file,
+                'source_file': source_file,
+                'frame_id': frame_id,
+                'parent_frame_id': frame_info['parent_id'],
+                'depth': frame_info['depth'],
+                'suspends': frame_info['suspends'],
+                'thread_id': state.number,
+                'function': function_name,
+                'line_number': frame.f_lineno,
+                'source_segment': source_segment,
+                "global_diff": global_diff,
+                "local_diff": local_diff,
+                "return_value": arg,
+                "traceback": None,
+                "error": None,
+                "time_taken": time_taken,
+                "cpu_time": cpu_time
+            }
+            
+            if event == 'exception':
+                exc_type, exc_value, exc_traceback = arg
+                data.update({
+                    "traceback": ''.join(format_tb(exc_traceback)),
+                    "error": f"{exc_type.__name__}: {exc_value}"
+                })
+            
+            variable_changes, diffs = serialize_data(data, state.writer.blobs)
+        except BaseException:
+            with event_turn(timeline_id):
+                pass # the events numbered after this one still wait for its turn
+            raise
         
-        source_segment = source_code_cache[str_code_filepath].get(frame.f_lineno, {}).get('segment', '')
+        with event_turn(timeline_id):
+            pause, save = handle_data(data, frame, function_name, diffs)
+            
+            # a suspended generator or coroutine keeps its frame id and scope snapshot for when it resumes
+            if event == 'return':
+                frame_ids.leave(frame)
         
-        data = {
-            'event': event,
-            'target': target,
-            'file': filename,
-            'frame_id': frame_id,
-            'function': function_name,
-            'line_number': frame.f_lineno,
-            'source_segment': source_segment,
-            "global_diff": global_diff,
-            "local_diff": local_diff,
-            "return_value": arg,
-            "traceback": None,
-            "error": None
-        }
+        if save is not None:
+            db_save(data, variable_changes, *save)
             
-        if event == 'line':
-            send_data(data, frame)
-            last_scope[frame_id] = current_globals, current_locals
-            return
-
-        elif event == 'call':
+            if not state.number and retention_policy.due():
+                try:
+                    with tracing_lock: # reads the followed branch and the warm pool
+                        prune(data)
+                except Exception as error:
+                    print(error)
+        
+        if event == 'return':
+            state.scope_tracker.forget(frame_id)
+            if state.number and frame_info['parent_id'] is None:
+                state.writer.flush() # the thread is done with traced code, for now at least
+        
+        if pause:
             send_data(data, frame)
-            #if current_locals: print(pretty_scope(current_locals))
-            last_scope.setdefault(frame_id, (current_globals, current_locals))
+        
+        if event in ('call', 'resume'):
             return trace_function
-
-        elif event == 'return':
-            send_data(data, frame)
-            del last_scope[frame_id]
-            return
-
-        elif event == 'exception':
-            exc_type, exc_value, exc_traceback = arg
-            data.update({
-                "traceback": ''.join(format_tb(exc_traceback)),
-                "error": f"{exc_type.__name__}: {exc_value}"
-            })
-            send_data(data, frame)
-            return
         
     source_code = debug_script_path.read_text()
         
@@ -254,7 +755,7 @@ def main(debug_script_path: Path):
         '__file__': str(debug_script_path)
     }
         
-    with use_dir(debug_script_path.parent), use_trace(trace_function):
+    with use_dir(debug_script_path.parent), use_tracing(trace_function, trace_filter):
         exec(
             compiled,
             exec_globals,
@@ -266,21 +767,39 @@ if __name__ == '__main__':
     info = ifc.read(_watcher)
     info = info[len(info) - 1] if info else None
     
-    starting = not info or not info.isdigit()
+    starting = not isinstance(info, dict)
+    
+    warm_pool.clear() # copies parked by an earlier watcher
+    db_clear_parked()
+    warm_pool.watcher_pid = getpid()
+    become_subreaper()
+    
+    ifc.close()
     
     child_pid = os_fork()
     if child_pid > 0:
-        os_waitpid(child_pid, 0)
+        active_pid = child_pid
         while True:
+            
+            if active_pid is not None:
+                wait_for(active_pid)
+                active_pid = None
 
             info = ifc.pop(_watcher)
             info = info[len(info) - 1] if info else None
+            
+            if isinstance(info, dict) and 'pid' in info:
+                active_pid = int(info['pid']) # a parked copy took over
+                continue
 
             try:
-                int(info)
+                checkpoint = int(info['checkpoint'])
+                timeline_id = int(info['timeline_id'])
             except:
                 # done executing a script.
                 
+                warm_pool.clear()
+                
                 with sqlite3.connect(DATABASE) as db_connection:
                     cursor = db_connection.cursor()
                     
@@ -289,9 +808,12 @@ if __name__ == '__main__':
                     cursor.execute(
                         """
                         SELECT file
-                        FROM state
-                        WHERE id = 1
-                        """
+                        FROM sessions
+                        WHERE id = :session
+                        """,
+                        {
+                            "session": SESSION
+                        }
                     )
                     
                     if row := cursor.fetchone():
@@ -316,7 +838,7 @@ if __name__ == '__main__':
                 exit()
 
             try:
-                criu.restore(int(info)) # == restore and os_waitpid(child_pid, 0)
+                checkpoints.restore(checkpoint, timeline_id) # == restore and os_waitpid(child_pid, 0)
             except KeyboardInterrupt:
                 print("\nKeyboardInterrupt")
                 exit()
@@ -325,8 +847,8 @@ if __name__ == '__main__':
                 exit()
     
     if starting:
-        criu.wipe()
+        checkpoints.wipe()
 
-        debug_script_path = Path('./shared/main.py').resolve()
+        debug_script_path = (session_dir(SESSION) / 'main.py').resolve()
 
         main(debug_script_path)
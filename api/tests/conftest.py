@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# utils.sessions reads TRACE_HOME when it is imported
+os.environ.setdefault('TRACE_HOME', tempfile.mkdtemp(prefix='trace-tests-'))
+
+from utils.schema import create_tables
+from utils.timeline_writer import TIMELINE_COLUMNS
+
+FILE = 'main'
+
+@pytest.fixture
+def database(tmp_path: Path) -> Path:
+    # an uploaded file with its root branch, like main.py's upload leaves it
+    database = tmp_path / 'trace.db'
+    create_tables(database)
+    with sqlite3.connect(database) as db_connection:
+        db_connection.execute("INSERT INTO files (file, branch_id) VALUES (?, 0)", (FILE,))
+        db_connection.execute("INSERT INTO branches (file, id, parent_id, fork_id) VALUES (?, 0, NULL, -1)", (FILE,))
+    return database
+
+@pytest.fixture
+def make_row():
+    # a timeline row as the tracer hands it to TimelineWriter.save
+    def make_row(timeline_id: int, line_number: int | None, event: str = 'line', frame_id: int = 0, **columns) -> dict:
+        row = dict.fromkeys(TIMELINE_COLUMNS)
+        row.update(
+            id=timeline_id,
+            event=event,
+            file=FILE,
+            frame_id=frame_id,
+            function='<module>',
+            target='<module>' if event == 'call' else None,
+            line_number=line_number,
+            global_diff='{}',
+            local_diff='{}',
+            thread_id=0,
+            blobs=[]
+        )
+        row.update(columns)
+        return row
+    return make_row
+
+def record(writer, keyframes, row: dict, global_changes: dict, local_changes: dict | None = None) -> None:
+    # encodes the changed values like the tracer's serialize_data, large ones into writer.blobs, and saves
+    # the row with its variable_changes and, when one is due, a keyframe
+    variable_changes = []
+    diffs = {}
+    for scope, changes in (('global', global_changes), ('local', local_changes or {})):
+        diff = diffs[scope] = {}
+        stored = []
+        for name, value in changes.items():
+            value_json = stored_json = json.dumps(value)
+            digest = None
+            if len(value_json) >= writer.blobs.min_size:
+                digest = writer.blobs.put(value_json)
+                row['blobs'].append(digest)
+                stored_json = f'"<blob:{digest}>"'
+            text = f'{json.dumps(name)}: {stored_json}'
+            stored.append(text)
+            diff[name] = None if value == "<deleted>" else (text, digest)
+            variable_changes.append((row['file'], row['id'], scope, name, stored_json))
+        row[f'{scope}_diff'] = '{' + ', '.join(stored) + '}'
+    writer.save(row, variable_changes, keyframes.apply(row, diffs['global'], diffs['local']))
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+from conftest import FILE
+from utils.branches import BRANCH_PATH, ON_PATH, BranchFollower, branch_path
+from utils.line_stats import path_line_stats
+from utils.timeline_writer import TimelineWriter
+
+def run(writer: TimelineWriter, follower: BranchFollower, rows: list[dict]) -> None:
+    # places and saves rows the way the tracer's handle_data does
+    for row in rows:
+        write = follower.place(writer.connect(), row, writer.new_branch)
+        writer.save(row, write=write, branch_id=follower.branch_id)
+    writer.flush()
+
+def path_rows(database, branch_id: int) -> list[tuple[int, int, int]]:
+    # (id, branch_id, line_number) along a branch's path
+    with sqlite3.connect(database) as db_connection:
+        return db_connection.execute(
+            f"""
+            {BRANCH_PATH}
+            SELECT timeline.id, timeline.branch_id, timeline.line_number
+            FROM path
+            {ON_PATH.format(table='timeline', id='id')}
+            ORDER BY timeline.id ASC
+            """,
+            {"file": FILE, "branch_id": branch_id}
+        ).fetchall()
+
+def lines(database, branch_id: int) -> list[int]:
+    return [line_number for _, _, line_number in path_rows(database, branch_id)]
+
+@pytest.fixture
+def first_run(database, make_row):
+    # ids 0..9 on the root branch, row n at line n
+    writer = TimelineWriter(database)
+    follower = BranchFollower()
+    run(writer, follower, [make_row(0, 0, 'call')] + [make_row(n, n) for n in range(1, 10)])
+    return writer, follower
+
+def test_jump_back_and_diverge_keeps_both_paths(database, make_row, first_run):
+    writer, follower = first_run
+
+    # jump back to id 4: ids 5 and 6 are reproduced, id 7 differs and forks a branch off id 6
+    follower.follow(writer.connect(), FILE, 0)
+    run(writer, follower, [make_row(5, 5), make_row(6, 6)] + [make_row(n, 10 + n) for n in range(7, 11)])
+
+    assert follower.branch_id == 1
+    assert branch_path(writer.connect().cursor(), FILE, 1) == [(0, 0, 6), (1, 7, 9223372036854775807)]
+    assert lines(database, 0) == list(range(10))
+    assert lines(database, 1) == [0, 1, 2, 3, 4, 5, 6, 17, 18, 19, 20]
+    assert [branch_id for _, branch_id, _ in path_rows(database, 1)] == [0] * 7 + [1] * 4
+
+    # jump back to id 2 on the new branch's path, it forks again off the root branch it shares there
+    follower.follow(writer.connect(), FILE, 1)
+    run(writer, follower, [make_row(3, 3), make_row(4, 4), make_row(5, 5), make_row(6, 26), make_row(7, 27)])
+
+    assert follower.branch_id == 2
+    assert branch_path(writer.connect().cursor(), FILE, 2) == [(0, 0, 5), (2, 6, 9223372036854775807)]
+    assert lines(database, 0) == list(range(10))
+    assert lines(database, 1) == [0, 1, 2, 3, 4, 5, 6, 17, 18, 19, 20]
+    assert lines(database, 2) == [0, 1, 2, 3, 4, 5, 26, 27]
+
+    # reproduced rows were not written again, every stored row is counted once
+    cursor = writer.connect().cursor()
+    assert {line: stats['hits'] for line, stats in path_line_stats(cursor, FILE, 0, 9).items()} == {0: 0, **dict.fromkeys(range(1, 10), 1)}
+    assert {line: stats['hits'] for line, stats in path_line_stats(cursor, FILE, 1, 10).items()} == {0: 0, **dict.fromkeys([1, 2, 3, 4, 5, 6, 17, 18, 19, 20], 1)}
+    writer.close()
+
+def test_following_past_the_end_grows_the_branch(database, make_row, first_run):
+    writer, follower = first_run
+
+    follower.follow(writer.connect(), FILE, 0)
+    run(writer, follower, [make_row(8, 8), make_row(9, 9), make_row(10, 10)])
+
+    assert follower.branch_id == 0
+    assert lines(database, 0) == list(range(11))
+    assert writer.connect().execute("SELECT COUNT(*) FROM branches").fetchone() == (1,)
+    writer.close()
+
+def test_writing_a_stored_row_again_fails(database, make_row, first_run):
+    writer, follower = first_run
+
+    writer.save(make_row(5, 50, branch_id=0))
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.flush()
+
+    assert lines(database, 0) == list(range(10))
+    writer.close()
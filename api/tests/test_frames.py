@@ -0,0 +1,179 @@
+import sys
+from itertools import count
+
+from utils.frames import FrameIds
+
+TRACED = {'consume', 'close_early', 'close_plain', 'leave_suspended', 'drive', 'gen', 'guarded', 'job'}
+
+def gen(n):
+    for i in range(n):
+        yield i
+
+def guarded(n):
+    # from 3.13 on a generator suspended outside any try block is closed without running it
+    try:
+        for i in range(n):
+            yield i
+    finally:
+        n = 0
+
+class Tick:
+    def __await__(self):
+        yield
+
+async def job():
+    await Tick()
+    await Tick()
+    return 1
+
+def consume():
+    return list(gen(2))
+
+def close_early():
+    g = guarded(3)
+    next(g)
+    g.close()
+
+def close_plain():
+    g = gen(3)
+    next(g)
+    g.close()
+
+suspended = []
+
+def leave_suspended():
+    g = gen(3)
+    next(g)
+    suspended.append(g) # closed when the test is done, not while it is still traced
+
+def drive():
+    coroutine = job()
+    try:
+        while True:
+            coroutine.send(None)
+    except StopIteration:
+        pass
+
+# from 3.12 on settrace reports the StopIteration of an awaited iterator that finished in the awaiting frame
+STOP_ITERATION = [('exception', 'job')] if sys.version_info >= (3, 12) else []
+
+def trace(function) -> tuple[list[tuple], FrameIds]:
+    # (event, function, frame id, parent frame id) of the traced functions' events, named the way
+    # the tracer's settrace backend names them
+    frame_ids = FrameIds()
+    ids = count()
+    events = []
+
+    def tracer(frame, event, arg):
+        if frame.f_code.co_name not in TRACED:
+            return None
+        event = frame_ids.settrace_event(frame, event, arg)
+        info = frame_ids.get(frame, event, next(ids), frame.f_code.co_name, __file__)
+        if event != 'line':
+            events.append((event, frame.f_code.co_name, info['id'], info['parent_id']))
+        if event == 'return':
+            frame_ids.leave(frame)
+        return tracer
+
+    sys.settrace(tracer)
+    try:
+        function()
+    finally:
+        sys.settrace(None)
+    return events, frame_ids
+
+def shape(events: list[tuple]) -> list[tuple[str, str]]:
+    return [(event, function) for event, function, _, _ in events]
+
+def frames(events: list[tuple]) -> dict[str, set[tuple[int, int | None]]]:
+    # function -> the (frame id, parent frame id) pairs its events were numbered with
+    numbered = {}
+    for _, function, frame_id, parent_id in events:
+        numbered.setdefault(function, set()).add((frame_id, parent_id))
+    return numbered
+
+def test_generator_keeps_its_frame_id_across_suspends():
+    events, frame_ids = trace(consume)
+
+    assert shape(events) == [
+        ('call', 'consume'),
+        ('call', 'gen'),
+        ('suspend', 'gen'),
+        ('resume', 'gen'),
+        ('suspend', 'gen'),
+        ('resume', 'gen'),
+        ('return', 'gen'),
+        ('return', 'consume'),
+    ]
+    assert frames(events) == {'consume': {(0, None)}, 'gen': {(events[1][2], 0)}}
+    assert frame_ids.open == {}
+
+def test_closed_generator_returns_instead_of_suspending():
+    events, frame_ids = trace(close_early)
+
+    # GeneratorExit leaves through the yield, which is not a suspend
+    assert shape(events) == [
+        ('call', 'close_early'),
+        ('call', 'guarded'),
+        ('suspend', 'guarded'),
+        ('resume', 'guarded'),
+        ('exception', 'guarded'),
+        ('return', 'guarded'),
+        ('return', 'close_early'),
+    ]
+    assert frames(events) == {'close_early': {(0, None)}, 'guarded': {(events[1][2], 0)}}
+    assert frame_ids.open == {}
+
+def test_closed_generator_leaves_through_its_yield():
+    events, frame_ids = trace(close_plain)
+
+    if sys.version_info >= (3, 13):
+        # not run again, its frame stays open until another frame is allocated in its place
+        assert shape(events) == [('call', 'close_plain'), ('call', 'gen'), ('suspend', 'gen'), ('return', 'close_plain')]
+        return
+
+    # GeneratorExit is raised at the yield and ends the frame there, the return is not a suspend
+    assert shape(events) == [
+        ('call', 'close_plain'),
+        ('call', 'gen'),
+        ('suspend', 'gen'),
+        ('resume', 'gen'),
+        ('exception', 'gen'),
+        ('return', 'gen'),
+        ('return', 'close_plain'),
+    ]
+    assert frame_ids.open == {}
+
+def test_suspended_generator_stays_open():
+    events, frame_ids = trace(leave_suspended)
+    suspended.pop().close()
+
+    assert shape(events)[-2:] == [('suspend', 'gen'), ('return', 'leave_suspended')]
+    assert list(frame_ids.open.values()) == [{
+        "id": events[1][2],
+        "parent_id": 0,
+        "depth": 1,
+        "function": 'gen',
+        "source_file": __file__,
+        "suspends": True,
+        "raised": False
+    }]
+
+def test_coroutine_suspends_on_each_await():
+    events, frame_ids = trace(drive)
+
+    assert shape(events) == [
+        ('call', 'drive'),
+        ('call', 'job'),
+        ('suspend', 'job'),
+        ('resume', 'job'),
+        *STOP_ITERATION,
+        ('suspend', 'job'),
+        ('resume', 'job'),
+        *STOP_ITERATION,
+        ('return', 'job'),
+        ('exception', 'drive'),
+        ('return', 'drive'),
+    ]
+    assert frames(events) == {'drive': {(0, None)}, 'job': {(events[1][2], 0)}}
+    assert frame_ids.open == {}
@@ -0,0 +1,121 @@
+import json
+import sqlite3
+
+import pytest
+
+from conftest import FILE, record
+from utils.branches import BRANCH_PATH, ON_PATH, BranchFollower
+from utils.content_store import BlobReader
+from utils.keyframes import ScopeKeyframes, apply_diff
+from utils.retention import keyframe_at
+from utils.timeline_writer import TimelineWriter
+
+LARGE = ['a long value'] * 40 # stored as a blob
+
+def steps(first_id: int, count: int, offset: int = 0) -> list[tuple[int, dict, dict]]:
+    # (id, global changes, local changes): values that change, grow into blobs, get deleted and come back
+    return [
+        (
+            timeline_id,
+            {
+                "n": timeline_id + offset,
+                **({"big": LARGE + [timeline_id]} if timeline_id % 4 == 1 else {}),
+                **({"big": "<deleted>"} if timeline_id % 4 == 3 else {})
+            },
+            {"i": timeline_id % 3} if timeline_id % 2 else {}
+        )
+        for timeline_id in range(first_id, first_id + count)
+    ]
+
+def returned(timeline_id: int) -> str | None:
+    return str(timeline_id) if timeline_id % 5 == 4 else None
+
+def replay(db_connection: sqlite3.Connection, branch_id: int, timeline_id: int) -> dict:
+    # every diff from the first row on, without keyframes
+    blobs = BlobReader(db_connection)
+    scope_globals, scope_locals, return_value = {}, {}, None
+    rows = db_connection.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT timeline.global_diff, timeline.local_diff, timeline.return_value
+        FROM path
+        {ON_PATH.format(table='timeline', id='id')}
+        WHERE timeline.id <= :timeline_id
+        ORDER BY timeline.id ASC
+        """,
+        {"file": FILE, "branch_id": branch_id, "timeline_id": timeline_id}
+    )
+    for global_diff, local_diff, row_return_value in rows:
+        apply_diff(scope_globals, json.loads(blobs.expand(global_diff)))
+        apply_diff(scope_locals, json.loads(blobs.expand(local_diff)))
+        if row_return_value is not None:
+            return_value = row_return_value
+    return {"globals": scope_globals, "locals": scope_locals, "return_value": return_value}
+
+def rebuilt(db_connection: sqlite3.Connection, branch_id: int, timeline_id: int) -> dict:
+    keyframe = keyframe_at(db_connection, FILE, branch_id, timeline_id)
+    return {
+        "globals": json.loads(keyframe['globals']),
+        "locals": json.loads(keyframe['locals']),
+        "return_value": keyframe['return_value']
+    }
+
+@pytest.fixture
+def traced(database, make_row):
+    # ids 0..19 on the root branch, a keyframe after every third event
+    writer = TimelineWriter(database)
+    keyframes = ScopeKeyframes(every=3)
+    for timeline_id, global_changes, local_changes in steps(0, 20):
+        row = make_row(timeline_id, timeline_id, branch_id=0, return_value=returned(timeline_id))
+        record(writer, keyframes, row, global_changes, local_changes)
+    writer.flush()
+    return writer, keyframes
+
+def test_keyframes_are_taken_every_few_events(traced):
+    writer, _ = traced
+
+    assert writer.connect().execute("SELECT timeline_id FROM keyframes ORDER BY timeline_id").fetchall() == [
+        (timeline_id,) for timeline_id in range(2, 20, 3)
+    ]
+    writer.close()
+
+def test_keyframe_and_later_diffs_match_a_full_replay(traced):
+    writer, _ = traced
+    db_connection = writer.connect()
+
+    for timeline_id in range(20):
+        assert rebuilt(db_connection, 0, timeline_id) == replay(db_connection, 0, timeline_id)
+
+    # the scope holds a blob's value, not the reference the stored diff has
+    assert rebuilt(db_connection, 0, 17)['globals']['big'] == LARGE + [17]
+    assert 'big' not in rebuilt(db_connection, 0, 19)['globals']
+    writer.close()
+
+def test_a_branch_rebuilds_from_its_parents_keyframes(traced, make_row):
+    writer, _ = traced
+
+    # re-executed from id 6 with the tracer's scope as it was there, the run differs from id 7 on
+    follower = BranchFollower()
+    follower.follow(writer.connect(), FILE, 0)
+    keyframes = ScopeKeyframes(every=3)
+    for timeline_id, global_changes, local_changes in steps(0, 7):
+        keyframes.apply(make_row(timeline_id, None, return_value=returned(timeline_id)), *(
+            {name: None if value == "<deleted>" else (f'{json.dumps(name)}: {json.dumps(value)}', None) for name, value in changes.items()}
+            for changes in (global_changes, local_changes)
+        ))
+    for timeline_id, global_changes, local_changes in steps(7, 8, offset=100):
+        row = make_row(timeline_id, timeline_id + 100, return_value=returned(timeline_id))
+        follower.place(writer.connect(), row, writer.new_branch)
+        record(writer, keyframes, row, global_changes, local_changes)
+    writer.flush()
+
+    assert follower.branch_id == 1
+    db_connection = writer.connect()
+    assert db_connection.execute("SELECT branch_id, timeline_id FROM keyframes WHERE branch_id = 1").fetchall() == [
+        (1, 8), (1, 11), (1, 14)
+    ]
+    for timeline_id in range(15):
+        assert rebuilt(db_connection, 1, timeline_id) == replay(db_connection, 1, timeline_id)
+    assert rebuilt(db_connection, 1, 14)['globals']['n'] == 114
+    assert rebuilt(db_connection, 0, 14)['globals']['n'] == 14
+    writer.close()
@@ -0,0 +1,92 @@
+import json
+import sqlite3
+
+import pytest
+
+from conftest import FILE, record
+from utils.content_store import BlobPacker, branch_blob_refs, collect_blobs
+from utils.keyframes import ScopeKeyframes
+from utils.retention import keyframe_at, thin
+from utils.timeline_writer import TimelineWriter
+
+LARGE = ['a long value'] * 40 # stored as a blob
+
+def changes(timeline_id: int) -> dict:
+    # a blob every fourth event, deleted two events later
+    return {
+        "n": timeline_id,
+        **({"big": LARGE + [timeline_id]} if timeline_id % 4 == 1 else {}),
+        **({"big": "<deleted>"} if timeline_id % 4 == 3 else {})
+    }
+
+def scopes(db_connection: sqlite3.Connection, branch_id: int, timeline_ids) -> dict:
+    return {
+        timeline_id: json.loads(keyframe_at(db_connection, FILE, branch_id, timeline_id)['globals'])
+        for timeline_id in timeline_ids
+    }
+
+def blob(timeline_id: int) -> str:
+    return BlobPacker().put(json.dumps(LARGE + [timeline_id]))
+
+@pytest.fixture
+def traced(database, make_row):
+    # ids 0..19 on the root branch with a keyframe every fifth event and images at ids 3 and 15;
+    # branch 1 forks off id 6 and runs on to id 10
+    writer = TimelineWriter(database)
+    keyframes = ScopeKeyframes(every=5)
+    for timeline_id in range(20):
+        checkpoint = {3: 1, 15: 2}.get(timeline_id)
+        record(writer, keyframes, make_row(timeline_id, timeline_id, branch_id=0, checkpoint=checkpoint), changes(timeline_id))
+
+    branch_id = writer.new_branch(FILE, 0, 6)
+    keyframes = ScopeKeyframes(every=100)
+    for timeline_id in range(7, 11):
+        record(writer, keyframes, make_row(timeline_id, 100 + timeline_id, branch_id=branch_id), {"m": timeline_id})
+    writer.flush()
+    return writer
+
+def test_thin_keeps_keyframes_and_the_scope_of_every_kept_step(traced):
+    writer = traced
+    db_connection = writer.connect()
+
+    before = scopes(db_connection, 0, range(12, 20))
+    branch_before = scopes(db_connection, 1, range(7, 11))
+
+    dropped = thin(db_connection, FILE, 0, 12, BlobPacker())
+
+    # the keyframes taken while tracing, one at the cutoff and one where branch 1 forks off
+    assert db_connection.execute("SELECT id FROM timeline WHERE branch_id = 0 AND id < 12 ORDER BY id").fetchall() == [
+        (4,), (6,), (9,)
+    ]
+    assert db_connection.execute("SELECT timeline_id FROM keyframes WHERE branch_id = 0 ORDER BY timeline_id").fetchall() == [
+        (4,), (6,), (9,), (12,), (14,), (19,)
+    ]
+    assert db_connection.execute("SELECT COUNT(*) FROM variable_changes WHERE branch_id = 0 AND timeline_id < 12 AND timeline_id NOT IN (4, 6, 9)").fetchone() == (0,)
+
+    # nothing before the cutoff can be restored, the image at id 15 stays
+    assert dropped == [1]
+    assert db_connection.execute("SELECT id, checkpoint FROM timeline WHERE checkpoint IS NOT NULL").fetchall() == [(15, 2)]
+
+    assert scopes(db_connection, 0, range(12, 20)) == before
+    assert scopes(db_connection, 1, range(7, 11)) == branch_before
+    assert db_connection.execute("SELECT COUNT(*) FROM timeline WHERE branch_id = 1").fetchone() == (4,)
+
+    # thinned again, there is nothing left to drop
+    assert thin(db_connection, FILE, 0, 12, BlobPacker()) is None
+    writer.close()
+
+def test_thin_recounts_blob_refs(traced):
+    writer = traced
+    db_connection = writer.connect()
+
+    thin(db_connection, FILE, 0, 12, BlobPacker())
+
+    refs = {(branch_id, digest) for branch_id, digest in db_connection.execute("SELECT branch_id, hash FROM blob_refs WHERE file = ?", (FILE,))}
+    assert refs == {(branch_id, digest) for _, branch_id, digest in branch_blob_refs(db_connection.cursor(), FILE)}
+
+    # id 1's blob was only referred to by dropped rows, id 5's is still held by the keyframe at the fork
+    assert {digest for _, digest in refs} == {blob(5), blob(9), blob(13), blob(17)}
+
+    assert collect_blobs(db_connection) == 1
+    assert {digest for digest, in db_connection.execute("SELECT hash FROM blobs")} == {blob(5), blob(9), blob(13), blob(17)}
+    writer.close()
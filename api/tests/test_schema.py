@@ -0,0 +1,154 @@
+import json
+import sqlite3
+
+from utils.schema import SCHEMA_VERSION, create_tables
+from utils.sessions import DEFAULT_SESSION
+from utils.timeline_writer import TimelineWriter
+
+# the three tables trace.db started out with, before the schema was versioned
+BASELINE_TABLES = '''
+    CREATE TABLE files (
+        file TEXT NOT NULL,
+        timeline_id INTEGER,
+        line_number INTEGER,
+        PRIMARY KEY (file)
+    );
+
+    CREATE TABLE state (
+        id INTEGER CHECK (id = 1),
+        file TEXT,
+        PRIMARY KEY (id)
+        FOREIGN KEY (file)
+            REFERENCES files(file)
+            ON DELETE SET NULL
+    );
+
+    CREATE TABLE timeline (
+        file TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        event TEXT,
+        target TEXT,
+        return_value TEXT,
+        frame_id INTEGER,
+        function TEXT,
+        line_number INTEGER,
+        source_segment TEXT,
+        global_diff TEXT,
+        local_diff TEXT,
+        traceback TEXT,
+        error TEXT,
+        PRIMARY KEY (file, id),
+        FOREIGN KEY (file)
+            REFERENCES files(file)
+            ON DELETE CASCADE
+    );
+'''
+
+BASELINE_ROWS = [
+    # id, event, line_number, global_diff, local_diff, error
+    (0, 'call', 0, '{}', '{}', None),
+    (1, 'line', 1, '{"x": 1}', '{}', None),
+    (2, 'line', 2, '{"x": 2, "y": [1, 2]}', '{}', None),
+    (3, 'line', 1, '{"y": "<deleted>"}', '{}', None),
+    (4, 'exception', 2, '{}', '{}', 'ValueError: 2'),
+]
+
+def baseline_database(path) -> None:
+    with sqlite3.connect(path) as db_connection:
+        db_connection.executescript(BASELINE_TABLES)
+        db_connection.execute("INSERT INTO files (file, timeline_id, line_number) VALUES ('main', 3, 1)")
+        db_connection.execute("INSERT INTO state (id, file) VALUES (1, 'main')")
+        db_connection.executemany(
+            """
+            INSERT INTO timeline (file, id, event, frame_id, function, line_number, global_diff, local_diff, error)
+            VALUES ('main', ?, ?, 7, '<module>', ?, ?, ?, ?)
+            """,
+            BASELINE_ROWS
+        )
+
+def test_baseline_database_migrates_to_the_current_schema(tmp_path):
+    database = tmp_path / 'trace.db'
+    baseline_database(database)
+
+    create_tables(database)
+
+    with sqlite3.connect(database) as db_connection:
+        cursor = db_connection.cursor()
+
+        assert cursor.execute("PRAGMA user_version").fetchone() == (SCHEMA_VERSION,)
+        assert cursor.execute("PRAGMA auto_vacuum").fetchone() == (2,)
+
+        # every row kept, on the root branch, with the columns added since
+        assert cursor.execute(
+            """
+            SELECT id, branch_id, event, line_number, global_diff, error, checkpoint, parked, thread_id
+            FROM timeline
+            ORDER BY id
+            """
+        ).fetchall() == [
+            (timeline_id, 0, event, line_number, global_diff, error, None, None, 0)
+            for timeline_id, event, line_number, global_diff, _, error in BASELINE_ROWS
+        ]
+        assert cursor.execute("SELECT file, id, parent_id, fork_id FROM branches").fetchall() == [('main', 0, None, -1)]
+        assert cursor.execute("SELECT file, timeline_id, branch_id, line_number FROM files").fetchall() == [('main', 3, 0, 1)]
+        assert cursor.execute("SELECT id, file FROM sessions").fetchall() == [(DEFAULT_SESSION, 'main')]
+
+        # the diffs are normalised into one row per name
+        assert cursor.execute(
+            """
+            SELECT branch_id, timeline_id, scope, name, value
+            FROM variable_changes
+            ORDER BY timeline_id, name
+            """
+        ).fetchall() == [
+            (0, 1, 'global', 'x', '1'),
+            (0, 2, 'global', 'x', '2'),
+            (0, 2, 'global', 'y', json.dumps([1, 2])),
+            (0, 3, 'global', 'y', json.dumps("<deleted>")),
+        ]
+
+        # counted once from the stored rows, rows from before source_file count as main.py
+        assert cursor.execute(
+            """
+            SELECT source_file, line_number, hits, exceptions, first_id, last_id, last_frame_id
+            FROM line_stats
+            ORDER BY line_number
+            """
+        ).fetchall() == [
+            ('main.py', 0, 0, 0, 0, 0, 7),
+            ('main.py', 1, 2, 0, 1, 3, 7),
+            ('main.py', 2, 1, 1, 2, 4, 7),
+        ]
+
+        assert cursor.execute("SELECT COUNT(*) FROM blob_refs").fetchone() == (0,)
+
+        indexes = {name for name, in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'")}
+        assert {'timeline_line_number', 'timeline_frame_id', 'timeline_function', 'variable_changes_name', 'branches_parent_id', 'blob_refs_hash'} <= indexes
+
+def test_migrating_again_changes_nothing(tmp_path):
+    database = tmp_path / 'trace.db'
+    baseline_database(database)
+    create_tables(database)
+
+    with sqlite3.connect(database) as db_connection:
+        before = db_connection.execute("SELECT * FROM timeline ORDER BY id").fetchall()
+
+    create_tables(database)
+
+    with sqlite3.connect(database) as db_connection:
+        assert db_connection.execute("SELECT * FROM timeline ORDER BY id").fetchall() == before
+        assert db_connection.execute("SELECT COUNT(*) FROM variable_changes").fetchone() == (4,)
+
+def test_migrated_database_takes_new_rows(tmp_path, make_row):
+    database = tmp_path / 'trace.db'
+    baseline_database(database)
+    create_tables(database)
+
+    writer = TimelineWriter(database)
+    writer.save(make_row(5, 3, branch_id=0), [('main', 5, 'global', 'x', '3')])
+    writer.close()
+
+    with sqlite3.connect(database) as db_connection:
+        assert db_connection.execute("SELECT MAX(id) FROM timeline WHERE branch_id = 0").fetchone() == (5,)
+        assert db_connection.execute("SELECT timeline_id, line_number FROM files").fetchone() == (5, 3)
+        assert db_connection.execute("SELECT hits FROM line_stats WHERE line_number = 3").fetchone() == (1,)
@@ -1,41 +1,181 @@
 #!/usr/bin/env python3
 
+import json
+import os
 from ast import parse, walk, Import, ImportFrom, stmt, get_source_segment
+from collections import OrderedDict
+from hashlib import sha256
 from pathlib import Path
 
-def find_python_imports(script_path: Path) -> set[Path]:
-    script_dir = script_path.parent
-    source_code = script_path.read_text()
-    ast_tree = parse(source_code, filename=script_path.name)
-    script_paths = {script_path}
-
-    for node in walk(ast_tree):
-        if isinstance(node, (Import, ImportFrom)):
-            base_name = node.module if isinstance(node, ImportFrom) else None
-            for alias in node.names:
-                name = base_name or alias.name
-                candidate = script_dir.joinpath(*name.split('.')).with_suffix('.py')
-                if candidate.exists():
-                    script_paths.add(candidate)
-
-    return script_paths
+from utils.sessions import TRACE_HOME
 
-def get_source_code_cache(script_path: Path):
-    source_code = script_path.read_text()
+SOURCE_INDEX_DIR = TRACE_HOME / '_source_index'
+SOURCE_INDEX_VERSION = 2 # bump when the index layout changes
+
+SOURCE_INDEX_CACHE_SIZE = 64 # parsed versions kept in memory, the API sees every upload of every session
+
+_source_indexes = OrderedDict() # content key -> index, least recently used first
+
+def build_source_index(source_code: str, filename: str) -> dict:
     script_lines = source_code.splitlines()
-    ast_tree = parse(source_code, filename=script_path.name)
-    
+    try:
+        nodes = walk(parse(source_code, filename=filename))
+    except SyntaxError:
+        nodes = () # still laid out as plain lines, compiling it reports the error
+
     stmt_lines = {}
-    for node in walk(ast_tree):
+    imports = []
+    for node in nodes:
         if isinstance(node, stmt):
             segment = get_source_segment(source_code, node)
             stmt_lines[node.lineno] = segment
-    
-    source_code_cache = {}
-    for lineno, line in enumerate(script_lines, start=1):
-        if lineno in stmt_lines:
-            source_code_cache[lineno] = {'segment': stmt_lines[lineno]}
+        if isinstance(node, Import):
+            imports.extend([alias.name, [], 0] for alias in node.names)
+        elif isinstance(node, ImportFrom):
+            imports.append([node.module or '', [alias.name for alias in node.names], node.level])
+
+    return {
+        # one [kind, text] per line, kind is 'segment' for a statement start and 'line' otherwise
+        "lines": [
+            ['segment', stmt_lines[lineno]] if lineno in stmt_lines else ['line', line]
+            for lineno, line in enumerate(script_lines, start=1)
+        ],
+        "imports": imports, # [module, imported names, relative level]
+        # [line number, text] of every line shown as a node
+        "nodes": [
+            [lineno, line]
+            for lineno, line in enumerate(script_lines, start=1)
+            if line.strip() and line.lstrip()[0] != '#'
+        ]
+    }
+
+def source_index(source_code: str, filename: str = '<unknown>') -> dict:
+    # keyed by content, so the API and every tracer process share one parse per version of a file
+    key = sha256(f"{SOURCE_INDEX_VERSION}\n{source_code}".encode()).hexdigest()
+
+    if key in _source_indexes:
+        _source_indexes.move_to_end(key)
+        return _source_indexes[key]
+
+    index_path = SOURCE_INDEX_DIR / f'{key}.json'
+
+    try:
+        index = json.loads(index_path.read_text())
+    except (OSError, ValueError):
+        index = build_source_index(source_code, filename)
+        try:
+            SOURCE_INDEX_DIR.mkdir(exist_ok=True)
+            temporary_path = index_path.with_suffix(f'.{os.getpid()}.tmp')
+            temporary_path.write_text(json.dumps(index))
+            os.replace(temporary_path, index_path)
+        except OSError:
+            pass # still usable from memory
+
+    _source_indexes[key] = index
+    if len(_source_indexes) > SOURCE_INDEX_CACHE_SIZE:
+        _source_indexes.popitem(last=False) # an older version stays on disk
+    return index
+
+def module_name(root: Path, path: Path) -> tuple[list[str], bool]:
+    parts = list(path.relative_to(root).with_suffix('').parts)
+    if parts[-1] == '__init__':
+        return parts[:-1], True
+    return parts, False
+
+def imported_modules(root: Path, path: Path, imports: list) -> list[str]:
+    # every dotted module an import statement may execute, including parent packages
+    parts, is_package = module_name(root, path)
+    package = parts if is_package else parts[:-1]
+
+    modules = []
+    for module, names, level in imports:
+        if level:
+            if level - 1 > len(package):
+                continue # beyond the top-level package
+            base = package[:len(package) - (level - 1)]
         else:
-            source_code_cache[lineno] = {'line': line}
-    
-    return source_code_cache
+            base = []
+        base = base + (module.split('.') if module else [])
+
+        modules.extend('.'.join(base[:end]) for end in range(1, len(base) + 1))
+        modules.extend('.'.join(base + [name]) for name in names if name != '*')
+
+    return list(dict.fromkeys(modules))
+
+def resolve_module(root: Path, module: str) -> Path | None:
+    base = root.joinpath(*module.split('.'))
+    for candidate in (base / '__init__.py', base.with_suffix('.py')):
+        if candidate.is_file():
+            return candidate
+
+class ModuleGraph:
+    # per-file dependencies kept with the file's mtime and size, unchanged files are not read again
+    def __init__(self, graph_path: Path = SOURCE_INDEX_DIR / 'module_graph.json'):
+        self.graph_path = graph_path
+        try:
+            self.entries = json.loads(graph_path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+        self.changed = False
+
+    def dependencies(self, root: Path, path: Path) -> list[str]:
+        stat = path.stat()
+        entry = self.entries.get(str(path))
+        if entry and entry['root'] == str(root) and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['modules']
+
+        index = source_index(path.read_text(), path.name)
+        modules = imported_modules(root, path, index['imports'])
+        self.entries[str(path)] = {
+            "root": str(root),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "modules": modules
+        }
+        self.changed = True
+        return modules
+
+    def walk(self, script_path: Path) -> dict[Path, set[Path]]:
+        root = script_path.parent
+        graph = {}
+        pending = [script_path]
+
+        while pending:
+            path = pending.pop()
+            if path in graph:
+                continue
+            graph[path] = {
+                dependency
+                for module in self.dependencies(root, path)
+                if (dependency := resolve_module(root, module)) is not None
+            }
+            pending.extend(graph[path] - graph.keys())
+
+        return graph
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        try:
+            SOURCE_INDEX_DIR.mkdir(exist_ok=True)
+            temporary_path = self.graph_path.with_suffix(f'.{os.getpid()}.tmp')
+            temporary_path.write_text(json.dumps(self.entries))
+            os.replace(temporary_path, self.graph_path)
+            self.changed = False
+        except OSError:
+            pass
+
+def find_python_imports(script_path: Path) -> set[Path]:
+    # the script and every file under its directory it imports, directly or not
+    module_graph = ModuleGraph()
+    graph = module_graph.walk(script_path)
+    module_graph.save()
+    return set(graph)
+
+def get_source_code_cache(script_path: Path):
+    index = source_index(script_path.read_text(), script_path.name)
+
+    return {
+        lineno: {kind: text}
+        for lineno, (kind, text) in enumerate(index['lines'], start=1)
+    }
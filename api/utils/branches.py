@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+ROOT_BRANCH = 0
+
+# the segments (branch_id, first_id, last_id) of the path from the root to :branch_id; a branch holds
+# its own rows after fork_id and shares everything up to fork_id with its parent
+BRANCH_PATH = """
+    WITH RECURSIVE path (branch_id, parent_id, first_id, last_id) AS (
+        SELECT id, parent_id, fork_id + 1, 9223372036854775807
+        FROM branches
+        WHERE file = :file
+          AND id = :branch_id
+        UNION ALL
+        SELECT branches.id, branches.parent_id, branches.fork_id + 1, path.first_id - 1
+        FROM path
+        JOIN branches
+          ON branches.file = :file
+         AND branches.id = path.parent_id
+    )
+"""
+
+# rows of one branch's path, BRANCH_PATH has to come first in the query
+ON_PATH = """
+    CROSS JOIN {table}
+       ON {table}.file = :file
+      AND {table}.branch_id = path.branch_id
+      AND {table}.{id} BETWEEN path.first_id AND path.last_id
+"""
+
+def branch_path(cursor: sqlite3.Cursor, file: str, branch_id: int) -> list[tuple[int, int, int]]:
+    # oldest segment first
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT branch_id, first_id, last_id
+        FROM path
+        ORDER BY first_id ASC
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id
+        }
+    )
+    return cursor.fetchall()
+
+def branch_at(path: list[tuple[int, int, int]], timeline_id: int) -> int | None:
+    # the branch a path takes timeline_id's row from
+    for branch_id, first_id, last_id in path:
+        if first_id <= timeline_id <= last_id:
+            return branch_id
+    return None
+
+def on_path(path: list[tuple[int, int, int]], branch_id: int, timeline_id: int) -> bool:
+    return any(
+        segment_branch_id == branch_id and first_id <= timeline_id <= last_id
+        for segment_branch_id, first_id, last_id in path
+    )
+
+def shared_until(path: list[tuple[int, int, int]], other_path: list[tuple[int, int, int]]) -> int:
+    # the last timeline id both paths have in common
+    shared = -1
+    for (branch_id, _, last_id), (other_branch_id, _, other_last_id) in zip(path, other_path):
+        if branch_id != other_branch_id:
+            break
+        shared = min(last_id, other_last_id)
+        if last_id != other_last_id:
+            break
+    return shared
+
+class BranchFollower:
+    # after a jump the tracer re-executes a stored path: rows it reproduces are not written again,
+    # the first one that differs starts a new branch instead of overwriting the old future
+    SIGNATURE = ('event', 'line_number', 'function', 'source_file', 'global_diff', 'local_diff', 'return_value', 'error')
+
+    def __init__(self, read_ahead: int = 1000):
+        self.read_ahead = read_ahead
+
+        self.file = None
+        self.branch_id = ROOT_BRANCH
+        self.path = []
+        self.following = False
+        self.ahead = {} # timeline id -> (branch_id, checkpoint, signature) of the stored rows read ahead
+        self.checkpoint = None # image of the last placed row when it was reproduced, shared instead of dumped again
+
+    def follow(self, db_connection: sqlite3.Connection, file: str, branch_id: int) -> None:
+        self.file = file
+        self.branch_id = branch_id
+        self.path = branch_path(db_connection.cursor(), file, branch_id)
+        self.following = True
+        self.ahead = {}
+
+    def _read(self, db_connection: sqlite3.Connection, timeline_id: int) -> None:
+        cursor = db_connection.cursor()
+
+        self.ahead = {}
+        for branch_id, first_id, last_id in self.path:
+            if last_id < timeline_id:
+                continue
+            cursor.execute(
+                """
+                SELECT id, branch_id, checkpoint, event, line_number, function, source_file,
+                       global_diff, local_diff, return_value, error
+                FROM timeline
+                WHERE file = :file
+                  AND branch_id = :branch_id
+                  AND id >= :first_id
+                  AND id <= :last_id
+                ORDER BY id ASC
+                LIMIT :limit
+                """,
+                {
+                    "file": self.file,
+                    "branch_id": branch_id,
+                    "first_id": max(first_id, timeline_id),
+                    "last_id": last_id,
+                    "limit": self.read_ahead - len(self.ahead)
+                }
+            )
+            # diffs are compared as stored, the tracer packs large values into the same blob references
+            for stored_id, stored_branch_id, checkpoint, *signature in cursor.fetchall():
+                self.ahead[stored_id] = (stored_branch_id, checkpoint, tuple(signature))
+            if len(self.ahead) >= self.read_ahead:
+                break
+
+    def place(self, db_connection: sqlite3.Connection, row: dict, new_branch) -> bool:
+        # sets row['branch_id'], returns whether the row still has to be written
+        self.checkpoint = None
+
+        if self.following:
+            if row['id'] not in self.ahead:
+                self._read(db_connection, row['id'])
+            stored = self.ahead.get(row['id'])
+
+            if stored is None:
+                self.following = False # past the end of the path, the branch grows from here
+            elif stored[2] == tuple(row[key] for key in self.SIGNATURE):
+                row['branch_id'] = stored[0]
+                self.checkpoint = stored[1]
+                return False
+            else:
+                # forks off the branch holding the last row both runs agree on
+                parent_id = branch_at(self.path, row['id'] - 1)
+                self.branch_id = new_branch(self.file, stored[0] if parent_id is None else parent_id, row['id'] - 1)
+                self.following = False
+
+        row['branch_id'] = self.branch_id
+        return True
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+from collections import defaultdict
+from types import FrameType
+
+class Breakpoints:
+    def __init__(self, specs: list[dict] = ()):
+        self.replace(specs)
+
+    def replace(self, specs: list[dict]) -> None:
+        self.lines = defaultdict(lambda: defaultdict(list))
+        self.functions = defaultdict(list)
+        self.conditions = []
+
+        for spec in specs:
+            condition = spec.get('condition') or None
+            if condition:
+                condition = compile(condition, '<breakpoint>', 'eval')
+
+            if spec.get('line') is not None:
+                self.lines[spec.get('file') or None][int(spec['line'])].append(condition)
+            elif spec.get('function'):
+                self.functions[spec['function']].append((spec.get('file') or None, condition))
+            elif condition:
+                self.conditions.append((spec.get('file') or None, condition))
+
+    def __bool__(self):
+        return bool(self.lines or self.functions or self.conditions)
+
+    def hit(self, frame: FrameType, event: str, filename: str, function_name: str | None) -> bool:
+        if event == 'call':
+            return function_name in self.functions and any(
+                (file is None or file == filename) and self._check(condition, frame)
+                for file, condition in self.functions[function_name]
+            )
+
+        if event != 'line':
+            return False
+
+        for file in (filename, None):
+            if file in self.lines and frame.f_lineno in (lines := self.lines[file]):
+                if any(self._check(condition, frame) for condition in lines[frame.f_lineno]):
+                    return True
+
+        return any(
+            (file is None or file == filename) and self._check(condition, frame)
+            for file, condition in self.conditions
+        )
+
+    @staticmethod
+    def _check(condition, frame: FrameType) -> bool:
+        if condition is None:
+            return True
+        try:
+            return bool(eval(condition, frame.f_globals, frame.f_locals))
+        except Exception:
+            return False
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+from utils.content_store import ObjectStore, image_manifests
+from utils.internal_file_communication import ifc
+from utils.warm_pool import WarmPool
+
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND', 'criu') # 'criu', 'fork' or 'stub'
+
+class CriuBackend:
+    # full process images on disk, they survive the tracer and the API restarting, needs root
+    persistent = True
+    privileged = True
+
+    def __init__(self, replay_channel: str, directory: Path, pool: WarmPool):
+        import criu_api # only needed when this backend is picked
+        self.criu = criu_api
+        self.replay_channel = replay_channel
+        self.pool = pool
+        self.images_dir = directory / 'criu_dumps' # written by criu_api, one directory per dump number
+        self.manifest_dir = directory / '_images'  # what is left of a dump once it is packed
+        self.store = ObjectStore()
+
+    def wipe(self) -> None:
+        self.criu.wipe()
+        shutil.rmtree(self.manifest_dir, ignore_errors=True)
+        self.store.sweep(image_manifests())
+
+    def _pack(self, latest: int) -> None:
+        # every dump but the latest moves into the object store, the next dump may still read the latest as its parent
+        if not self.images_dir.is_dir():
+            return
+        for directory in self.images_dir.iterdir():
+            if directory.name.isdigit() and int(directory.name) != latest and not directory.is_symlink():
+                self.store.pack(directory, self.manifest_dir / f'{directory.name}.json')
+                shutil.rmtree(directory)
+
+    def _parent(self, checkpoint: int) -> int | None:
+        # the dump an incremental dump links to, packed or not
+        directory = self.images_dir / str(checkpoint)
+        manifest_path = self.manifest_dir / f'{checkpoint}.json'
+        if directory.is_dir():
+            links = [os.readlink(path) for path in directory.iterdir() if path.is_symlink()]
+        elif manifest_path.exists():
+            links = [entry['link'] for entry in json.loads(manifest_path.read_text()).values() if 'link' in entry]
+        else:
+            links = []
+        for link in links:
+            parent = Path(os.path.normpath(directory / link))
+            if parent.parent == self.images_dir and parent.name.isdigit():
+                return int(parent.name)
+        return None
+
+    def _unpack(self, checkpoint: int) -> None:
+        directory = self.images_dir / str(checkpoint)
+        manifest_path = self.manifest_dir / f'{checkpoint}.json'
+        if directory.exists() or not manifest_path.exists():
+            return
+        self.store.unpack(manifest_path, directory)
+        if (parent := self._parent(checkpoint)) is not None:
+            self._unpack(parent)
+
+    def drop(self, checkpoints: list[int]) -> None:
+        # images of pruned steps, except those a kept incremental dump still builds on
+        dropped = set(checkpoints)
+        kept = {int(path.stem) for path in self.manifest_dir.glob('*.json') if path.stem.isdigit()}
+        if self.images_dir.is_dir():
+            kept |= {int(path.name) for path in self.images_dir.iterdir() if path.name.isdigit()}
+
+        for checkpoint in kept - dropped:
+            while (checkpoint := self._parent(checkpoint)) is not None and checkpoint in dropped:
+                dropped.discard(checkpoint)
+
+        for checkpoint in dropped:
+            shutil.rmtree(self.images_dir / str(checkpoint), ignore_errors=True)
+            (self.manifest_dir / f'{checkpoint}.json').unlink(missing_ok=True)
+        self.store.sweep(image_manifests())
+
+    def _last_number(self) -> int | None:
+        numbers = [int(path.stem) for path in self.manifest_dir.glob('*.json') if path.stem.isdigit()]
+        if self.images_dir.is_dir():
+            numbers += [int(path.name) for path in self.images_dir.iterdir() if path.name.isdigit()]
+        return max(numbers, default=None)
+
+    def dump(self, timeline_id: int, branch_id: int) -> tuple[int | None, int | None]:
+        # (checkpoint number, timeline id to replay up to when this is a restored process)
+
+        # a restored process counts on from the dump it came from, the images numbered after it
+        # belong to other branches now and must not be overwritten
+        if (last := self._last_number()) is not None and last > (self.criu._last_dump_number or 0):
+            self.criu._last_dump_number = last
+        self.criu.dump(allow_overwrite=True)
+        # only a restored process finds a target here, the watcher writes it before restoring
+        targets = ifc.pop(self.replay_channel)
+        if targets:
+            # the image may come from an earlier watcher, the one that restored it is the one to outlive
+            self.pool.watcher_pid = int(targets[-1]['watcher_pid'])
+            return self.criu._last_dump_number, int(targets[-1]['timeline_id'])
+        self._pack(self.criu._last_dump_number)
+        return self.criu._last_dump_number, None
+
+    def restore(self, checkpoint: int, timeline_id: int) -> None:
+        # blocks until the restored process tree exits
+        self._unpack(checkpoint)
+        ifc.replace(self.replay_channel, [{"timeline_id": timeline_id, "watcher_pid": os.getpid()}])
+        self.criu.restore(checkpoint)
+
+class ForkBackend:
+    # checkpoints are parked forked copies, nothing is written to disk and nothing needs root,
+    # everything is gone once the watcher exits; timeline.parked marks the steps that still have
+    # one, the pool's size bounds how far back a jump can go
+    persistent = False
+    privileged = False
+
+    def __init__(self, pool: WarmPool):
+        self.pool = pool
+        self.pool.size = max(self.pool.size, 1) # the pool is the only way back
+
+    def wipe(self) -> None:
+        self.pool.clear()
+
+    def dump(self, timeline_id: int, branch_id: int) -> tuple[int | None, int | None]:
+        return None, self.pool.park(timeline_id, branch_id)
+
+    def restore(self, checkpoint: int, timeline_id: int) -> None:
+        raise ValueError("the fork backend keeps no checkpoint images")
+
+    def drop(self, checkpoints: list[int]) -> None:
+        pass # parked copies are dropped through the pool
+
+class StubBackend:
+    # numbers checkpoints without taking any, for benchmarks: the tracer pays for everything around a dump
+    # (flushing, closing the database and IFC) but nothing can be restored
+    persistent = True
+    privileged = False
+
+    def __init__(self):
+        self.last_number = 0
+
+    def wipe(self) -> None:
+        self.last_number = 0
+
+    def dump(self, timeline_id: int, branch_id: int) -> tuple[int | None, int | None]:
+        self.last_number += 1
+        return self.last_number, None
+
+    def restore(self, checkpoint: int, timeline_id: int) -> None:
+        raise ValueError("the stub backend keeps no checkpoint images")
+
+    def drop(self, checkpoints: list[int]) -> None:
+        pass
+
+def checkpoint_backend(replay_channel: str, pool: WarmPool, directory: Path):
+    if CHECKPOINT_BACKEND == 'fork':
+        return ForkBackend(pool)
+    if CHECKPOINT_BACKEND == 'stub':
+        return StubBackend()
+    return CriuBackend(replay_channel, directory, pool)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+from time import perf_counter
+
+class CheckpointPolicy:
+    def __init__(self, every_events: int | None = 100, every_ms: float | None = 1000, budget: float | None = 0.1):
+        self.every_events = every_events # dump after this many events
+        self.every_ms = every_ms         # or after this much wall time
+        self.budget = budget             # max share of run time spent dumping
+
+        self.started = perf_counter()
+        self.last_dump = None
+        self.events_since_dump = 0
+        self.dumps = 0
+        self.dump_seconds = 0.0
+
+    @classmethod
+    def from_dict(cls, config: dict | None):
+        if not config:
+            return cls()
+        return cls(
+            every_events=config.get('every_events'),
+            every_ms=config.get('every_ms'),
+            budget=config.get('budget')
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "every_events": self.every_events,
+            "every_ms": self.every_ms,
+            "budget": self.budget
+        }
+
+    def configure(self, config: dict | None) -> None:
+        other = CheckpointPolicy.from_dict(config)
+        self.every_events = other.every_events
+        self.every_ms = other.every_ms
+        self.budget = other.budget
+
+    def due(self) -> bool:
+        self.events_since_dump += 1
+
+        if self.last_dump is None:
+            return True # always keep an image of the first event
+
+        now = perf_counter()
+
+        if self.every_events or self.every_ms:
+            triggered = (
+                self.every_events and self.events_since_dump >= self.every_events
+            ) or (
+                self.every_ms and (now - self.last_dump) * 1000 >= self.every_ms
+            )
+        else:
+            triggered = True
+
+        if triggered and self.budget:
+            average_cost = self.dump_seconds / self.dumps if self.dumps else 0.0
+            triggered = self.dump_seconds + average_cost <= self.budget * (now - self.started)
+
+        return bool(triggered)
+
+    def dumped(self, seconds: float) -> None:
+        self.last_dump = perf_counter()
+        self.events_since_dump = 0
+        self.dumps += 1
+        self.dump_seconds += seconds
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # zlib then, data written either way stays readable once zstandard is installed
+
+from utils.sessions import TRACE_HOME, SESSIONS_DIR
+
+OBJECTS_DIR = TRACE_HOME / '_objects'
+CHUNK_SIZE = 64 * 1024 # a multiple of the page size, so unchanged pages line up between dumps
+BLOB_MIN_SIZE = 256    # serialized values shorter than this stay inline
+GC_GRACE = 600         # seconds an unreferenced object is kept, its manifest may still be being written
+
+# a large value inside scope JSON is replaced by this string, like "<deleted>" marks a removed name
+BLOB_REF = re.compile(r'(?<!\\)"<blob:([0-9a-f]{64})>"')
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return b'Z' + zstandard.ZstdCompressor(level=3).compress(data)
+    return b'z' + zlib.compress(data, 6)
+
+def decompress(data: bytes) -> bytes:
+    codec, payload = data[:1], data[1:]
+    if codec == b'Z':
+        if zstandard is None:
+            raise ValueError("zstd compressed data, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+def blob_refs(text: str | None) -> list[str]:
+    return BLOB_REF.findall(text) if text and '<blob:' in text else []
+
+class BlobPacker:
+    # moves large values out of the JSON stored in trace.db, identical values end up in one blobs row;
+    # the tracer packs values as it encodes them, the writer stores what was packed with the rows
+    def __init__(self, min_size: int = BLOB_MIN_SIZE, cache_size: int = 256):
+        self.min_size = min_size
+        self.cache_size = cache_size
+        self.compressed = OrderedDict() # digest -> compressed value, recently stored ones are not compressed again
+        self.pending = {}               # digest -> (compressed value, size) for the next INSERT OR IGNORE
+        self.pending_refs = set()       # (file, branch_id, digest) the rows being written refer to
+        self.lock = threading.Lock()    # a thread packs its values while another one stores its writer
+
+    def put(self, value_json: str) -> str:
+        # queues one JSON value for the next store(), returns its digest
+        data = value_json.encode()
+        digest = sha256(data).hexdigest()
+
+        with self.lock:
+            if digest not in self.pending:
+                if digest in self.compressed:
+                    self.compressed.move_to_end(digest)
+                else:
+                    self.compressed[digest] = compress(data)
+                    if len(self.compressed) > self.cache_size:
+                        self.compressed.popitem(last=False)
+                self.pending[digest] = (self.compressed[digest], len(data))
+
+        return digest
+
+    def refer(self, file: str, branch_id: int, digests) -> None:
+        # the blobs a row or keyframe stored on the branch refers to
+        with self.lock:
+            self.pending_refs.update((file, branch_id, digest) for digest in digests)
+
+    def pack_scope(self, scope_json: str | None, file: str, branch_id: int) -> str | None:
+        # a JSON object of name -> value built elsewhere, e.g. a keyframe rebuilt by retention
+        if scope_json is None or len(scope_json) < self.min_size:
+            return scope_json
+
+        packed = {}
+        for name, value in json.loads(scope_json).items():
+            value_json = json.dumps(value)
+            if len(value_json) >= self.min_size:
+                digest = self.put(value_json)
+                self.refer(file, branch_id, (digest,))
+                value = f'<blob:{digest}>'
+            packed[name] = value
+        return json.dumps(packed)
+
+    def store(self, cursor: sqlite3.Cursor) -> None:
+        # in the same transaction as the rows referencing them, so the garbage collector never sees one without the other
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            pending_refs, self.pending_refs = self.pending_refs, set()
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO blobs (hash, data, size)
+            VALUES (?, ?, ?)
+            """,
+            [(digest, data, size) for digest, (data, size) in pending.items()]
+        )
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO blob_refs (file, branch_id, hash)
+            VALUES (?, ?, ?)
+            """,
+            pending_refs
+        )
+
+class BlobReader:
+    def __init__(self, db_connection: sqlite3.Connection):
+        self.db_connection = db_connection
+        self.values = {}
+
+    def value(self, digest: str) -> str:
+        if digest not in self.values:
+            row = self.db_connection.execute(
+                """
+                SELECT data
+                FROM blobs
+                WHERE hash = :hash
+                """,
+                {
+                    "hash": digest
+                }
+            ).fetchone()
+            self.values[digest] = decompress(row[0]).decode() if row else json.dumps("<missing>")
+        return self.values[digest]
+
+    def expand(self, text: str | None) -> str | None:
+        # the stored JSON with every reference replaced by the value it stands for
+        if not text or '<blob:' not in text:
+            return text
+        return BLOB_REF.sub(lambda match: self.value(match[1]), text)
+
+def branch_blob_refs(cursor: sqlite3.Cursor, file: str | None, branch_id: int | None = None) -> list[tuple[str, int, str]]:
+    # (file, branch_id, hash) of every reference in the stored rows of one branch, or of every branch of file
+    # when branch_id is None, or of every file when file is None too
+    refs = set()
+    for table, columns in (
+        ("timeline", "global_diff, local_diff"),
+        ("variable_changes", "value, NULL"),
+        ("keyframes", "globals, locals")
+    ):
+        first, second = columns.split(', ')
+        cursor.execute(
+            f"""
+            SELECT file, branch_id, {columns}
+            FROM {table}
+            WHERE (:file IS NULL OR file = :file)
+              AND (:branch_id IS NULL OR branch_id = :branch_id)
+              AND (instr({first}, '<blob:') OR instr({second}, '<blob:'))
+            """,
+            {
+                "file": file,
+                "branch_id": branch_id
+            }
+        )
+        for row_file, row_branch_id, *texts in cursor.fetchall():
+            refs.update((row_file, row_branch_id, digest) for text in texts for digest in blob_refs(text))
+    return list(refs)
+
+def recount_blob_refs(cursor: sqlite3.Cursor, file: str, branch_id: int) -> None:
+    # after rows of a branch were deleted without the branch itself, e.g. thinned
+    cursor.execute(
+        """
+        DELETE FROM blob_refs
+        WHERE file = :file
+          AND branch_id = :branch_id
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id
+        }
+    )
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO blob_refs (file, branch_id, hash)
+        VALUES (?, ?, ?)
+        """,
+        branch_blob_refs(cursor, file, branch_id)
+    )
+
+def collect_blobs(db_connection: sqlite3.Connection) -> int:
+    # deletes blobs no branch refers to anymore: replaced uploads, deleted branches, thinned rows;
+    # blob_refs is kept in the transactions writing and thinning rows and cascades with the branches,
+    # so this is one indexed pass over the blobs instead of a scan of every stored value
+    with db_connection:
+        cursor = db_connection.execute(
+            """
+            DELETE FROM blobs
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM blob_refs
+                WHERE blob_refs.hash = blobs.hash
+            )
+            """
+        )
+    return cursor.rowcount
+
+class ObjectStore:
+    # checkpoint image directories as manifests of content addressed, compressed chunks
+    def __init__(self, root: Path = OBJECTS_DIR, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def put(self, data: bytes) -> str:
+        digest = sha256(data).hexdigest()
+        path = self.path(digest)
+        try:
+            os.utime(path) # already stored, touched so a concurrent sweep keeps it
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            temporary_path.write_bytes(compress(data))
+            os.replace(temporary_path, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return decompress(self.path(digest).read_bytes())
+
+    def pack(self, directory: Path, manifest_path: Path) -> None:
+        manifest = {}
+        for parent, dirnames, filenames in os.walk(directory):
+            for name in sorted(dirnames + filenames):
+                path = Path(parent) / name
+                key = str(path.relative_to(directory))
+                if path.is_symlink():
+                    manifest[key] = {"link": os.readlink(path)} # e.g. the parent of an incremental dump
+                elif path.is_file():
+                    with open(path, 'rb') as image:
+                        manifest[key] = {
+                            "mode": path.stat().st_mode & 0o7777,
+                            "chunks": [self.put(chunk) for chunk in iter(lambda: image.read(self.chunk_size), b'')]
+                        }
+
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = manifest_path.with_suffix(f'.{os.getpid()}.tmp')
+        temporary_path.write_text(json.dumps(manifest))
+        os.replace(temporary_path, manifest_path)
+
+    def unpack(self, manifest_path: Path, directory: Path) -> None:
+        manifest = json.loads(manifest_path.read_text())
+
+        temporary_directory = directory.with_name(f'{directory.name}.{os.getpid()}.tmp')
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        temporary_directory.mkdir(parents=True)
+
+        for key, entry in manifest.items():
+            path = temporary_directory / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if 'link' in entry:
+                os.symlink(entry['link'], path)
+            else:
+                with open(path, 'wb') as image:
+                    for digest in entry['chunks']:
+                        image.write(self.get(digest))
+                os.chmod(path, entry['mode'])
+
+        os.replace(temporary_directory, directory)
+
+    def sweep(self, manifests: list[Path]) -> int:
+        live = set()
+        for manifest_path in manifests:
+            try:
+                manifest = json.loads(manifest_path.read_text())
+            except (OSError, ValueError):
+                continue
+            for entry in manifest.values():
+                live.update(entry.get('chunks', ()))
+
+        removed = 0
+        now = time()
+        for path in self.root.glob('??/*'):
+            digest = path.parent.name + path.name
+            try:
+                if digest not in live and now - path.stat().st_mtime > GC_GRACE:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass # gone already or owned by another user
+        return removed
+
+def image_manifests() -> list[Path]:
+    # the image manifests of every session, they share one object store
+    return list(SESSIONS_DIR.glob('*/_images/*.json'))
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import threading
 from sys import path, gettrace, settrace
 from os import chdir
 from contextlib import contextmanager
 from pathlib import Path
 
+TRACE_BACKEND = os.environ.get('TRACE_BACKEND', 'monitoring') # 'monitoring' (3.12+) or 'settrace'
+
+def monitoring_available() -> bool:
+    return TRACE_BACKEND == 'monitoring' and hasattr(sys, 'monitoring')
+
 @contextmanager
 def use_dir(target_dir: Path):
     original_dir = Path.cwd()
@@ -18,12 +26,134 @@ def use_dir(target_dir: Path):
         if target_dir in path:
             path.remove(target_dir)
             chdir(original_dir)
-    
+
 @contextmanager
 def use_trace(trace_function):
+    # threads started from here on are traced too, threads already running are not
     old_trace = gettrace()
+    old_thread_trace = threading.gettrace()
     settrace(trace_function)
+    threading.settrace(trace_function)
     try:
         yield
     finally:
+        threading.settrace(old_thread_trace)
         settrace(old_trace)
+
+@contextmanager
+def use_monitoring(trace_function, should_trace):
+    # PEP 669: the callbacks translate events into settrace's (frame, event, arg) calls, plus 'resume' and
+    # 'suspend' for generators and coroutines; code rejected by should_trace gets DISABLE and is never
+    # reported again; events are process wide, so every thread is traced
+    monitoring = sys.monitoring
+    events = monitoring.events
+    DISABLE = monitoring.DISABLE
+    tool = monitoring.DEBUGGER_ID
+
+    local_events = events.LINE | events.JUMP | events.PY_RESUME | events.PY_RETURN | events.PY_YIELD | events.STOP_ITERATION
+    code_lines = {} # code -> {offset: line number}
+
+    def line_at(code, offset):
+        if (lines := code_lines.get(code)) is None:
+            lines = code_lines[code] = {
+                offset: line_number
+                for start, end, line_number in code.co_lines()
+                for offset in range(start, end, 2)
+            }
+        return lines.get(offset)
+
+    def on_start(code, offset):
+        if not should_trace(code):
+            return DISABLE
+        monitoring.set_local_events(tool, code, local_events)
+        trace_function(sys._getframe(1), 'call', None)
+
+    def on_resume(code, offset):
+        if not should_trace(code):
+            return DISABLE
+        trace_function(sys._getframe(1), 'resume', None)
+
+    def on_line(code, line_number):
+        if not should_trace(code):
+            return DISABLE
+        trace_function(sys._getframe(1), 'line', None)
+
+    def on_jump(code, offset, destination):
+        # LINE only fires on entering another line, settrace also reports looping back within one line
+        # (a one-line loop or comprehension) as a 'line' event; which a jump instruction does never changes
+        if destination > offset or not should_trace(code):
+            return DISABLE
+        line_number = line_at(code, destination)
+        if line_number is None or line_number != line_at(code, offset):
+            return DISABLE
+        trace_function(sys._getframe(1), 'line', None)
+
+    def on_return(code, offset, return_value):
+        if not should_trace(code):
+            return DISABLE
+        trace_function(sys._getframe(1), 'return', return_value)
+
+    def on_yield(code, offset, value):
+        if not should_trace(code):
+            return DISABLE
+        trace_function(sys._getframe(1), 'suspend', value)
+
+    def on_stop_iteration(code, offset, exception):
+        # the StopIteration of a finished generator or awaitable is not a RAISE event, settrace reports
+        # it as an 'exception' all the same
+        if not should_trace(code):
+            return DISABLE
+        trace_function(sys._getframe(1), 'exception', (type(exception), exception, exception.__traceback__))
+
+    # the exception events below cannot be disabled, only filtered; RAISE fires again in every frame
+    # the exception propagates into, like settrace's 'exception'
+    def on_throw(code, offset, exception):
+        if should_trace(code):
+            trace_function(sys._getframe(1), 'resume', None)
+
+    def on_unwind(code, offset, exception):
+        if should_trace(code):
+            trace_function(sys._getframe(1), 'return', None)
+
+    def on_raise(code, offset, exception):
+        if should_trace(code):
+            trace_function(sys._getframe(1), 'exception', (type(exception), exception, exception.__traceback__))
+
+    callbacks = {
+        events.PY_START: on_start,
+        events.PY_RESUME: on_resume,
+        events.LINE: on_line,
+        events.JUMP: on_jump,
+        events.PY_RETURN: on_return,
+        events.PY_YIELD: on_yield,
+        events.STOP_ITERATION: on_stop_iteration,
+        events.PY_THROW: on_throw,
+        events.PY_UNWIND: on_unwind,
+        events.RAISE: on_raise,
+    }
+
+    monitoring.use_tool_id(tool, 'trace')
+    for event, callback in callbacks.items():
+        monitoring.register_callback(tool, event, callback)
+    monitoring.set_events(tool, events.PY_START | events.PY_THROW | events.PY_UNWIND | events.RAISE)
+    try:
+        yield
+    finally:
+        monitoring.set_events(tool, events.NO_EVENTS)
+        for event in callbacks:
+            monitoring.register_callback(tool, event, None)
+        monitoring.free_tool_id(tool)
+
+@contextmanager
+def use_tracing(trace_function, should_trace):
+    if monitoring_available():
+        with use_monitoring(trace_function, should_trace):
+            yield
+    else:
+        with use_trace(trace_function):
+            yield
+
+def restart_tracing() -> None:
+    # re-enables events returned DISABLE after the filter changed
+    if monitoring_available():
+        sys.monitoring.restart_events()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import dis
+import sqlite3
+from inspect import CO_ASYNC_GENERATOR, CO_COROUTINE, CO_GENERATOR
+from types import CodeType, FrameType
+
+from utils.branches import BRANCH_PATH
+
+SUSPENDING_CODE = CO_GENERATOR | CO_COROUTINE | CO_ASYNC_GENERATOR
+YIELD_VALUE = dis.opmap['YIELD_VALUE']
+RESUME = dis.opmap['RESUME']
+RESUME_LOCATION = 3 # low bits of RESUME's argument, 0 at the start and 1 to 3 after a yield, yield from or await
+
+class FrameIds:
+    # CPython hands out id(frame) again once a frame is freed; a frame is numbered by the timeline id
+    # of the first event traced in it instead, which replays to the same number and is unique along a path
+    def __init__(self):
+        self.open = {}  # id(frame) -> {"id", "parent_id", "depth", "function", "source_file", "suspends", "raised"}
+                        # until it returns, suspended generators and coroutines included
+        self.codes = {} # generator code -> (bytecode, offset its frames start at)
+
+    def _code(self, code: CodeType) -> tuple[bytes, int]:
+        if (known := self.codes.get(code)) is None:
+            start = next((instruction.offset for instruction in dis.get_instructions(code) if instruction.opname == 'RESUME'), -1)
+            known = self.codes[code] = (code.co_code, start)
+        return known
+
+    def settrace_event(self, frame: FrameType, event: str, arg) -> str:
+        # settrace reports a generator or coroutine resuming as 'call' and suspending as 'return',
+        # sys.monitoring tells them apart itself
+        if not frame.f_code.co_flags & SUSPENDING_CODE or event not in ('call', 'return'):
+            return event
+        bytecode, start = self._code(frame.f_code)
+        if event == 'call':
+            return 'resume' if frame.f_lasti > start else event
+        # up to 3.12 a suspended frame stops at its YIELD_VALUE, from 3.13 on at the RESUME after it
+        opcode, argument = bytecode[frame.f_lasti], bytecode[frame.f_lasti + 1]
+        if opcode == YIELD_VALUE or (opcode == RESUME and argument & RESUME_LOCATION):
+            # leaving through an exception (close(), a throw() it does not handle) ends it for good
+            info = self.open.get(id(frame))
+            if not (arg is None and info is not None and info['raised']):
+                return 'suspend'
+        return event
+
+    def get(self, frame: FrameType, event: str, timeline_id: int, function: str, source_file: str) -> dict:
+        # a call always starts a new frame, other events can come from frames entered before tracing started
+        if event != 'call' and (info := self.open.get(id(frame))) is not None:
+            info['raised'] = event == 'exception'
+            return info
+
+        # the closest caller that is traced, filtered out frames in between are skipped
+        parent = None
+        caller = frame.f_back
+        while caller is not None and (parent := self.open.get(id(caller))) is None:
+            caller = caller.f_back
+
+        info = self.open[id(frame)] = {
+            "id": timeline_id,
+            "parent_id": parent['id'] if parent else None,
+            "depth": parent['depth'] + 1 if parent else 0,
+            "function": function,
+            "source_file": source_file,
+            "suspends": bool(frame.f_code.co_flags & SUSPENDING_CODE),
+            "raised": event == 'exception'
+        }
+        return info
+
+    def leave(self, frame: FrameType) -> None:
+        self.open.pop(id(frame), None)
+
+def frame_rows(rows: list[dict]) -> list[dict]:
+    # the frames started by rows, a frame's id is the id of its first row
+    return [
+        {
+            "file": row['file'],
+            "branch_id": row['branch_id'],
+            "id": row['frame_id'],
+            "parent_id": row.get('parent_frame_id'),
+            "function": row['target'],
+            "source_file": row['source_file'],
+            "depth": row.get('depth'),
+            "suspends": row.get('suspends')
+        }
+        for row in rows
+        if row['frame_id'] == row['id']
+    ]
+
+def frame_on_path(cursor: sqlite3.Cursor, file: str, branch_id: int, frame_id: int) -> dict | None:
+    # a frame still running where a branch forked is copied into it, the copy on the latest segment wins
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT frames.id, frames.parent_id, frames.function, frames.source_file,
+               frames.start_event, frames.end_event, frames.depth, frames.suspends
+        FROM path
+        CROSS JOIN frames
+           ON frames.file = :file
+          AND frames.branch_id = path.branch_id
+          AND frames.id = :frame_id
+          AND frames.start_event <= path.last_id
+        ORDER BY path.first_id DESC
+        LIMIT 1
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id,
+            "frame_id": frame_id
+        }
+    )
+
+    if row := cursor.fetchone():
+        return dict(zip(("id", "parent_id", "function", "source_file", "start_event", "end_event", "depth", "suspends"), row))
+    return None
@@ -3,9 +3,18 @@
 import fcntl
 import json
 import os
+import socket
+import socketserver
+import threading
+from collections import defaultdict, deque
 from contextlib import contextmanager
+from time import monotonic, sleep
 from typing import Any, List
 
+from utils.sessions import TRACE_HOME
+
+IFC_TRANSPORT = os.environ.get('IFC_TRANSPORT', 'socket') # 'socket' or 'file'
+IFC_SOCKET = str(TRACE_HOME / '_ifc.sock')
 
 @contextmanager
 def file_lock(file):
@@ -37,7 +46,7 @@ class _IFC:
                 lines = file.readlines()
 
         return _parse_lines(lines, keep_json)
-    
+
     def replace(self, filepath: str, data: List[Any], is_json: bool = False) -> None:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
@@ -48,7 +57,7 @@ class _IFC:
                     file.write("\n")
                 file.flush()
                 os.fsync(file.fileno())
-        
+
     def append(self, filepath: str, data: Any, is_json: bool = False) -> None:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
@@ -58,8 +67,11 @@ class _IFC:
                 file.write("\n")
                 file.flush()
                 os.fsync(file.fileno())
-    
-    def pop(self, filepath: str, keep_json: bool = False) -> List[Any]:
+
+    def pop(self, filepath: str, keep_json: bool = False, timeout: float | None = None) -> List[Any]:
+        if timeout and not self.wait(filepath, timeout):
+            return []
+
         open(filepath, "a").close()
 
         with open(filepath, "r+") as file:
@@ -73,4 +85,177 @@ class _IFC:
 
         return _parse_lines(lines, keep_json)
 
-ifc = _IFC()
+    def wait(self, filepath: str, timeout: float) -> bool:
+        deadline = monotonic() + timeout
+        while not os.path.exists(filepath) or not os.path.getsize(filepath):
+            if monotonic() >= deadline:
+                return False
+            sleep(.1)
+        return True
+
+    def close(self) -> None:
+        pass
+
+class _Broker:
+    # the channels live in the API process's memory only: the warm pool's registry, `_watcher` and every
+    # other channel are lost when it restarts, unlike with the file transport
+    def __init__(self):
+        self.channels = defaultdict(deque)
+        self.condition = threading.Condition()
+
+    def read(self, filepath: str, keep_json: bool = False) -> List[Any]:
+        with self.condition:
+            lines = list(self.channels[filepath])
+        return _parse_lines(lines, keep_json)
+
+    def replace(self, filepath: str, data: List[Any], is_json: bool = False) -> None:
+        with self.condition:
+            self.channels[filepath] = deque(item if is_json else json.dumps(item) for item in data)
+            self.condition.notify_all()
+
+    def append(self, filepath: str, data: Any, is_json: bool = False) -> None:
+        with self.condition:
+            self.channels[filepath].append(data if is_json else json.dumps(data))
+            self.condition.notify_all()
+
+    def pop(self, filepath: str, keep_json: bool = False, timeout: float | None = None) -> List[Any]:
+        with self.condition:
+            if timeout:
+                self.condition.wait_for(lambda: self.channels[filepath], timeout)
+            lines = list(self.channels[filepath])
+            self.channels[filepath].clear()
+        return _parse_lines(lines, keep_json)
+
+    def wait(self, filepath: str, timeout: float) -> bool:
+        with self.condition:
+            return bool(self.condition.wait_for(lambda: self.channels[filepath], timeout))
+
+    def close(self) -> None:
+        pass
+
+    def serve(self, socket_path: str) -> None:
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    for line in self.rfile:
+                        try:
+                            request = json.loads(line)
+                            match request['op']:
+                                case 'read':
+                                    reply = broker.read(request['channel'], keep_json=True)
+                                case 'replace':
+                                    reply = broker.replace(request['channel'], request['data'], is_json=True)
+                                case 'append':
+                                    reply = broker.append(request['channel'], request['data'], is_json=True)
+                                case 'pop':
+                                    reply = broker.pop(request['channel'], keep_json=True, timeout=request['timeout'])
+                                case 'wait':
+                                    reply = broker.wait(request['channel'], request['timeout'])
+                                case op:
+                                    reply = {"error": f"unknown op {op!r}"}
+                        except (ValueError, KeyError, TypeError) as error:
+                            reply = {"error": f"bad request: {error!r}"}
+                        self.wfile.write(json.dumps(reply).encode() + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client went away, e.g. a parked copy killed by the warm pool
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        server = Server(socket_path, Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+class _SocketIFC:
+    # one connection per process and thread, closed before a CRIU dump and reopened on first use;
+    # a thread waiting in pop() does not hold up the others
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.local = threading.local() # socket, connection and the pid that opened them
+        self.bytes_sent = 0 # totals for this process, read by the benchmark
+        self.bytes_received = 0
+
+    def _connect(self) -> None:
+        local = self.local
+        for attempt in range(2):
+            try:
+                self.close() # a forked child must not keep its parent's connection
+                local.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                local.socket.connect(self.socket_path)
+                local.connection = local.socket.makefile("rwb")
+                local.pid = os.getpid()
+                return
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+                sleep(.1) # e.g. the API is still starting its broker
+
+    def _request(self, request: dict) -> Any:
+        # only connecting is retried: a request that was sent may have run already, sending it again
+        # could append an item twice or lose the items a pop took
+        local = self.local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            self._connect()
+        payload = json.dumps(request).encode() + b"\n"
+        try:
+            local.connection.write(payload)
+            local.connection.flush()
+            line = local.connection.readline()
+            if not line:
+                raise ConnectionError("IFC broker closed the connection")
+        except OSError:
+            self.close() # the next request connects again
+            raise
+        self.bytes_sent += len(payload)
+        self.bytes_received += len(line)
+        reply = json.loads(line)
+        if isinstance(reply, dict):
+            raise ValueError(reply['error']) # no op replies with an object
+        return reply
+
+    def read(self, filepath: str, keep_json: bool = False) -> List[Any]:
+        return _parse_lines(self._request({"op": "read", "channel": filepath}), keep_json)
+
+    def replace(self, filepath: str, data: List[Any], is_json: bool = False) -> None:
+        self._request({
+            "op": "replace",
+            "channel": filepath,
+            "data": [item if is_json else json.dumps(item) for item in data]
+        })
+
+    def append(self, filepath: str, data: Any, is_json: bool = False) -> None:
+        self._request({
+            "op": "append",
+            "channel": filepath,
+            "data": data if is_json else json.dumps(data)
+        })
+
+    def pop(self, filepath: str, keep_json: bool = False, timeout: float | None = None) -> List[Any]:
+        return _parse_lines(self._request({"op": "pop", "channel": filepath, "timeout": timeout}), keep_json)
+
+    def wait(self, filepath: str, timeout: float) -> bool:
+        return self._request({"op": "wait", "channel": filepath, "timeout": timeout})
+
+    def close(self) -> None:
+        # the calling thread's connection
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+        if getattr(self.local, 'socket', None) is not None:
+            self.local.socket.close()
+            self.local.socket = None
+
+def serve_ifc():
+    # the API process owns the channels, every other process talks to it through `ifc`
+    if IFC_TRANSPORT != 'socket':
+        return ifc
+    broker = _Broker()
+    broker.serve(IFC_SOCKET)
+    return broker
+
+ifc = _SocketIFC(IFC_SOCKET) if IFC_TRANSPORT == 'socket' else _IFC()
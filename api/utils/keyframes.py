@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+def apply_diff(target: dict, diff: dict) -> None:
+    for name, value in diff.items():
+        if value == "<deleted>":
+            target.pop(name, None)
+        else:
+            target[name] = value
+
+class ScopeKeyframes:
+    # mirrors the frontend's cumulative scope so a keyframe plus the diffs after it rebuild any step;
+    # it keeps the '"name": value' text the diffs were stored with, a keyframe joins it without encoding anything
+    def __init__(self, every: int = 1000):
+        self.every = every
+        self.globals = {} # name -> (text, digest of the blob it refers to or None)
+        self.locals = {}
+        self.return_value = None
+        self.error = None
+        self.since_keyframe = 0
+
+    @staticmethod
+    def _apply(target: dict, diff: dict) -> None:
+        # diff maps name -> (text, digest), None for a deleted name
+        for name, entry in diff.items():
+            if entry is None:
+                target.pop(name, None)
+            else:
+                target[name] = entry
+
+    def apply(self, send_back: dict, global_diff: dict, local_diff: dict) -> dict | None:
+        self._apply(self.globals, global_diff)
+        self._apply(self.locals, local_diff)
+
+        if send_back['return_value'] is not None:
+            self.return_value = send_back['return_value']
+        if send_back['error'] is not None:
+            self.error = send_back['error']
+
+        self.since_keyframe += 1
+        if self.since_keyframe < self.every:
+            return None
+
+        self.since_keyframe = 0
+        return {
+            "file": send_back['file'],
+            "timeline_id": send_back['id'],
+            "globals": '{' + ', '.join(text for text, _ in self.globals.values()) + '}',
+            "locals": '{' + ', '.join(text for text, _ in self.locals.values()) + '}',
+            "return_value": self.return_value,
+            "error": self.error,
+            "blobs": [digest for scope in (self.globals, self.locals) for _, digest in scope.values() if digest]
+        }
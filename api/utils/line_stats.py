@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+from utils.branches import branch_path
+
+# per branch and line: the branch's own rows, kept up to date by TimelineWriter in the batch that stores them
+LINE_STATS_UPSERT = """
+    INSERT INTO line_stats (file, branch_id, source_file, line_number, hits, exceptions, first_id, last_id, last_frame_id)
+    VALUES (:file, :branch_id, :source_file, :line_number, :hits, :exceptions, :first_id, :last_id, :last_frame_id)
+    ON CONFLICT (file, branch_id, source_file, line_number) DO UPDATE SET
+        hits = hits + excluded.hits,
+        exceptions = exceptions + excluded.exceptions,
+        first_id = MIN(first_id, excluded.first_id),
+        last_id = MAX(last_id, excluded.last_id),
+        last_frame_id = CASE WHEN excluded.last_id >= last_id THEN excluded.last_frame_id ELSE last_frame_id END
+"""
+
+def count_lines(rows: list[dict]) -> list[dict]:
+    # rows in id order, the upsert parameters for them
+    stats = {}
+    for row in rows:
+        if row['line_number'] is None:
+            continue
+        key = (row['file'], row['branch_id'], row['source_file'] or 'main.py', row['line_number'])
+        line = stats.get(key)
+        if line is None:
+            line = stats[key] = {
+                "file": key[0],
+                "branch_id": key[1],
+                "source_file": key[2],
+                "line_number": key[3],
+                "hits": 0,
+                "exceptions": 0,
+                "first_id": row['id'],
+                "last_id": row['id'],
+                "last_frame_id": row['frame_id']
+            }
+        line['hits'] += row['event'] == 'line'
+        line['exceptions'] += row['event'] == 'exception'
+        line['first_id'] = min(line['first_id'], row['id'])
+        if row['id'] >= line['last_id']:
+            line['last_id'] = row['id']
+            line['last_frame_id'] = row['frame_id']
+    return list(stats.values())
+
+def _segment_stats(cursor: sqlite3.Cursor, file: str, branch_id: int, last_id: int, source_file: str) -> dict:
+    # line_number -> [hits, exceptions, first_id, last_id, last_frame_id] of the branch's own rows up to last_id:
+    # the stored totals, less the rows after last_id when the path leaves the branch early, which costs
+    # a scan of all of them
+    cursor.execute(
+        """
+        SELECT line_number, hits, exceptions, first_id, last_id, last_frame_id
+        FROM line_stats
+        WHERE file = :file
+          AND branch_id = :branch_id
+          AND source_file = :source_file
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id,
+            "source_file": source_file
+        }
+    )
+    lines = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+
+    if not any(line[3] > last_id for line in lines.values()):
+        return lines
+
+    cursor.execute(
+        """
+        SELECT line_number, SUM(event = 'line'), SUM(event = 'exception')
+        FROM timeline
+        WHERE file = :file
+          AND branch_id = :branch_id
+          AND id > :last_id
+          AND IFNULL(source_file, 'main.py') = :source_file
+        GROUP BY line_number
+        """,
+        {
+            "file": file,
+            "branch_id": branch_id,
+            "last_id": last_id,
+            "source_file": source_file
+        }
+    )
+    for line_number, hits, exceptions in cursor.fetchall():
+        if (line := lines.get(line_number)) is not None:
+            line[0] -= hits
+            line[1] -= exceptions
+
+    for line_number, line in list(lines.items()):
+        if line[2] > last_id:
+            del lines[line_number] # first reached after the cut
+        elif line[3] > last_id:
+            cursor.execute(
+                """
+                SELECT id, frame_id
+                FROM timeline
+                WHERE file = :file
+                  AND branch_id = :branch_id
+                  AND line_number = :line_number
+                  AND id <= :last_id
+                  AND IFNULL(source_file, 'main.py') = :source_file
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                {
+                    "file": file,
+                    "branch_id": branch_id,
+                    "line_number": line_number,
+                    "last_id": last_id,
+                    "source_file": source_file
+                }
+            )
+            if last := cursor.fetchone():
+                line[3], line[4] = last
+            else:
+                del lines[line_number] # thinned out by retention
+    return lines
+
+def path_line_stats(cursor: sqlite3.Cursor, file: str, branch_id: int, until_id: int, source_file: str = 'main.py') -> dict:
+    # line_number -> {hits, exceptions, first_id, last_id, frame_id} along a branch's path up to until_id;
+    # O(lines) only while every segment is read up to its last row: at the tip of a branch whose parents
+    # stop at its fork point. A segment cut short, by the pointer moving back or by a parent whose rows
+    # go on past the fork, scans its rows after the cut, O(events) again
+    totals = {}
+    for segment_branch_id, first_id, last_id in branch_path(cursor, file, branch_id):
+        if first_id > until_id:
+            break
+        for line_number, (hits, exceptions, line_first_id, line_last_id, frame_id) in _segment_stats(cursor, file, segment_branch_id, min(last_id, until_id), source_file).items():
+            line = totals.get(line_number)
+            if line is None:
+                totals[line_number] = {
+                    "hits": hits,
+                    "exceptions": exceptions,
+                    "first_id": line_first_id,
+                    "last_id": line_last_id,
+                    "frame_id": frame_id
+                }
+                continue
+            line['hits'] += hits
+            line['exceptions'] += exceptions
+            line['first_id'] = min(line['first_id'], line_first_id)
+            if line_last_id >= line['last_id']:
+                line['last_id'] = line_last_id
+                line['frame_id'] = frame_id
+    return totals
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+from collections.abc import Callable
+from time import monotonic
+
+class OutputCapture:
+    def __init__(self, send: Callable[[dict], None], max_chars: int = 4096, max_delay: float = .1):
+        self.send = send
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+
+        self.event_chunks = [] # [stream, text] written since the last timeline event
+        self.pending = []      # messages not sent to the app yet
+        self.pending_chars = 0
+        self.pending_marks = [] # streams the traced script flushed, marked after the pending messages
+        self.marked = {"stdout", "stderr"} # streams with no output since their last marker
+        self.last_flush = monotonic()
+        self.lock = threading.RLock() # threads of the traced script print concurrently
+
+    @staticmethod
+    def _merge(chunks: list, stream: str, text: str) -> None:
+        if chunks and chunks[-1][0] == stream:
+            chunks[-1][1] += text
+        else:
+            chunks.append([stream, text])
+
+    def write(self, stream: str, text: str, live: bool = True) -> None:
+        with self.lock:
+            if not text:
+                return
+
+            self._merge(self.event_chunks, stream, text)
+
+            if not live:
+                return # replayed output is already on the client
+
+            self._merge(self.pending, stream, text)
+            self.pending_chars += len(text)
+            self.marked.discard(stream)
+
+            if self.pending_chars >= self.max_chars or ('\n' in text and monotonic() - self.last_flush >= self.max_delay):
+                self.flush()
+
+    def poll(self) -> None:
+        # called once per timeline event so output without a newline is not held back for long
+        with self.lock:
+            if (self.pending or self.pending_marks) and monotonic() - self.last_flush >= self.max_delay:
+                self.flush()
+
+    def mark_flushed(self, stream: str) -> None:
+        # the marker goes out once, after the batch its output is in: print(flush=True) in a loop or
+        # the flushes at interpreter exit must not become a message each
+        with self.lock:
+            if stream in self.marked:
+                return
+            self.marked.add(stream)
+            if stream not in self.pending_marks:
+                self.pending_marks.append(stream)
+            if monotonic() - self.last_flush >= self.max_delay:
+                self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, []
+            marks, self.pending_marks = self.pending_marks, []
+            self.pending_chars = 0
+            self.last_flush = monotonic()
+
+            for stream, text in pending:
+                self.send({
+                    "type": stream,
+                    "data": text
+                })
+            for stream in marks:
+                self.send({
+                    "type": "flush",
+                    "data": stream
+                })
+
+    def take(self) -> str | None:
+        # JSON for the timeline row's output column, NULL when the step printed nothing
+        with self.lock:
+            if not self.event_chunks:
+                return None
+            chunks, self.event_chunks = self.event_chunks, []
+            return json.dumps(chunks)
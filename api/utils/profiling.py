@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+from collections import defaultdict
+from time import perf_counter_ns, thread_time_ns
+
+class EventClock:
+    # how long the traced code ran between two events; whatever the tracer does in between,
+    # callbacks for filtered out code included, is left out
+    def __init__(self, calibration_rounds: int = 1000):
+        self.wall_ns = 0
+        self.cpu_ns = 0
+        self.wall_bias_ns = self.cpu_bias_ns = 0
+        self.left_at = perf_counter_ns()
+        self.cpu_left_at = thread_time_ns()
+        self.calibrate(calibration_rounds)
+
+    def calibrate(self, rounds: int) -> None:
+        # reading the clocks is part of every measured stretch, what an empty one typically measures is subtracted
+        walls, cpus = [], []
+        for _ in range(rounds):
+            self.leave()
+            self.enter()
+            walls.append(self.wall_ns)
+            cpus.append(self.cpu_ns)
+            self.wall_ns = self.cpu_ns = 0
+        if rounds:
+            self.wall_bias_ns, self.cpu_bias_ns = sorted(walls)[rounds // 2], sorted(cpus)[rounds // 2]
+
+    def enter(self) -> None:
+        self.wall_ns += max(perf_counter_ns() - self.left_at - self.wall_bias_ns, 0)
+        self.cpu_ns += max(thread_time_ns() - self.cpu_left_at - self.cpu_bias_ns, 0)
+
+    def leave(self) -> None:
+        self.cpu_left_at = thread_time_ns()
+        self.left_at = perf_counter_ns()
+
+    def take(self) -> tuple[float, float]:
+        # (wall, cpu) seconds since the last event that took them
+        wall, cpu = self.wall_ns / 1e9, self.cpu_ns / 1e9
+        self.wall_ns = self.cpu_ns = 0
+        return wall, cpu
+
+class Spans:
+    # time each key spends anywhere on the stack, a key on it more than once (recursion) counts once
+    def __init__(self):
+        self.depth = defaultdict(int)
+        self.since = {}
+        self.total = defaultdict(lambda: [0.0, 0.0])
+
+    def enter(self, key, clock: tuple[float, float]) -> None:
+        if not self.depth[key]:
+            self.since[key] = clock
+        self.depth[key] += 1
+
+    def leave(self, key, clock: tuple[float, float]) -> None:
+        self.depth[key] -= 1
+        if not self.depth[key]:
+            wall, cpu = self.since.pop(key)
+            self.total[key][0] += clock[0] - wall
+            self.total[key][1] += clock[1] - cpu
+
+    def totals(self, clock: tuple[float, float]) -> dict:
+        # including the keys still on the stack
+        totals = {key: list(value) for key, value in self.total.items()}
+        for key, (wall, cpu) in self.since.items():
+            total = totals.setdefault(key, [0.0, 0.0])
+            total[0] += clock[0] - wall
+            total[1] += clock[1] - cpu
+        return totals
+
+class Profile:
+    # built from timeline rows in id order: the time a row records ran in the frame that was on top of
+    # its thread's stack after that thread's previous row, on the line that frame was at
+    def __init__(self):
+        self.lines = defaultdict(lambda: [0, 0.0, 0.0])   # (source_file, line_number) -> [hits, self wall, self cpu]
+        self.functions = defaultdict(lambda: [0, 0.0, 0.0]) # (source_file, function) -> [calls, self wall, self cpu]
+        self.root = {"name": "<root>", "self": [0.0, 0.0], "children": {}}
+        self.threads = {} # thread_id -> {clock, stack, line_spans, function_spans, root}
+
+    def _thread(self, thread_id: int) -> dict:
+        if (thread := self.threads.get(thread_id)) is None:
+            root = self.root
+            if thread_id:
+                # the script's other threads get a subtree each, the thread running the script is the root
+                root = self.root['children'].setdefault(('<thread>', thread_id), {"name": f"<thread {thread_id}>", "self": [0.0, 0.0], "children": {}})
+            thread = self.threads[thread_id] = {
+                "clock": (0.0, 0.0),
+                "stack": [], # [frame_id, function key, line key, call tree node]
+                "line_spans": Spans(),
+                "function_spans": Spans(),
+                "root": root
+            }
+        return thread
+
+    def _push(self, thread: dict, row: dict) -> list:
+        function = (row['source_file'], row['target'])
+        parent = thread['stack'][-1][3] if thread['stack'] else thread['root']
+        node = parent['children'].get(function)
+        if node is None:
+            node = parent['children'][function] = {"name": f"{row['target']} ({row['source_file']})", "self": [0.0, 0.0], "children": {}}
+        line = (row['source_file'], row['line_number'])
+        thread['function_spans'].enter(function, thread['clock'])
+        thread['line_spans'].enter(line, thread['clock'])
+        thread['stack'].append([row['frame_id'], function, line, node])
+        return thread['stack'][-1]
+
+    def _pop(self, thread: dict) -> None:
+        _, function, line, _ = thread['stack'].pop()
+        thread['line_spans'].leave(line, thread['clock'])
+        thread['function_spans'].leave(function, thread['clock'])
+
+    def _frame(self, thread: dict, row: dict) -> list:
+        # the row's frame on top of the stack, rows of thinned out or filtered calls can leave it missing
+        if any(frame[0] == row['frame_id'] for frame in thread['stack']):
+            while thread['stack'][-1][0] != row['frame_id']:
+                self._pop(thread)
+            return thread['stack'][-1]
+        return self._push(thread, row)
+
+    def add(self, row: dict) -> None:
+        wall, cpu = row['time_taken'] or 0.0, row['cpu_time'] or 0.0
+        thread = self._thread(row.get('thread_id') or 0)
+
+        if thread['stack']:
+            _, function, line, node = thread['stack'][-1]
+            for totals in (self.lines[line], self.functions[function]):
+                totals[1] += wall
+                totals[2] += cpu
+        else:
+            node = thread['root']
+        node['self'][0] += wall
+        node['self'][1] += cpu
+
+        thread['clock'] = (thread['clock'][0] + wall, thread['clock'][1] + cpu)
+
+        match row['event']:
+            case 'call' | 'resume':
+                frame = self._push(thread, row)
+                if row['event'] == 'call':
+                    self.functions[frame[1]][0] += 1
+            case 'line' | 'exception':
+                frame = self._frame(thread, row)
+                line = (row['source_file'], row['line_number'])
+                if frame[2] != line:
+                    thread['line_spans'].leave(frame[2], thread['clock'])
+                    thread['line_spans'].enter(line, thread['clock'])
+                    frame[2] = line
+                if row['event'] == 'line':
+                    self.lines[line][0] += 1
+            case 'return' | 'suspend':
+                if any(frame[0] == row['frame_id'] for frame in thread['stack']):
+                    while thread['stack'][-1][0] != row['frame_id']:
+                        self._pop(thread)
+                    self._pop(thread)
+
+    def _totals(self, spans: str) -> dict:
+        # summed over the threads, each measured on its own clock
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for thread in self.threads.values():
+            for key, (wall, cpu) in thread[spans].totals(thread['clock']).items():
+                totals[key][0] += wall
+                totals[key][1] += cpu
+        return totals
+
+    def call_tree(self) -> dict:
+        # {name, value, self, cpu, children}, value is the total wall time, as flame graph libraries expect;
+        # built without recursion, a deeply recursive script makes a deep tree
+        def convert(node: dict) -> dict:
+            return {"name": node['name'], "self": node['self'][0], "self_cpu": node['self'][1], "value": 0.0, "cpu": 0.0, "children": []}
+
+        tree = convert(self.root)
+        order = [(self.root, tree, None)]
+        pending = [(self.root, tree)]
+        while pending:
+            node, converted = pending.pop()
+            for child in node['children'].values():
+                converted_child = convert(child)
+                converted['children'].append(converted_child)
+                order.append((child, converted_child, converted))
+                pending.append((child, converted_child))
+
+        for _, converted, parent in reversed(order):
+            converted['value'] += converted['self']
+            converted['cpu'] += converted['self_cpu']
+            if parent is not None:
+                parent['value'] += converted['value']
+                parent['cpu'] += converted['cpu']
+        return tree
+
+    def to_dict(self, limit: int | None = None) -> dict:
+        line_totals = self._totals('line_spans')
+        function_totals = self._totals('function_spans')
+
+        lines = sorted(
+            (
+                {
+                    "source_file": source_file,
+                    "line_number": line_number,
+                    "hits": hits,
+                    "self_time": self_wall,
+                    "self_cpu_time": self_cpu,
+                    "total_time": line_totals.get((source_file, line_number), (0.0, 0.0))[0],
+                    "total_cpu_time": line_totals.get((source_file, line_number), (0.0, 0.0))[1]
+                }
+                for (source_file, line_number), (hits, self_wall, self_cpu) in self.lines.items()
+            ),
+            key=lambda line: line['self_time'],
+            reverse=True
+        )
+
+        functions = sorted(
+            (
+                {
+                    "source_file": source_file,
+                    "function": function,
+                    "calls": calls,
+                    "self_time": self_wall,
+                    "self_cpu_time": self_cpu,
+                    "total_time": function_totals.get((source_file, function), (0.0, 0.0))[0],
+                    "total_cpu_time": function_totals.get((source_file, function), (0.0, 0.0))[1]
+                }
+                for (source_file, function), (calls, self_wall, self_cpu) in self.functions.items()
+            ),
+            key=lambda function: function['total_time'],
+            reverse=True
+        )
+
+        return {
+            "time": sum(thread['clock'][0] for thread in self.threads.values()),
+            "cpu_time": sum(thread['clock'][1] for thread in self.threads.values()),
+            "lines": lines[:limit],
+            "functions": functions[:limit],
+            "call_tree": self.call_tree()
+        }
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+from time import time
+
+from utils.branches import BRANCH_PATH, ON_PATH
+from utils.content_store import BlobPacker, BlobReader, recount_blob_refs
+from utils.keyframes import apply_diff
+
+VACUUM_PAGES = 4096 # freed pages handed back to the file system per pruning pass
+
+# approximate stored size of a timeline row, its diffs are stored a second time as variable_changes
+ROW_BYTES = """
+    64
+    + 2 * (IFNULL(length(global_diff), 0) + IFNULL(length(local_diff), 0))
+    + IFNULL(length(source_segment), 0) + IFNULL(length(return_value), 0)
+    + IFNULL(length(traceback), 0) + IFNULL(length(error), 0) + IFNULL(length(output), 0)
+"""
+
+class RetentionPolicy:
+    def __init__(self, max_events: int | None = 1_000_000, max_bytes: int | None = 256 * 1024 * 1024, max_age_s: float | None = None, check_every: int = 5000):
+        self.max_events = max_events # events kept in full per file, older ones are thinned down to keyframes
+        self.max_bytes = max_bytes   # stored bytes of those events, blobs shared between rows not counted
+        self.max_age_s = max_age_s   # seconds since an event was traced
+        self.check_every = check_every
+
+        self.events_since_check = 0
+
+    @classmethod
+    def from_dict(cls, config: dict | None):
+        if not config:
+            return cls()
+        return cls(
+            max_events=config.get('max_events'),
+            max_bytes=config.get('max_bytes'),
+            max_age_s=config.get('max_age_s')
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "max_events": self.max_events,
+            "max_bytes": self.max_bytes,
+            "max_age_s": self.max_age_s
+        }
+
+    def configure(self, config: dict | None) -> None:
+        other = RetentionPolicy.from_dict(config)
+        self.max_events = other.max_events
+        self.max_bytes = other.max_bytes
+        self.max_age_s = other.max_age_s
+
+    def due(self) -> bool:
+        self.events_since_check += 1
+
+        if self.events_since_check < self.check_every:
+            return False
+
+        self.events_since_check = 0
+        return bool(self.max_events or self.max_bytes or self.max_age_s)
+
+    def cutoff(self, cursor: sqlite3.Cursor, file: str, branch_id: int) -> int | None:
+        # the first timeline id on the branch's path to keep in full, None when everything fits
+        cutoffs = []
+
+        if self.max_events:
+            cursor.execute(
+                f"""
+                {BRANCH_PATH}
+                SELECT timeline.id
+                FROM path
+                {ON_PATH.format(table="timeline", id="id")}
+                ORDER BY timeline.id DESC
+                LIMIT 1
+                OFFSET :max_events
+                """,
+                {
+                    "file": file,
+                    "branch_id": branch_id,
+                    "max_events": self.max_events
+                }
+            )
+            if row := cursor.fetchone():
+                cutoffs.append(row[0] + 1)
+
+        if self.max_bytes:
+            cursor.execute(
+                f"""
+                {BRANCH_PATH}
+                SELECT id
+                FROM (
+                    SELECT timeline.id, SUM({ROW_BYTES}) OVER (ORDER BY timeline.id DESC) AS newer_bytes
+                    FROM path
+                    {ON_PATH.format(table="timeline", id="id")}
+                )
+                WHERE newer_bytes > :max_bytes
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                {
+                    "file": file,
+                    "branch_id": branch_id,
+                    "max_bytes": self.max_bytes
+                }
+            )
+            if row := cursor.fetchone():
+                cutoffs.append(row[0] + 1)
+
+        if self.max_age_s:
+            cursor.execute(
+                f"""
+                {BRANCH_PATH}
+                SELECT MAX(timeline.id)
+                FROM path
+                {ON_PATH.format(table="timeline", id="id")}
+                WHERE timeline.recorded_at < :oldest
+                """,
+                {
+                    "file": file,
+                    "branch_id": branch_id,
+                    "oldest": time() - self.max_age_s
+                }
+            )
+            if (row := cursor.fetchone()) and row[0] is not None:
+                cutoffs.append(row[0] + 1)
+
+        return max(cutoffs, default=None)
+
+def keyframe_at(db_connection: sqlite3.Connection, file: str, branch_id: int, timeline_id: int) -> dict:
+    # the cumulative scope after timeline_id on the branch's path, rebuilt the way the scope endpoint does it
+    blobs = BlobReader(db_connection)
+    cursor = db_connection.cursor()
+
+    parameters = {
+        "file": file,
+        "branch_id": branch_id,
+        "timeline_id": timeline_id
+    }
+
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT keyframes.timeline_id, keyframes.globals, keyframes.locals, keyframes.return_value, keyframes.error
+        FROM path
+        {ON_PATH.format(table="keyframes", id="timeline_id")}
+        WHERE keyframes.timeline_id <= :timeline_id
+        ORDER BY keyframes.timeline_id DESC
+        LIMIT 1
+        """,
+        parameters
+    )
+
+    if row := cursor.fetchone():
+        keyframe_id, globals_json, locals_json, return_value, error = row
+        scope_globals = json.loads(blobs.expand(globals_json))
+        scope_locals = json.loads(blobs.expand(locals_json))
+    else:
+        keyframe_id, scope_globals, scope_locals, return_value, error = -1, {}, {}, None, None
+
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT timeline.branch_id, timeline.global_diff, timeline.local_diff, timeline.return_value, timeline.error
+        FROM path
+        {ON_PATH.format(table="timeline", id="id")}
+        WHERE timeline.id > :keyframe_id
+          AND timeline.id <= :timeline_id
+        ORDER BY timeline.id ASC
+        """,
+        {
+            **parameters,
+            "keyframe_id": keyframe_id
+        }
+    )
+
+    row_branch_id = branch_id
+    for row_branch_id, global_diff, local_diff, row_return_value, row_error in cursor:
+        apply_diff(scope_globals, json.loads(blobs.expand(global_diff) or '{}'))
+        apply_diff(scope_locals, json.loads(blobs.expand(local_diff) or '{}'))
+        if row_return_value is not None:
+            return_value = row_return_value
+        if row_error is not None:
+            error = row_error
+
+    return {
+        "file": file,
+        "branch_id": row_branch_id, # the branch timeline_id's row is stored on
+        "timeline_id": timeline_id,
+        "globals": json.dumps(scope_globals),
+        "locals": json.dumps(scope_locals),
+        "return_value": return_value,
+        "error": error
+    }
+
+def thin(db_connection: sqlite3.Connection, file: str, branch_id: int, cutoff: int, blobs: BlobPacker) -> list[int] | None:
+    # drops every row on the branch's path before cutoff except keyframes, returns the checkpoint numbers
+    # no remaining row uses, None when there was nothing to thin; other branches keep their own rows
+    cursor = db_connection.cursor()
+
+    parameters = {
+        "file": file,
+        "branch_id": branch_id,
+        "cutoff": cutoff
+    }
+
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT timeline.branch_id, timeline.id, timeline.checkpoint, EXISTS (
+            SELECT 1
+            FROM keyframes
+            WHERE keyframes.file = :file
+              AND keyframes.branch_id = timeline.branch_id
+              AND keyframes.timeline_id = timeline.id
+        )
+        FROM path
+        {ON_PATH.format(table="timeline", id="id")}
+        WHERE timeline.id < :cutoff
+        """,
+        parameters
+    )
+
+    rows = cursor.fetchall()
+
+    if all(keyframed for _, _, _, keyframed in rows):
+        return None
+
+    # the first kept row gets a keyframe, the diffs leading up to it are about to go; so does every row
+    # another branch forks off, that branch still rebuilds its scope from there
+    cursor.execute(
+        f"""
+        {BRANCH_PATH}
+        SELECT DISTINCT branches.fork_id
+        FROM path
+        JOIN branches
+          ON branches.file = :file
+         AND branches.parent_id = path.branch_id
+         AND branches.fork_id BETWEEN path.first_id AND path.last_id
+        WHERE branches.fork_id < :cutoff
+        """,
+        parameters
+    )
+
+    keyframes = []
+    for timeline_id in [cutoff, *(fork_id for fork_id, in cursor.fetchall())]:
+        keyframe = keyframe_at(db_connection, file, branch_id, timeline_id)
+        keyframe["globals"] = blobs.pack_scope(keyframe["globals"], file, keyframe["branch_id"])
+        keyframe["locals"] = blobs.pack_scope(keyframe["locals"], file, keyframe["branch_id"])
+        keyframes.append(keyframe)
+
+    kept = {(keyframe["branch_id"], keyframe["timeline_id"]) for keyframe in keyframes}
+    dropped_rows = [
+        (file, row_branch_id, timeline_id)
+        for row_branch_id, timeline_id, _, keyframed in rows
+        if not keyframed and (row_branch_id, timeline_id) not in kept
+    ]
+
+    with db_connection:
+        blobs.store(cursor)
+
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO keyframes (file, branch_id, timeline_id, globals, locals, return_value, error)
+            VALUES (:file, :branch_id, :timeline_id, :globals, :locals, :return_value, :error)
+            """,
+            keyframes
+        )
+
+        # kept keyframe rows are history only, nothing can be restored before cutoff anymore
+        cursor.executemany(
+            """
+            UPDATE timeline
+            SET checkpoint = NULL
+            WHERE file = ?
+              AND branch_id = ?
+              AND id = ?
+              AND checkpoint IS NOT NULL
+            """,
+            [(file, row_branch_id, timeline_id) for row_branch_id, timeline_id, checkpoint, _ in rows if checkpoint is not None]
+        )
+
+        # cascades to their variable_changes
+        cursor.executemany(
+            """
+            DELETE FROM timeline
+            WHERE file = ?
+              AND branch_id = ?
+              AND id = ?
+            """,
+            dropped_rows
+        )
+
+        for row_branch_id in {row_branch_id for _, row_branch_id, _ in dropped_rows}:
+            recount_blob_refs(cursor, file, row_branch_id)
+
+        # branches share images: one is only dropped once no row of any branch uses it
+        cursor.execute(
+            """
+            SELECT DISTINCT checkpoint
+            FROM timeline
+            WHERE file = :file
+              AND checkpoint IS NOT NULL
+            """,
+            parameters
+        )
+
+        dropped = {checkpoint for _, _, checkpoint, _ in rows if checkpoint is not None} - {checkpoint for checkpoint, in cursor.fetchall()}
+
+    cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+    cursor.fetchall()
+
+    return sorted(dropped)
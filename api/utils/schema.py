@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+from pathlib import Path
+
+from utils.content_store import branch_blob_refs
+from utils.sessions import DEFAULT_SESSION
+
+TABLES = '''
+    CREATE TABLE IF NOT EXISTS files (
+        file TEXT NOT NULL,
+        
+        timeline_id INTEGER,    -- timeline pointer
+        branch_id INTEGER,      -- branch the timeline pointer is on
+        line_number INTEGER,    -- node pointer
+        
+        checkpoint_policy TEXT, -- JSON {every_events, every_ms, budget}
+        trace_filter TEXT,      -- JSON {include_modules, exclude_modules, include_functions, exclude_functions}
+        retention_policy TEXT,  -- JSON {max_events, max_bytes, max_age_s}
+        
+        PRIMARY KEY (file)
+    );
+    
+    CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT NOT NULL,
+        
+        file TEXT,    -- file pointer
+
+        PRIMARY KEY (id)
+        
+        FOREIGN KEY (file)
+            REFERENCES files(file)
+            ON DELETE SET NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS branches (
+        file TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        
+        parent_id INTEGER,  -- NULL for the root
+        fork_id INTEGER,    -- last timeline id shared with the parent, -1 for the root
+        
+        PRIMARY KEY (file, id),
+        
+        FOREIGN KEY (file)
+            REFERENCES files(file)
+            ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS timeline (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL DEFAULT 0,
+        id INTEGER NOT NULL,    -- event number along the branch's path
+        
+        event TEXT,
+        target TEXT,
+        return_value TEXT,
+        frame_id INTEGER,
+        function TEXT,
+        line_number INTEGER,
+        source_segment TEXT,
+        global_diff TEXT,   -- JSON, large values as "<blob:hash>"
+        local_diff TEXT,    -- JSON, large values as "<blob:hash>"
+        traceback TEXT,
+        error TEXT,
+        checkpoint INTEGER, -- CRIU dump number, NULL if no image was taken here
+        parked INTEGER,     -- pid of a forked copy of the tracer parked at this step, NULL once it is evicted, resumed or gone
+        output TEXT,        -- JSON [[stream, text], ...] printed since the previous event
+        source_file TEXT,   -- path of the executing file inside the session directory
+        recorded_at REAL,   -- unix time the event was traced
+        time_taken REAL,    -- seconds the traced code ran since the previous event, the tracer's own time left out
+        cpu_time REAL,      -- CPU seconds of the same stretch
+        thread_id INTEGER NOT NULL DEFAULT 0,   -- 0 for the thread running the script, others numbered as they first show up
+
+        -- +? sha256 TEXT UNIQUE
+        -- +? last_sha256 TEXT
+        
+        PRIMARY KEY (file, branch_id, id),
+        
+        FOREIGN KEY (file, branch_id)
+            REFERENCES branches(file, id)
+            ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS breakpoints (
+        file TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        
+        spec TEXT,  -- JSON {file?, line?, function?, condition?}
+        
+        PRIMARY KEY (file, id),
+        
+        FOREIGN KEY (file)
+            REFERENCES files(file)
+            ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS variable_changes (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL DEFAULT 0,
+        timeline_id INTEGER NOT NULL,
+        
+        scope TEXT NOT NULL,    -- 'global' | 'local'
+        name TEXT NOT NULL,
+        value TEXT,             -- JSON, "<deleted>" when removed, "<blob:hash>" when large
+        
+        PRIMARY KEY (file, branch_id, timeline_id, scope, name),
+        
+        FOREIGN KEY (file, branch_id, timeline_id)
+            REFERENCES timeline(file, branch_id, id)
+            ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS keyframes (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL DEFAULT 0,
+        timeline_id INTEGER NOT NULL,
+        
+        globals TEXT,       -- JSON, cumulative scope after this event
+        locals TEXT,        -- JSON
+        return_value TEXT,  -- last non-null up to here
+        error TEXT,
+        
+        PRIMARY KEY (file, branch_id, timeline_id),
+        
+        FOREIGN KEY (file, branch_id, timeline_id)
+            REFERENCES timeline(file, branch_id, id)
+            ON DELETE CASCADE
+    );
+    
+    CREATE TABLE IF NOT EXISTS line_stats (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL,
+        source_file TEXT NOT NULL,
+        line_number INTEGER NOT NULL,
+        
+        hits INTEGER NOT NULL DEFAULT 0,        -- 'line' events of the branch's own rows
+        exceptions INTEGER NOT NULL DEFAULT 0,  -- 'exception' events
+        first_id INTEGER,                       -- first and last row at the line, any event
+        last_id INTEGER,
+        last_frame_id INTEGER,                  -- frame_id of the last row
+        
+        PRIMARY KEY (file, branch_id, source_file, line_number),
+        
+        FOREIGN KEY (file, branch_id)
+            REFERENCES branches(file, id)
+            ON DELETE CASCADE
+    );
+    
+    CREATE TABLE IF NOT EXISTS frames (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL,
+        id INTEGER NOT NULL,    -- timeline.frame_id, the timeline id of the frame's first event
+        
+        parent_id INTEGER,      -- closest traced caller
+        function TEXT,          -- timeline.target of the frame
+        source_file TEXT,
+        start_event INTEGER,    -- timeline id of the first event, the same as id
+        end_event INTEGER,      -- timeline id of the return event, NULL while running
+        depth INTEGER,          -- 0 for frames without a traced caller
+        suspends INTEGER,       -- 1 for generators and coroutines, they suspend and resume before end_event
+        
+        -- a frame still running where a branch forks is copied into the branch, with its own end_event
+        
+        PRIMARY KEY (file, branch_id, id),
+        
+        FOREIGN KEY (file, branch_id)
+            REFERENCES branches(file, id)
+            ON DELETE CASCADE
+    );
+    
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT NOT NULL,     -- sha256 of the value JSON, referenced as "<blob:hash>" from diffs, values and keyframes
+        
+        data BLOB,              -- compressed value JSON
+        size INTEGER,           -- uncompressed length
+        
+        PRIMARY KEY (hash)
+    );
+    
+    CREATE TABLE IF NOT EXISTS blob_refs (
+        file TEXT NOT NULL,
+        branch_id INTEGER NOT NULL,
+        hash TEXT NOT NULL,     -- a blob some row of the branch refers to, written with the rows
+        
+        PRIMARY KEY (file, branch_id, hash),
+        
+        FOREIGN KEY (file, branch_id)
+            REFERENCES branches(file, id)
+            ON DELETE CASCADE
+    );
+'''
+
+def create_tables(database: Path) -> None:
+    with sqlite3.connect(database) as db_connection:
+        # only takes effect on a new file, migrate() converts existing ones
+        db_connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
+        db_connection.executescript(TABLES)
+        
+        migrate(db_connection)
+
+SCHEMA_VERSION = 13
+
+def add_column(cursor, table: str, column: str, declaration: str) -> None:
+    cursor.execute(f"PRAGMA table_info({table})")
+    
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def json_items(diff: str | None) -> list:
+    try:
+        return list(json.loads(diff or '{}').items())
+    except (ValueError, AttributeError):
+        return []
+
+def migrate(db_connection) -> None:
+    cursor = db_connection.cursor()
+    
+    cursor.execute("PRAGMA user_version")
+    
+    version, = cursor.fetchone()
+    
+    if version < 1:
+        # trace.db files from before checkpoints and breakpoints
+        add_column(cursor, "timeline", "checkpoint", "INTEGER")
+        add_column(cursor, "files", "checkpoint_policy", "TEXT")
+    
+    if version < 2:
+        cursor.executescript('''
+            CREATE INDEX IF NOT EXISTS timeline_line_number ON timeline (file, line_number);
+            CREATE INDEX IF NOT EXISTS timeline_frame_id ON timeline (file, frame_id);
+            CREATE INDEX IF NOT EXISTS timeline_function ON timeline (file, function);
+            CREATE INDEX IF NOT EXISTS variable_changes_name ON variable_changes (file, name, timeline_id);
+        ''')
+        
+        cursor.execute(
+            """
+            SELECT file, id, global_diff, local_diff
+            FROM timeline
+            """
+        )
+        
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO variable_changes (file, timeline_id, scope, name, value)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (file, timeline_id, scope, name, json.dumps(value))
+                for file, timeline_id, global_diff, local_diff in cursor.fetchall()
+                for scope, diff in (('global', global_diff), ('local', local_diff))
+                for name, value in json_items(diff)
+            ]
+        )
+    
+    if version < 3:
+        add_column(cursor, "files", "trace_filter", "TEXT")
+    
+    if version < 4:
+        add_column(cursor, "timeline", "output", "TEXT")
+    
+    if version < 5:
+        # the single state row becomes the default session
+        add_column(cursor, "timeline", "source_file", "TEXT")
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'state'")
+        
+        if cursor.fetchone():
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO sessions (id, file)
+                SELECT :session, file
+                FROM state
+                WHERE id = 1
+                """,
+                {
+                    "session": DEFAULT_SESSION
+                }
+            )
+    
+    if version < 6:
+        add_column(cursor, "files", "retention_policy", "TEXT")
+        add_column(cursor, "timeline", "recorded_at", "REAL")
+    
+    if version < 7:
+        # every existing timeline becomes the root branch of its file
+        add_column(cursor, "files", "branch_id", "INTEGER")
+        
+        cursor.execute("PRAGMA table_info(timeline)")
+        
+        if "branch_id" not in {row[1] for row in cursor.fetchall()}:
+            # the primary keys change, so the three tables are rebuilt
+            db_connection.commit()
+            cursor.execute("PRAGMA legacy_alter_table = ON") # keeps the foreign keys pointing at the names
+            for table in ("timeline", "variable_changes", "keyframes"):
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_v6")
+            cursor.execute("PRAGMA legacy_alter_table = OFF")
+            
+            cursor.executescript(TABLES)
+            
+            cursor.executescript('''
+                INSERT INTO timeline (
+                    file, branch_id, id, event, target, return_value,
+                    frame_id, function, line_number, source_segment,
+                    global_diff, local_diff, traceback, error, checkpoint,
+                    output, source_file, recorded_at
+                )
+                SELECT file, 0, id, event, target, return_value,
+                       frame_id, function, line_number, source_segment,
+                       global_diff, local_diff, traceback, error, checkpoint,
+                       output, source_file, recorded_at
+                FROM timeline_v6;
+                
+                INSERT INTO variable_changes (file, branch_id, timeline_id, scope, name, value)
+                SELECT file, 0, timeline_id, scope, name, value
+                FROM variable_changes_v6;
+                
+                INSERT INTO keyframes (file, branch_id, timeline_id, globals, locals, return_value, error)
+                SELECT file, 0, timeline_id, globals, locals, return_value, error
+                FROM keyframes_v6;
+                
+                DROP TABLE keyframes_v6;
+                DROP TABLE variable_changes_v6;
+                DROP TABLE timeline_v6;
+            ''')
+        
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO branches (file, id, parent_id, fork_id)
+            SELECT file, 0, NULL, -1
+            FROM files
+            """
+        )
+        
+        cursor.execute("UPDATE files SET branch_id = 0 WHERE branch_id IS NULL")
+        
+        cursor.executescript('''
+            DROP INDEX IF EXISTS timeline_line_number;
+            DROP INDEX IF EXISTS timeline_frame_id;
+            DROP INDEX IF EXISTS timeline_function;
+            DROP INDEX IF EXISTS variable_changes_name;
+            
+            CREATE INDEX IF NOT EXISTS timeline_line_number ON timeline (file, branch_id, line_number, id);
+            CREATE INDEX IF NOT EXISTS timeline_frame_id ON timeline (file, branch_id, frame_id);
+            CREATE INDEX IF NOT EXISTS timeline_function ON timeline (file, branch_id, function);
+            CREATE INDEX IF NOT EXISTS variable_changes_name ON variable_changes (file, branch_id, name, timeline_id);
+            CREATE INDEX IF NOT EXISTS branches_parent_id ON branches (file, parent_id);
+        ''')
+    
+    if version < 8:
+        add_column(cursor, "timeline", "time_taken", "REAL")
+        add_column(cursor, "timeline", "cpu_time", "REAL")
+    
+    if version < 9:
+        # counted from the stored rows once, TimelineWriter keeps it up to date from here
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO line_stats (file, branch_id, source_file, line_number, hits, exceptions, first_id, last_id, last_frame_id)
+            SELECT lines.*, timeline.frame_id
+            FROM (
+                SELECT file, branch_id, IFNULL(source_file, 'main.py'), line_number,
+                       SUM(event = 'line'), SUM(event = 'exception'), MIN(id), MAX(id) AS last_id
+                FROM timeline
+                WHERE line_number IS NOT NULL
+                GROUP BY file, branch_id, IFNULL(source_file, 'main.py'), line_number
+            ) AS lines
+            JOIN timeline
+              ON timeline.file = lines.file
+             AND timeline.branch_id = lines.branch_id
+             AND timeline.id = lines.last_id
+            """
+        )
+    
+    if version < 10:
+        # frame ids recorded before this were addresses, such timelines get no frames rows;
+        # the caller of a frame is found by a range lookup on this index
+        cursor.executescript('''
+            DROP INDEX IF EXISTS timeline_frame_id;
+            
+            CREATE INDEX IF NOT EXISTS timeline_frame_id ON timeline (file, branch_id, frame_id, id);
+        ''')
+    
+    if version < 11:
+        add_column(cursor, "timeline", "thread_id", "INTEGER NOT NULL DEFAULT 0")
+        add_column(cursor, "frames", "suspends", "INTEGER")
+    
+    if version < 12:
+        # found by scanning every stored value once, the writers keep it up to date from here
+        cursor.execute("CREATE INDEX IF NOT EXISTS blob_refs_hash ON blob_refs (hash)")
+        
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO blob_refs (file, branch_id, hash)
+            VALUES (?, ?, ?)
+            """,
+            branch_blob_refs(cursor, None)
+        )
+    
+    if version < 13:
+        add_column(cursor, "timeline", "parked", "INTEGER")
+    
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    db_connection.commit()
+    
+    cursor.execute("PRAGMA auto_vacuum")
+    
+    if cursor.fetchone()[0] != 2:
+        # pruning hands pages back through incremental_vacuum, switching over takes one full VACUUM
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
@@ -2,6 +2,9 @@
 
 from json import dumps
 from functools import partial
+from collections import defaultdict
+from dis import get_instructions
+from types import CodeType, FrameType
 
 def default_json_handler(obj):
     return f"<{type(obj).__name__}>"
@@ -17,3 +20,124 @@ def diff_scope(old_scope: dict, new_scope: dict):
         for key in old_scope.keys() | new_scope.keys()
         if old_scope.get(key) != new_scope.get(key)
     }
+
+ALL = None # every name may have changed
+
+_GLOBAL_WRITES = {'STORE_GLOBAL', 'DELETE_GLOBAL'}
+_LOCAL_WRITES = {'STORE_FAST', 'DELETE_FAST', 'STORE_DEREF', 'DELETE_DEREF', 'STORE_NAME', 'DELETE_NAME'}
+_NAME_WRITES = {'STORE_NAME', 'DELETE_NAME'}
+_WRITES_ANYTHING = {'IMPORT_STAR'}
+_DYNAMIC_SCOPE = {'globals', 'locals', 'vars', 'exec', 'eval'}
+
+_code_writes_cache = {}
+
+def code_writes(code: CodeType) -> tuple[dict, dict]:
+    if (writes := _code_writes_cache.get(code)) is not None:
+        return writes
+
+    is_module = code.co_name == '<module>'
+    global_writes, local_writes = defaultdict(set), defaultdict(set)
+    line = code.co_firstlineno
+
+    for instruction in get_instructions(code):
+        if instruction.starts_line:
+            line = getattr(instruction, 'line_number', None) or instruction.starts_line
+
+        name = instruction.argval
+
+        if instruction.opname in _GLOBAL_WRITES or (is_module and instruction.opname in _NAME_WRITES):
+            if global_writes[line] is not ALL:
+                global_writes[line].add(name)
+        elif instruction.opname in _LOCAL_WRITES:
+            if local_writes[line] is not ALL:
+                local_writes[line].add(name)
+        elif instruction.opname in _WRITES_ANYTHING or (
+            instruction.opname in ('LOAD_GLOBAL', 'LOAD_NAME') and name in _DYNAMIC_SCOPE
+        ):
+            global_writes[line] = local_writes[line] = ALL
+
+    writes = _code_writes_cache[code] = dict(global_writes), dict(local_writes)
+    return writes
+
+def _fingerprint(value):
+    # identity plus size, so in-place growth of builtin containers is noticed without copying them
+    if type(value) in (list, dict, set, bytearray):
+        return value, len(value)
+    return value, None
+
+def _changed(old, new) -> bool:
+    (old_value, old_size), (new_value, new_size) = old, new
+    if old_size != new_size:
+        return True
+    if old_value is new_value:
+        return False
+    try:
+        return bool(old_value != new_value)
+    except Exception:
+        return True
+
+def diff_fingerprints(snapshot: dict, scope: dict, names=ALL) -> dict:
+    changes = {}
+
+    if names is ALL:
+        for name, value in scope.items():
+            new = _fingerprint(value)
+            if name not in snapshot or _changed(snapshot[name], new):
+                snapshot[name] = new
+                changes[name] = value
+        if len(snapshot) > len(scope):
+            for name in snapshot.keys() - scope.keys():
+                del snapshot[name]
+                changes[name] = "<deleted>"
+        return changes
+
+    for name in names:
+        if name in scope:
+            new = _fingerprint(value := scope[name])
+            if name not in snapshot or _changed(snapshot[name], new):
+                snapshot[name] = new
+                changes[name] = value
+        elif name in snapshot:
+            del snapshot[name]
+            changes[name] = "<deleted>"
+    return changes
+
+class ScopeTracker:
+    def __init__(self):
+        self.globals = {}     # id(f_globals) -> {name: fingerprint}
+        self.locals = {}      # frame id -> {name: fingerprint}
+        self.last_lines = {}  # frame id -> line of the previous event in that frame
+
+    def update(self, frame: FrameType, frame_id: int, parent_id: int | None, track_locals: bool) -> tuple[dict, dict]:
+        code = frame.f_code
+        global_writes, local_writes = code_writes(code)
+        last_line = self.last_lines.get(frame_id)
+        self.last_lines[frame_id] = frame.f_lineno
+
+        # writes made while running a line become visible at the next event of the same frame
+        if (global_snapshot := self.globals.get(id(frame.f_globals))) is None:
+            global_snapshot = self.globals[id(frame.f_globals)] = {}
+            global_diff = diff_fingerprints(global_snapshot, frame.f_globals)
+        elif last_line is not None and last_line in global_writes:
+            global_diff = diff_fingerprints(global_snapshot, frame.f_globals, global_writes[last_line])
+        else:
+            global_diff = {}
+
+        if not track_locals:
+            return global_diff, {}
+
+        if (local_snapshot := self.locals.get(frame_id)) is None:
+            # a new frame is diffed against its caller, like the frontend expects
+            local_snapshot = self.locals[frame_id] = dict(self.locals.get(parent_id, ()))
+            return global_diff, diff_fingerprints(local_snapshot, frame.f_locals)
+
+        names = local_writes.get(last_line, set())
+        if names is not ALL and (cells := code.co_cellvars + code.co_freevars):
+            names = names.union(cells)
+        if not names and names is not ALL:
+            return global_diff, {}
+        return global_diff, diff_fingerprints(local_snapshot, frame.f_locals, names)
+
+    def forget(self, frame_id: int) -> None:
+        self.locals.pop(frame_id, None)
+        self.last_lines.pop(frame_id, None)
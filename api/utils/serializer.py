@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+from collections.abc import Callable, Collection
+from dataclasses import fields, is_dataclass
+from itertools import islice
+from math import isfinite
+from reprlib import Repr
+from typing import Any
+
+class Serializer:
+    def __init__(self, max_depth: int = 6, max_items: int = 100, max_string: int = 1000):
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string = max_string
+        self.summarizers = {}
+        self.resolved = {} # class -> summarizer found along its MRO, or None
+        # collections without a serializer of their own (deque, array, ...), bounded while they are written out
+        self.repr = Repr()
+        self.repr.maxlevel = max_depth
+        self.repr.maxtuple = self.repr.maxlist = self.repr.maxarray = self.repr.maxdict = max_items
+        self.repr.maxset = self.repr.maxfrozenset = self.repr.maxdeque = max_items
+        self.repr.maxstring = self.repr.maxother = max_string
+
+    def register(self, cls: type | str, summarizer: Callable[[Any], Any]) -> None:
+        # cls may be a "module.QualName" string so optional packages never have to be imported
+        self.summarizers[cls] = summarizer
+        self.resolved.clear()
+
+    def __call__(self, obj):
+        return self._serialize(obj, 0, {}, set(), "value")
+
+    def scope(self, scope: dict) -> dict:
+        # every name is written out in full, a reference shared between names would otherwise
+        # only point at a name that a diff or keyframe may not carry
+        return {
+            str(name): self._serialize(value, 0, {}, set(), str(name))
+            for name, value in scope.items()
+        }
+
+    def _summarizer(self, cls: type):
+        # a summarizer covers subclasses too, the closest registered base wins
+        if not self.summarizers:
+            return None
+        try:
+            return self.resolved[cls]
+        except KeyError:
+            pass
+        summarizer = None
+        for base in cls.__mro__:
+            summarizer = self.summarizers.get(base) or self.summarizers.get(f"{base.__module__}.{base.__qualname__}")
+            if summarizer is not None:
+                break
+        self.resolved[cls] = summarizer
+        return summarizer
+
+    @staticmethod
+    def _path(path) -> str:
+        # paths stay (parent, key) tuples until a cycle or shared reference has to name them
+        keys = []
+        while isinstance(path, tuple):
+            path, key = path
+            keys.append(f"[{key!r}]")
+        return path + ''.join(reversed(keys))
+
+    def _string(self, text: str) -> str:
+        if len(text) <= self.max_string:
+            return text
+        return f"{text[:self.max_string]}<… {len(text) - self.max_string} more chars>"
+
+    def _serialize(self, obj, depth: int, seen: dict, stack: set, path: str | tuple):
+        if obj is None or isinstance(obj, (bool, int)):
+            return obj
+        if isinstance(obj, str):
+            return self._string(obj)
+        if isinstance(obj, float):
+            return obj if isfinite(obj) else str(obj)
+
+        cls = type(obj)
+
+        if (summarizer := self._summarizer(cls)) is not None:
+            try:
+                return summarizer(obj)
+            except Exception:
+                return f"<{cls.__name__} (unprintable)>"
+
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            data = bytes(obj[:self.max_string])
+            return self._string(repr(data)) if len(obj) <= self.max_string else f"{data!r}<… {len(obj) - self.max_string} more bytes>"
+
+        key = id(obj) # taken before numpy conversion, the scope keeps the original alive
+
+        if cls.__module__ == 'numpy':
+            if getattr(obj, 'ndim', None) == 0:
+                return self._serialize(obj.item(), depth, seen, stack, path)
+            if hasattr(obj, 'shape') and obj.size > self.max_items:
+                return f"<{cls.__name__} shape={obj.shape} dtype={obj.dtype}>"
+            if hasattr(obj, 'tolist'):
+                obj = obj.tolist()
+
+        is_container = isinstance(obj, (list, tuple, dict, set, frozenset)) or (is_dataclass(obj) and not isinstance(obj, type))
+
+        if not is_container:
+            try:
+                if isinstance(obj, Collection):
+                    return self._string(self.repr.repr(obj))
+                return self._string(str(obj))
+            except Exception:
+                return f"<{cls.__name__} (unprintable)>"
+
+        if key in stack:
+            return f"<cycle: {self._path(seen[key])}>"
+        if key in seen:
+            return f"<same {cls.__name__} as {self._path(seen[key])}>"
+        if depth >= self.max_depth:
+            size = len(obj) if hasattr(obj, '__len__') else len(fields(obj))
+            return f"<{cls.__name__} of {size} items>"
+
+        seen[key] = path
+        stack.add(key)
+        try:
+            if isinstance(obj, dict):
+                items, size = obj.items(), len(obj)
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                items = None
+            else:
+                items = [(field.name, getattr(obj, field.name, None)) for field in fields(obj)]
+                size = len(items)
+
+            if items is not None:
+                result = {
+                    self._string(str(name)): self._serialize(value, depth + 1, seen, stack, (path, name))
+                    for name, value in islice(items, self.max_items)
+                }
+                if size > self.max_items:
+                    result["<truncated>"] = f"{size - self.max_items} more items"
+                return result
+
+            result = [
+                self._serialize(value, depth + 1, seen, stack, (path, index))
+                for index, value in enumerate(islice(obj, self.max_items))
+            ]
+            if len(obj) > self.max_items:
+                result.append(f"<… {len(obj) - self.max_items} more items>")
+            return result
+        finally:
+            stack.discard(key)
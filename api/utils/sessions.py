@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import signal
+import subprocess
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+TRACE_HOME = Path(os.environ.get('TRACE_HOME', Path.cwd())) # the api directory, tracers run inside their session directory
+SESSIONS_DIR = TRACE_HOME / 'sessions'
+DEFAULT_SESSION = 'default'
+
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+CHANNELS = ('_server_to_app', '_watcher', '_replay', '_pool')
+
+def valid_session_id(session_id: str) -> bool:
+    return SESSION_ID.fullmatch(session_id) is not None
+
+def session_dir(session_id: str) -> Path:
+    return SESSIONS_DIR / session_id
+
+def session_channels(session_id: str) -> dict[str, str]:
+    # inbound channels are per session, everything the tracers send goes through one shared channel
+    return {
+        name: str(session_dir(session_id) / f'{name}.txt')
+        for name in CHANNELS
+    }
+
+def session_file(session_id: str, filename: str = 'main.py') -> str:
+    return f'{session_id}/{filename}'
+
+class TracerScheduler:
+    # at most max_tracers live tracers, starting one more stops the least recently used,
+    # which resumes from its last checkpoint the next time its session is touched
+    def __init__(self, max_tracers: int = 4, privileged: bool = False):
+        self.max_tracers = max_tracers
+        self.privileged = privileged # tracers run through sudo, so killing them does as well
+        self.running = OrderedDict() # session id -> process
+        self.lock = threading.Lock()
+
+    def _reap(self) -> None:
+        for session_id, process in list(self.running.items()):
+            if process.poll() is not None:
+                del self.running[session_id]
+
+    def _kill(self, process: subprocess.Popen) -> None:
+        # a watcher leads its own process group, the traced child and its parked copies with it
+        try:
+            if self.privileged:
+                subprocess.run(["sudo", "kill", "-KILL", "--", f"-{process.pid}"], timeout=5)
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, subprocess.TimeoutExpired):
+            process.kill()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def is_running(self, session_id: str) -> bool:
+        with self.lock:
+            self._reap()
+            return session_id in self.running
+
+    def start(self, session_id: str, launch: Callable[[], subprocess.Popen]) -> bool:
+        # returns True when a new tracer was launched
+        with self.lock:
+            self._reap()
+
+            if session_id in self.running:
+                self.running.move_to_end(session_id)
+                return False
+
+            while self.running and len(self.running) >= self.max_tracers:
+                _, process = self.running.popitem(last=False)
+                self._kill(process)
+
+            self.running[session_id] = launch()
+            return True
+
+    def stop(self, session_id: str) -> None:
+        with self.lock:
+            if (process := self.running.pop(session_id, None)) is not None:
+                self._kill(process)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import threading
+from functools import wraps
+from operator import itemgetter
+from pathlib import Path
+from time import monotonic
+
+from utils.content_store import BlobPacker
+from utils.frames import frame_rows
+from utils.line_stats import LINE_STATS_UPSERT, count_lines
+
+TIMELINE_COLUMNS = (
+    'id', 'branch_id', 'event', 'target', 'return_value', 'file',
+    'frame_id', 'function', 'line_number', 'source_segment',
+    'global_diff', 'local_diff', 'traceback', 'error', 'checkpoint',
+    'parked', 'output', 'source_file', 'recorded_at', 'time_taken',
+    'cpu_time', 'thread_id'
+)
+
+# bound by position, picking 22 named parameters out of every row's dict costs more than the insert itself;
+# rows are never replaced, BranchFollower puts a run that differs from the stored one on a new branch, so
+# a duplicate key is a bug that has to fail instead of dropping the old row's children
+TIMELINE_INSERT = f"""
+    INSERT INTO timeline ({', '.join(TIMELINE_COLUMNS)})
+    VALUES ({', '.join('?' * len(TIMELINE_COLUMNS))})
+"""
+
+timeline_values = itemgetter(*TIMELINE_COLUMNS)
+
+FRAMES_INSERT = """
+    INSERT INTO frames (file, branch_id, id, parent_id, function, source_file, start_event, end_event, depth, suspends)
+    VALUES (:file, :branch_id, :id, :parent_id, :function, :source_file, :id, :end_event, :depth, :suspends)
+"""
+
+def locked(method):
+    # a thread saves into its own writer while the thread running the script flushes or closes them all
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class TimelineWriter:
+    def __init__(self, database: Path, max_rows: int = 1000, max_delay: float = .5, moves_pointer: bool = True):
+        self.database = database
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.moves_pointer = moves_pointer # False for the writers of threads the script started, the pointer follows its main thread
+
+        self.db_connection = None
+        self.blobs = BlobPacker()
+        self.rows = []
+        self.variable_changes = []
+        self.keyframes = []
+        self.pointers = {} # file -> last row placed, written or reproduced from a stored path
+        self.first_row_at = None
+        self.lock = threading.RLock()
+
+    @locked
+    def connect(self) -> sqlite3.Connection:
+        if self.db_connection is None:
+            # a thread's writer is flushed and closed from the thread running the script as well
+            self.db_connection = sqlite3.connect(self.database, check_same_thread=False)
+            self.db_connection.execute("PRAGMA journal_mode = WAL;")
+            self.db_connection.execute("PRAGMA synchronous = NORMAL;")
+            self.db_connection.execute("PRAGMA foreign_keys = ON;")
+        return self.db_connection
+
+    @locked
+    def save(self, row: dict, variable_changes: list[tuple] = (), keyframe: dict | None = None, write: bool = True, branch_id: int | None = None) -> None:
+        # write=False only moves the pointer, the row is already stored on the branch it names;
+        # branch_id is the branch the pointer follows, the row may be stored on one of its ancestors
+        if self.first_row_at is None:
+            self.first_row_at = monotonic()
+
+        if self.moves_pointer:
+            self.pointers[row['file']] = {
+                "id": row['id'],
+                "file": row['file'],
+                "line_number": row['line_number'],
+                "branch_id": row['branch_id'] if branch_id is None else branch_id
+            }
+
+        if write:
+            # values are packed into blobs by the tracer already, row['blobs'] lists the ones it refers to
+            self.rows.append(row)
+            self.variable_changes.extend(
+                (file, row['branch_id'], timeline_id, scope, name, value)
+                for file, timeline_id, scope, name, value in variable_changes
+            )
+            if row.get('blobs'):
+                self.blobs.refer(row['file'], row['branch_id'], row['blobs'])
+            if keyframe is not None:
+                self.keyframes.append({**keyframe, "branch_id": row['branch_id']})
+                self.blobs.refer(row['file'], row['branch_id'], keyframe['blobs'])
+
+        if len(self.rows) >= self.max_rows or monotonic() - self.first_row_at >= self.max_delay:
+            self.flush()
+
+    @locked
+    def flush(self) -> None:
+        if self.first_row_at is None:
+            return
+
+        self.first_row_at = None
+
+        rows, self.rows = self.rows, []
+        variable_changes, self.variable_changes = self.variable_changes, []
+        keyframes, self.keyframes = self.keyframes, []
+        last_rows, self.pointers = self.pointers, {}
+
+        with self.connect() as db_connection:
+            cursor = db_connection.cursor()
+
+            self.blobs.store(cursor)
+
+            cursor.executemany(TIMELINE_INSERT, map(timeline_values, rows))
+
+            # every row is written once, reproduced ones are only placed, so the counts only ever grow
+            cursor.executemany(LINE_STATS_UPSERT, count_lines(rows))
+
+            # a frame that starts and returns within the batch is inserted finished, only the returns
+            # of frames started in an earlier batch are updated
+            returns = {
+                (row['file'], row['branch_id'], row['frame_id']): row['id']
+                for row in rows
+                if row['event'] == 'return'
+            }
+            frames = frame_rows(rows)
+            for frame in frames:
+                frame['end_event'] = returns.pop((frame['file'], frame['branch_id'], frame['id']), None)
+
+            cursor.executemany(FRAMES_INSERT, frames)
+
+            cursor.executemany(
+                """
+                UPDATE frames
+                SET end_event = ?
+                WHERE file = ?
+                  AND branch_id = ?
+                  AND id = ?
+                """,
+                [(end_event, file, branch_id, frame_id) for (file, branch_id, frame_id), end_event in returns.items()]
+            )
+
+            cursor.executemany(
+                """
+                INSERT INTO variable_changes (file, branch_id, timeline_id, scope, name, value)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                variable_changes
+            )
+
+            cursor.executemany(
+                """
+                INSERT INTO keyframes (file, branch_id, timeline_id, globals, locals, return_value, error)
+                VALUES (:file, :branch_id, :timeline_id, :globals, :locals, :return_value, :error)
+                """,
+                keyframes
+            )
+
+            cursor.executemany(
+                """
+                UPDATE files
+                SET timeline_id = :id,
+                    branch_id = :branch_id,
+                    line_number = :line_number
+                WHERE file = :file;
+                """,
+                last_rows.values()
+            )
+
+    @locked
+    def move_pointer(self, row: dict) -> None:
+        # for a step whose row is already stored, saving it again would fail
+        self.flush()
+        with self.connect() as db_connection:
+            db_connection.execute(
+                """
+                UPDATE files
+                SET timeline_id = :id,
+                    branch_id = :branch_id,
+                    line_number = :line_number
+                WHERE file = :file;
+                """,
+                row
+            )
+
+    @locked
+    def new_branch(self, file: str, parent_id: int, fork_id: int, open_frames: list[dict] = ()) -> int:
+        # rows already placed go first, they belong to the path being left;
+        # the frames still running at the fork end on the new branch, so they are copied into it
+        self.flush()
+        with self.connect() as db_connection:
+            cursor = db_connection.cursor()
+            cursor.execute(
+                """
+                INSERT INTO branches (file, id, parent_id, fork_id)
+                SELECT :file, IFNULL(MAX(id), -1) + 1, :parent_id, :fork_id
+                FROM branches
+                WHERE file = :file
+                """,
+                {
+                    "file": file,
+                    "parent_id": parent_id,
+                    "fork_id": fork_id
+                }
+            )
+            cursor.execute(
+                """
+                SELECT MAX(id)
+                FROM branches
+                WHERE file = :file
+                """,
+                {
+                    "file": file
+                }
+            )
+            branch_id = cursor.fetchone()[0]
+            cursor.executemany(
+                FRAMES_INSERT,
+                [
+                    {**frame, "file": file, "branch_id": branch_id, "end_event": None}
+                    for frame in open_frames
+                ]
+            )
+            return branch_id
+
+    @locked
+    def close(self) -> None:
+        # called before every CRIU dump as well, so no image carries an open database
+        self.flush()
+        if self.db_connection is not None:
+            self.db_connection.close()
+            self.db_connection = None
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+from types import CodeType
+
+class TraceFilter:
+    def __init__(self, config: dict | None = None, paths: set[str] = frozenset()):
+        self.paths = paths # co_filename values of the files found by find_python_imports
+        self.decisions = {}
+        self.include_modules = self.exclude_modules = frozenset()
+        self.include_functions = self.exclude_functions = frozenset()
+        self.configure(config)
+
+    @classmethod
+    def from_dict(cls, config: dict | None):
+        return cls(config)
+
+    def to_dict(self) -> dict:
+        return {
+            "include_modules": sorted(self.include_modules),
+            "exclude_modules": sorted(self.exclude_modules),
+            "include_functions": sorted(self.include_functions),
+            "exclude_functions": sorted(self.exclude_functions)
+        }
+
+    def configure(self, config: dict | None) -> bool:
+        config = config or {}
+        before = self.to_dict()
+
+        # modules match a file name ("helpers.py") or its stem, functions a co_name or co_qualname
+        self.include_modules = set(config.get('include_modules') or ())
+        self.exclude_modules = set(config.get('exclude_modules') or ())
+        self.include_functions = set(config.get('include_functions') or ())
+        self.exclude_functions = set(config.get('exclude_functions') or ())
+
+        changed = before != self.to_dict()
+        if changed:
+            self.decisions.clear()
+        return changed
+
+    def __call__(self, code: CodeType) -> bool:
+        # keyed by id, the entry keeps the code object alive so the id is never reused
+        if (entry := self.decisions.get(id(code))) is not None:
+            return entry[1]
+        decision = self._decide(code)
+        self.decisions[id(code)] = (code, decision)
+        return decision
+
+    def _decide(self, code: CodeType) -> bool:
+        if code.co_filename not in self.paths:
+            return False
+
+        path = Path(code.co_filename)
+        modules = {path.name, path.stem}
+        if self.include_modules and not modules & self.include_modules:
+            return False
+        if modules & self.exclude_modules:
+            return False
+
+        functions = {code.co_name, getattr(code, 'co_qualname', code.co_name)}
+        if self.include_functions and not functions & self.include_functions:
+            return False
+        if functions & self.exclude_functions:
+            return False
+
+        return True
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import ctypes
+import os
+import signal
+from collections.abc import Callable
+from pathlib import Path
+from time import sleep
+
+from utils.branches import on_path
+from utils.internal_file_communication import ifc
+
+PR_SET_CHILD_SUBREAPER = 36
+
+def become_subreaper() -> None:
+    # parked copies are double-forked, so they are re-parented here instead of to init
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def wait_for(pid: int) -> None:
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        # re-parented to another subreaper (e.g. criu restore), all that is left is polling
+        while pid_alive(pid):
+            sleep(.05)
+
+    # parked copies that exited in the meantime
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+class WarmPool:
+    # forked copies of the tracer parked at earlier timeline ids; resuming one replaces a CRIU restore
+    def __init__(self, registry: str, channel_dir: Path, before_fork: Callable[[], None], size: int = 8,
+                 record: Callable[[int, int, int | None], None] | None = None):
+        self.registry = registry       # IFC channel listing {"timeline_id", "branch_id", "pid"}, oldest use first
+        self.channel_dir = channel_dir
+        self.before_fork = before_fork # nothing open may be shared with a copy: db, IFC, pending output
+        self.size = size
+        self.record = record           # (timeline_id, branch_id, pid) of a step gaining a copy, pid None when it loses it
+        self.watcher_pid = None
+        self.last_parked = None        # pid of the copy the last park() in the caller left behind
+
+    def channel(self, pid: int) -> str:
+        return str(self.channel_dir / f'_snapshot_{pid}.txt')
+
+    def orphaned(self) -> bool:
+        # the watcher is gone (the session was evicted), nothing is left to resume this process
+        return self.watcher_pid is not None and not pid_alive(self.watcher_pid)
+
+    def entries(self) -> list[dict]:
+        return [entry for entry in ifc.read(self.registry) if pid_alive(entry['pid'])]
+
+    def _store(self, entries: list[dict], parked: dict | None = None) -> None:
+        # least recently used goes first; never the copy just parked, and while there is room for more
+        # than one, not the earliest step either: replaying from it reaches any target
+        size = max(self.size, 1)
+        while len(entries) > size:
+            kept = [parked]
+            if size > 1:
+                kept.append(min(entries, key=lambda entry: entry['timeline_id']))
+            evicted = next(entry for entry in entries if not any(entry is other for other in kept))
+            entries.remove(evicted)
+            self.kill(evicted)
+        ifc.replace(self.registry, entries)
+
+    def _recorded(self, entry: dict, pid: int | None) -> None:
+        if self.record is not None:
+            self.record(entry['timeline_id'], entry.get('branch_id', 0), pid)
+
+    def kill(self, entry: dict) -> None:
+        self._recorded(entry, None)
+        try:
+            os.kill(entry['pid'], signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def clear(self) -> None:
+        for entry in ifc.read(self.registry):
+            self.kill(entry)
+        ifc.replace(self.registry, [])
+
+    def drop_before(self, timeline_id: int, path: list[tuple[int, int, int]] | None = None) -> None:
+        # copies on other branches than path stay, their own steps are not pruned
+        entries = []
+        for entry in self.entries():
+            if entry['timeline_id'] < timeline_id and (path is None or on_path(path, entry.get('branch_id', 0), entry['timeline_id'])):
+                self.kill(entry)
+            else:
+                entries.append(entry)
+        ifc.replace(self.registry, entries)
+
+    def _park(self, timeline_id: int, branch_id: int) -> int | None:
+        self.before_fork()
+
+        read_fd, write_fd = os.pipe()
+
+        if pid := os.fork():
+            os.close(write_fd)
+            os.waitpid(pid, 0)
+            with os.fdopen(read_fd) as pipe:
+                parked_pid = int(pipe.read() or 0)
+            self.last_parked = parked_pid or None
+            if parked_pid:
+                entries = []
+                for entry in self.entries():
+                    if entry['timeline_id'] == timeline_id and entry.get('branch_id', 0) == branch_id:
+                        self.kill(entry) # replaced by the newer copy of the same step
+                    else:
+                        entries.append(entry)
+                parked = {"timeline_id": timeline_id, "branch_id": branch_id, "pid": parked_pid}
+                entries.append(parked)
+                self._store(entries, parked)
+                self._recorded(parked, parked_pid)
+            return None
+
+        os.close(read_fd)
+        if os.fork():
+            os._exit(0)
+
+        os.write(write_fd, str(os.getpid()).encode())
+        os.close(write_fd)
+
+        channel = self.channel(os.getpid())
+        while True:
+            if self.orphaned():
+                os._exit(0)
+            for message in ifc.pop(channel, timeout=1):
+                return int(message['timeline_id'])
+
+    def park(self, timeline_id: int, branch_id: int = 0) -> int | None:
+        # None in the caller; in a parked copy, once resumed, the timeline id to replay up to
+        self.last_parked = None
+        if not self.size:
+            return None
+
+        target = self._park(timeline_id, branch_id)
+        resumed_to = target
+        while resumed_to is not None:
+            # a resumed copy leaves a replacement behind, so this step stays warm
+            target = resumed_to
+            resumed_to = self._park(timeline_id, branch_id)
+        return target
+
+    def nearest(self, timeline_id: int, path: list[tuple[int, int, int]] | None = None) -> dict | None:
+        # only copies whose step lies on path can replay forward along it
+        candidates = [
+            entry for entry in self.entries()
+            if entry['timeline_id'] <= timeline_id and (path is None or on_path(path, entry.get('branch_id', 0), entry['timeline_id']))
+        ]
+        return max(candidates, key=lambda entry: entry['timeline_id'], default=None)
+
+    def resume(self, entry: dict, timeline_id: int) -> None:
+        # the resumed copy parks a replacement at its step before it runs on
+        self._recorded(entry, None)
+        self._store([other for other in self.entries() if other['pid'] != entry['pid']])
+        ifc.append(self.channel(entry['pid']), {"timeline_id": timeline_id})
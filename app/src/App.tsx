@@ -13,7 +13,7 @@ import { CodeNode } from './CodeNode';
 import { NodeContext } from './NodeContext';
 import { Background } from './ui/Background';
 import { useWebSocket } from './useWebSocket';
-import { server_uri } from './config';
+import { api_uri } from './config';
 import { JsonInspectorPanel, TerminalEntry } from './JsonInspectorPanel';
 import { DebuggerStateContext } from './DebuggerStateContext';
 
@@ -41,64 +41,6 @@ function updateNodeCode(nodes, nodeId, newCode) {
   });
 }
 
-function parsePythonDict(str: string) {
-  if (!str || str === '{}') return {};
-  try {
-    return JSON.parse(str.replace(/'/g, '"'));
-  } catch {
-    return {};
-  }
-}
-
-function applyDiff(target: Record<string, any>, diffStr: string) {
-  const diff = parsePythonDict(diffStr);
-
-  // WE NEED TO ACCOUNT FOR FRAMES HERE AS WELL, BUT FOR NOW - IDC
-
-  for (const key of Object.keys(diff)) {
-    if (diff[key] === '<deleted>') {
-      delete target[key];
-    } else {
-      target[key] = diff[key];
-    }
-  }
-}
-
-function buildCurrentScope(timeline: any[], timelineIndex: number | null) {
-  if (timelineIndex == null || timelineIndex < 0) return null;
-
-  const scope: any = {
-    event: null,
-    file: null,
-    function: null,
-    frame_id: null,
-    line_number: null,
-    globals: {},
-    locals: {},
-    return_value: null,
-    error: null,
-  };
-
-  for (let i = 0; i <= timelineIndex && i < timeline.length; i++) {
-    const e = timeline[i];
-    if (!e) continue;
-
-    scope.event = e.event;
-    scope.file = e.file;
-    scope.function = e.function;
-    scope.frame_id = e.frame_id;
-    scope.line_number = e.line_number;
-
-    applyDiff(scope.globals, e.global_diff);
-    applyDiff(scope.locals, e.local_diff);
-
-    if (e.return_value != null) scope.return_value = e.return_value;
-    if (e.error != null) scope.error = e.error;
-  }
-
-  return scope;
-}
-
 export default function App() {
   const inputMethod = ['touch', 'mouse'][0];
 
@@ -109,15 +51,33 @@ export default function App() {
   const [timelineIndex, setTimelineIndex] = useState<number | null>(null);
   const [fileImported, setFileImported] = useState(true);
   const [waitingForResponse, setWaitingForResponse] = useState(false);
+  const [breakpoints, setBreakpoints] = useState<number[]>([]);
 
   const timelineRefs = useRef<(HTMLDivElement | null)[]>([]);
 
   const [terminalEntries, setTerminalEntries] = useState<TerminalEntry[]>([]);
 
-  const debuggerState = useMemo(
-    () => buildCurrentScope(timelineEntries, timelineIndex),
-    [timelineEntries, timelineIndex]
-  );
+  const [debuggerState, setDebuggerState] = useState(null);
+
+  // the server rebuilds the scope from its nearest keyframe instead of replaying every diff here
+  useEffect(() => {
+    if (timelineIndex == null || timelineIndex < 0) {
+      setDebuggerState(null);
+      return;
+    }
+
+    let cancelled = false;
+    fetch(`http${api_uri}/scope?timeline_id=${timelineIndex}`)
+      .then((res) => (res.ok ? res.json() : null))
+      .then((scope) => {
+        if (!cancelled) setDebuggerState(scope);
+      })
+      .catch(() => {});
+
+    return () => {
+      cancelled = true;
+    };
+  }, [timelineIndex, timelineEntries[timelineIndex ?? -1]]);
 
   const messageReceived = (jsonString) => {
     if (!jsonString) return;
@@ -185,7 +145,7 @@ export default function App() {
     }
   };
 
-  const { send, isConnected } = useWebSocket(`ws${server_uri}/api/ws`, messageReceived);
+  const { send, isConnected } = useWebSocket(`ws${api_uri}/ws`, messageReceived);
 
   const sendStdin = useCallback(
     (text: string) => {
@@ -203,6 +163,22 @@ export default function App() {
     [send]
   );
 
+  const toggleBreakpoint = useCallback(
+    (lineno: number) => {
+      setBreakpoints((prev) => {
+        const next = prev.includes(lineno)
+          ? prev.filter((line) => line !== lineno)
+          : [...prev, lineno];
+        send(JSON.stringify({
+          type: 'set_breakpoints',
+          breakpoints: next.map((line) => ({ file: 'main.py', line })),
+        }));
+        return next;
+      });
+    },
+    [send]
+  );
+
   // ================= NODE TYPES =================
   const nodeTypes = useMemo(
     () => ({
@@ -223,17 +199,55 @@ export default function App() {
   );
 
   // ================= SYNC FUNCTIONS =================
+  // after a rewind the terminal shows exactly what had been printed up to that step
+  const fetchConsole = async (timelineId: number) => {
+    const res = await fetch(`http${api_uri}/console?timeline_id=${timelineId}`);
+    if (!res.ok) return;
+    const chunks: [TerminalEntry['stream'], string][] = await res.json();
+    setTerminalEntries(chunks.map(([stream, text]) => ({ stream, text, flushed: true })));
+  };
+
   const handleSync = (data) => {
     setNodes(data.nodes);
     setNodeIndex(data.node_id?.toString() || null);
-    setTimelineEntries(data.timeline || []);
+    setTimelineEntries((prev) => {
+      if (data.timeline_id == null) return [];
+      // rows up to after_id are already here, anything past timeline_id is a stale future
+      const next = prev.slice(0, (data.after_id ?? -1) + 1);
+      for (const row of data.timeline || []) next[row.id] = row;
+      next.length = data.timeline_id + 1;
+      return next;
+    });
     setTimelineIndex(data.timeline_id || null);
+    setBreakpoints((data.breakpoints || []).filter((b) => b.line != null).map((b) => b.line));
+    if (data.timeline_id != null) fetchConsole(data.timeline_id).catch(() => {});
+  };
+
+  const fetchTimeline = async (afterId: number) => {
+    const limit = 5000;
+    for (;;) {
+      const res = await fetch(`http${api_uri}/timeline?after_id=${afterId}&limit=${limit}`);
+      const text = await res.text();
+      const rows = text.split('\n').filter(Boolean).map((line) => JSON.parse(line));
+      if (!rows.length) return;
+
+      setTimelineEntries((prev) => {
+        const next = [...prev];
+        for (const row of rows) next[row.id] = row;
+        return next;
+      });
+
+      afterId = rows[rows.length - 1].id;
+      if (rows.length < limit) return;
+    }
   };
 
   const syncFromServer = async () => {
-    const res = await fetch(`http${server_uri}/api/sync`);
+    const res = await fetch(`http${api_uri}/sync?limit=0`);
     const data = await res.json();
-    handleSync(data);
+    setTimelineEntries([]);
+    handleSync({ ...data, after_id: -1 });
+    if (data.timeline_id != null) await fetchTimeline(-1);
   };
 
   useEffect(() => {
@@ -259,7 +273,20 @@ export default function App() {
       const node = prev[idx];
       return [
         ...prev.slice(0, idx),
-        { ...node, data: { ...node.data, framePointer: data.frame_id } },
+        {
+          ...node,
+          data: {
+            ...node.data,
+            framePointer: data.frame_id,
+            // replayed events were counted already
+            ...(data.id > (node.data.lastTimelineId ?? -1) && {
+              hits: (node.data.hits ?? 0) + (data.event === 'line' ? 1 : 0),
+              exceptions: (node.data.exceptions ?? 0) + (data.event === 'exception' ? 1 : 0),
+              firstTimelineId: node.data.firstTimelineId ?? data.id,
+              lastTimelineId: data.id,
+            }),
+          },
+        },
         ...prev.slice(idx + 1),
       ];
     });
@@ -293,7 +320,7 @@ export default function App() {
       <Background />
 
       <DebuggerStateContext.Provider value={debuggerState}>
-        <NodeContext.Provider value={{ nodeIndex, setNodeIndex }}>
+        <NodeContext.Provider value={{ nodeIndex, setNodeIndex, breakpoints, toggleBreakpoint }}>
           <div className="flex-1 relative z-20 w-full">
             <ReactFlow
               nodes={nodes}
@@ -344,7 +371,7 @@ export default function App() {
                   className={`flex flex-col items-center flex-none w-8 mx-1 cursor-pointer transition-all duration-300
                   ${isSelected ? 'bg-yellow-400 border-yellow-600' : 'bg-gray-400/50 border-gray-600'}
                   rounded-full border-2 h-8`}
-                  title={`Timeline index: ${idx}, Line: ${record.line_number}`}
+                  title={`Timeline index: ${idx}, Line: ${record?.line_number}`}
                 >
                   <span className="text-xs text-white mt-1 font-bold">{label}</span>
                 </div>
@@ -6,12 +6,13 @@ import { NodeContext } from './NodeContext';
 import 'prismjs/themes/prism-tomorrow.css';
 
 export function CodeNode({ id, data, send }: any) {
-  const { nodeIndex } = useContext(NodeContext);
+  const { nodeIndex, breakpoints, toggleBreakpoint } = useContext(NodeContext);
   const [code, setCode] = useState(data.source_segment);
 
   useEffect(() => setCode(data.source_segment), [data.source_segment]);
 
   const highlighted = id === nodeIndex;
+  const hasBreakpoint = breakpoints.includes(Number(id));
 
   const handleChange = (newCode: string) => {
     setCode(newCode);
@@ -28,6 +29,21 @@ export function CodeNode({ id, data, send }: any) {
 
   return (
     <div style={{ position: 'relative', display: 'inline-block' }}>
+      <div
+        onClick={() => toggleBreakpoint(Number(id))}
+        title="Toggle breakpoint"
+        style={{
+          position: 'absolute',
+          left: -14,
+          top: 10,
+          width: 10,
+          height: 10,
+          borderRadius: '50%',
+          cursor: 'pointer',
+          background: hasBreakpoint ? '#e51400' : 'transparent',
+          border: '1px solid #e51400',
+        }}
+      />
       {data.framePointer && (
         <div
           style={{
@@ -43,6 +59,7 @@ export function CodeNode({ id, data, send }: any) {
           }}
         >
           {data.framePointer} · {id}
+          {data.hits > 0 && ` · ${data.hits}×`}
         </div>
       )}
       <Editor
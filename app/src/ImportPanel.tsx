@@ -2,7 +2,7 @@
 import { useReactFlow, Panel } from '@xyflow/react'
 import { useState, useRef } from 'react'
 import { PanelButton } from './ui/PanelButton'
-import { server_uri } from './config'
+import { api_uri } from './config'
 
 export function ImportPanel({ setFileImported }: { setFileImported: (v: boolean) => void }) {
   const [loading, setLoading] = useState(false)
@@ -14,7 +14,7 @@ export function ImportPanel({ setFileImported }: { setFileImported: (v: boolean)
       const formData = new FormData()
       formData.append('file', file)
 
-      const response = await fetch(`http${server_uri}/api/upload`, {
+      const response = await fetch(`http${api_uri}/upload`, {
         method: 'POST',
         body: formData,
       })
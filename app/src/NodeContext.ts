@@ -3,6 +3,8 @@ import { createContext } from "react";
 export type NodeContextType = {
   nodeIndex: string | null;
   setNodeIndex: React.Dispatch<React.SetStateAction<string | null>>;
+  breakpoints: number[];
+  toggleBreakpoint: (lineno: number) => void;
 };
 
 export const NodeContext = createContext<NodeContextType | undefined>(
@@ -22,6 +22,17 @@ export function WebSocketPanel({ send, show, waiting, setWaiting }: WebSocketPan
       >
         {"CONTINUE"}
       </PanelButton>
+      <PanelButton
+        onClick={() => {
+          setWaiting(true);
+          setTimeout(() => setWaiting(false), 2000);
+          send?.(JSON.stringify({ type: 'continue', mode: 'run' }));
+        }}
+        disabled={!send || waiting}
+        style={{ marginBottom: 8, opacity: waiting ? 0.5 : 1 }}
+      >
+        {"RUN"}
+      </PanelButton>
     </Panel>
   );
 }
@@ -1 +1,6 @@
 export const server_uri = `${location.protocol.includes("https") ? "s" : ""}://${location.host}`;
+
+// each browser tab debugs one session, picked with ?session=<id>
+export const session_id = new URLSearchParams(location.search).get("session") || "default";
+
+export const api_uri = `${server_uri}/api/sessions/${encodeURIComponent(session_id)}`;